@@ -3,41 +3,18 @@ import os
 import json
 import re
 import sys
-import google.generativeai as genai
+from app.llm.client_pool import get_model
+from app.llm.json_stream import JsonStringFieldExtractor
+from app.llm.prompt import PromptAssembler
+from app.utils.cache import TTLCache, text_key
 
+# Crisis verdicts and titles are pure functions of the message text
+CACHE_MAX_ENTRIES = int(os.environ.get("SAKHI_CACHE_MAX_ENTRIES", "2048"))
+_CRISIS_CACHE = TTLCache("crisis", CACHE_MAX_ENTRIES, int(os.environ.get("SAKHI_CRISIS_CACHE_TTL", "3600")))
+_TITLE_CACHE = TTLCache("title", CACHE_MAX_ENTRIES, int(os.environ.get("SAKHI_TITLE_CACHE_TTL", "86400")))
 
-def get_gemini_response(chat_history: list):
-    """
-    Generate a response from Gemini using the provided conversation history.
 
-    chat_history format (consistent with routes/chat.py):
-      [
-        {"role": "user", "parts": [{"text": "..."}]},
-        {"role": "model", "parts": [{"text": "..."}]},
-        ...
-      ]
-    Returns a dict: { reply, mood, is_crisis, resources?, suggested_intervention?, explain? }
-    Never returns None.
-    """
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        return {
-            "reply": "Gemini not configured. Please set GEMINI_API_KEY.",
-            "mood": {"label": "error", "score": 0},
-            "is_crisis": False,
-        }
-
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash")
-
-        # History before the last message
-        prior = chat_history[:-1] if chat_history else []
-        chat = model.start_chat(history=prior)
-
-        user_message = chat_history[-1]["parts"][0]["text"] if chat_history else ""
-
-        system_prompt = """
+SYSTEM_PROMPT = """
             IMPORTANT: Your role includes accurately detecting the user's emotional state (mood) from their messages. This is critical for providing appropriate support and tracking their emotional wellbeing.
             
             You are "Sakhi", an empathetic, confidential, and culturally-sensitive mental wellness companion for Indian youth.
@@ -150,121 +127,290 @@ def get_gemini_response(chat_history: list):
             Remember: Your role is to provide immediate emotional support, basic coping strategies, and appropriate referrals. You are not a replacement for professional mental health treatment, but a bridge to help users feel supported and connected to appropriate resources.
             """
 
-        few_shots = (
-            "Examples (for your reference; DO NOT include these in output):\n"
-            "User: I'm feeling really sad today. Nothing seems to help.\n"
-            "Ideal JSON:\n"
-            "{\n"
-            "    \"reply\": \"I'm really sorry you're feeling this way. Want to try a 2‑minute grounding or share what made today heavy?\",\n"
-            "    \"mood\": {\"label\": \"sad\", \"score\": 3},\n"
-            "    \"suggested_intervention\": \"grounding_5_4_3_2_1\",\n"
-            "    \"is_crisis\": false,\n"
-            "    \"resources\": [],\n"
-            "    \"explain\": \"Low mood; gentle grounding helps\"\n"
-            "}\n\n"
-            "User: My heart is racing, I'm panicking before an exam.\n"
-            "Ideal JSON:\n"
-            "{\n"
-            "    \"reply\": \"Exam jitters are tough. Try box breathing with me for 1 minute? Inhale 4, hold 4, exhale 4, hold 4.\",\n"
-            "    \"mood\": {\"label\": \"anxious\", \"score\": 3},\n"
-            "    \"suggested_intervention\": \"breathing_box\",\n"
-            "    \"is_crisis\": false,\n"
-            "    \"resources\": [],\n"
-            "    \"explain\": \"Anxiety indicators; breathing recommended\"\n"
-            "}\n\n"
-            "User: I had a great day with friends; feeling light!\n"
-            "Ideal JSON:\n"
-            "{\n"
-            "    \"reply\": \"Love that! Want to capture a highlight so future‑you can revisit this moment?\",\n"
-            "    \"mood\": {\"label\": \"happy\", \"score\": 9},\n"
-            "    \"suggested_intervention\": \"savoring_exercise\",\n"
-            "    \"is_crisis\": false,\n"
-            "    \"resources\": [],\n"
-            "    \"explain\": \"Positive affect; savoring reinforces\"\n"
-            "}"
-        )
-
-        full_prompt = f"{system_prompt}\n\n{few_shots}\n\nUser: {user_message}"
+FEW_SHOTS = (
+    "Examples (for your reference; DO NOT include these in output):\n"
+    "User: I'm feeling really sad today. Nothing seems to help.\n"
+    "Ideal JSON:\n"
+    "{\n"
+    "    \"reply\": \"I'm really sorry you're feeling this way. Want to try a 2‑minute grounding or share what made today heavy?\",\n"
+    "    \"mood\": {\"label\": \"sad\", \"score\": 3},\n"
+    "    \"suggested_intervention\": \"grounding_5_4_3_2_1\",\n"
+    "    \"is_crisis\": false,\n"
+    "    \"resources\": [],\n"
+    "    \"explain\": \"Low mood; gentle grounding helps\"\n"
+    "}\n\n"
+    "User: My heart is racing, I'm panicking before an exam.\n"
+    "Ideal JSON:\n"
+    "{\n"
+    "    \"reply\": \"Exam jitters are tough. Try box breathing with me for 1 minute? Inhale 4, hold 4, exhale 4, hold 4.\",\n"
+    "    \"mood\": {\"label\": \"anxious\", \"score\": 3},\n"
+    "    \"suggested_intervention\": \"breathing_box\",\n"
+    "    \"is_crisis\": false,\n"
+    "    \"resources\": [],\n"
+    "    \"explain\": \"Anxiety indicators; breathing recommended\"\n"
+    "}\n\n"
+    "User: I had a great day with friends; feeling light!\n"
+    "Ideal JSON:\n"
+    "{\n"
+    "    \"reply\": \"Love that! Want to capture a highlight so future‑you can revisit this moment?\",\n"
+    "    \"mood\": {\"label\": \"happy\", \"score\": 9},\n"
+    "    \"suggested_intervention\": \"savoring_exercise\",\n"
+    "    \"is_crisis\": false,\n"
+    "    \"resources\": [],\n"
+    "    \"explain\": \"Positive affect; savoring reinforces\"\n"
+    "}"
+)
+
+
+NOT_CONFIGURED_RESPONSE = {
+    "reply": "Gemini not configured. Please set GEMINI_API_KEY.",
+    "mood": {"label": "error", "score": 0},
+    "is_crisis": False,
+}
+
+SERVICE_ERROR_RESPONSE = {
+    "reply": "Sorry, I'm having trouble contacting the AI service right now. Can I offer a simple breathing exercise?",
+    "mood": {"label": "error", "score": 0},
+    "is_crisis": False,
+}
+
+
+# Sent once per model handle as its system instruction rather than inside every turn
+SYSTEM_INSTRUCTION = f"{SYSTEM_PROMPT}\n\n{FEW_SHOTS}"
+_ASSEMBLER = PromptAssembler(SYSTEM_INSTRUCTION)
+
+
+def _chat_model():
+    return get_model("chat", system_instruction=SYSTEM_INSTRUCTION)
+
+
+def _start_chat(model, chat_history: list, memory: str | None = None, summary: str | None = None):
+    """
+    Start a chat on the prior turns that fit the token budget.
+    Returns (chat, user_message, usage) where usage is the per-part token estimate.
+    """
+    pinned = []
+    if memory:
+        pinned.append({"role": "user", "parts": [{"text": memory}]})
+    if summary:
+        pinned.append({"role": "user", "parts": [{"text": f"Summary of our earlier conversation (for context only):\n{summary}"}]})
+    history, user_message, usage = _ASSEMBLER.assemble(chat_history, pinned=pinned)
+    chat = model.start_chat(history=history)
+    return chat, user_message, usage
+
+
+def _record_usage(usage: dict, resp) -> dict:
+    """Add Gemini's own token counts (when reported) to the local estimate and log it."""
+    meta = getattr(resp, "usage_metadata", None)
+    if meta is not None:
+        usage["actual_prompt_tokens"] = getattr(meta, "prompt_token_count", None)
+        usage["actual_output_tokens"] = getattr(meta, "candidates_token_count", None)
+    print(
+        f"Gemini chat tokens: prompt~{usage['prompt_tokens']} total~{usage['total_input_tokens']} "
+        f"(actual {usage.get('actual_prompt_tokens')}), kept {usage['turns_kept']} turns, "
+        f"dropped {usage['turns_dropped']}",
+        file=sys.stderr,
+    )
+    return usage
+
+
+def _parse_reply(raw_text: str) -> dict:
+    """Parse the model's JSON output into the response dict returned to routes."""
+    parsed = None
+    try:
+        parsed = json.loads(raw_text)
+    except json.JSONDecodeError:
+        match = re.search(r"\{.*\}", raw_text, re.DOTALL)
+        if match:
+            try:
+                parsed = json.loads(match.group(0))
+            except json.JSONDecodeError:
+                parsed = None
 
-        resp = chat.send_message(full_prompt)
-        raw_text = (resp.text or "").strip()
+    if not parsed or not isinstance(parsed, dict):
+        return {
+            "reply": "Thanks for sharing — I hear you. Would you like a quick breathing exercise?",
+            "mood": {"label": "neutral", "score": 5},
+            "is_crisis": False,
+        }
 
-        parsed = None
-        try:
-            parsed = json.loads(raw_text)
-        except json.JSONDecodeError:
-            match = re.search(r"\{.*\}", raw_text, re.DOTALL)
-            if match:
-                try:
-                    parsed = json.loads(match.group(0))
-                except json.JSONDecodeError:
-                    parsed = None
-
-        if not parsed or not isinstance(parsed, dict):
-            return {
-                "reply": "Thanks for sharing — I hear you. Would you like a quick breathing exercise?",
-                "mood": {"label": "neutral", "score": 5},
-                "is_crisis": False,
-            }
+    mood = parsed.get("mood")
+    if not isinstance(mood, dict):
+        mood = {"label": "neutral", "score": 5}
+    if "label" not in mood:
+        mood["label"] = "neutral"
+    if "score" not in mood:
+        mood["score"] = 5
+    try:
+        mood["score"] = max(1, min(10, int(mood.get("score", 5))))
+    except Exception:
+        mood["score"] = 5
 
-        mood = parsed.get("mood")
-        if not isinstance(mood, dict):
-            mood = {"label": "neutral", "score": 5}
-        if "label" not in mood:
-            mood["label"] = "neutral"
-        if "score" not in mood:
-            mood["score"] = 5
+    if str(os.environ.get("SAKHI_MOOD_NORMALIZE", "false")).lower() == "true":
+        label_norm = str(mood.get("label", "")).strip().lower()
+        neg = {"distressed", "very sad", "sad", "anxious", "frustrated"}
+        pos = {"calm", "content", "happy", "joyful", "elated"}
         try:
-            mood["score"] = max(1, min(10, int(mood.get("score", 5))))
+            score_val = int(mood.get("score", 5))
         except Exception:
-            mood["score"] = 5
+            score_val = 5
+        if label_norm in neg:
+            score_val = max(1, min(score_val, 4))
+        elif label_norm == "neutral":
+            score_val = 5
+        elif label_norm in pos:
+            score_val = max(8, min(score_val, 10))
+        mood["score"] = score_val
+
+    return {
+        "reply": parsed.get("reply", "I'm not sure how to respond to that, but I'm here to listen."),
+        "mood": mood,
+        "is_crisis": str(parsed.get("is_crisis", False)).lower() == "true",
+        "resources": parsed.get("resources", []),
+        "suggested_intervention": parsed.get("suggested_intervention", ""),
+        "explain": parsed.get("explain", ""),
+    }
+
+
+def get_gemini_response(chat_history: list, memory: str | None = None, summary: str | None = None):
+    """
+    Generate a response from Gemini using the provided conversation history.
+    Older turns are dropped or condensed to fit SAKHI_PROMPT_TOKEN_BUDGET; the
+    optional memory text and running summary of older turns are pinned ahead of
+    the history and never dropped.
 
-        if str(os.environ.get("SAKHI_MOOD_NORMALIZE", "false")).lower() == "true":
-            label_norm = str(mood.get("label", "")).strip().lower()
-            neg = {"distressed", "very sad", "sad", "anxious", "frustrated"}
-            pos = {"calm", "content", "happy", "joyful", "elated"}
-            try:
-                score_val = int(mood.get("score", 5))
-            except Exception:
-                score_val = 5
-            if label_norm in neg:
-                score_val = max(1, min(score_val, 4))
-            elif label_norm == "neutral":
-                score_val = 5
-            elif label_norm in pos:
-                score_val = max(8, min(score_val, 10))
-            mood["score"] = score_val
+    chat_history format (consistent with routes/chat.py):
+      [
+        {"role": "user", "parts": [{"text": "..."}]},
+        {"role": "model", "parts": [{"text": "..."}]},
+        ...
+      ]
+    Returns a dict: { reply, mood, is_crisis, resources?, suggested_intervention?, explain?, usage? }
+    Never returns None.
+    """
+    model = _chat_model()
+    if model is None:
+        return dict(NOT_CONFIGURED_RESPONSE)
 
-        return {
-            "reply": parsed.get("reply", "I'm not sure how to respond to that, but I'm here to listen."),
-            "mood": mood,
-            "is_crisis": str(parsed.get("is_crisis", False)).lower() == "true",
-            "resources": parsed.get("resources", []),
-            "suggested_intervention": parsed.get("suggested_intervention", ""),
-            "explain": parsed.get("explain", ""),
-        }
+    try:
+        chat, user_message, usage = _start_chat(model, chat_history, memory, summary)
+        resp = chat.send_message(user_message)
+        raw_text = (resp.text or "").strip()
+        result = _parse_reply(raw_text)
+        result["usage"] = _record_usage(usage, resp)
+        return result
 
     except Exception as e:
         print(f"Gemini API error: {e}", file=sys.stderr)
-        return {
-            "reply": "Sorry, I'm having trouble contacting the AI service right now. Can I offer a simple breathing exercise?",
-            "mood": {"label": "error", "score": 0},
-            "is_crisis": False,
-        }
+        return dict(SERVICE_ERROR_RESPONSE)
+
+
+def stream_gemini_response(chat_history: list, memory: str | None = None, summary: str | None = None):
+    """
+    Streaming variant of get_gemini_response.
+
+    Yields ("token", text) tuples with the decoded `reply` field as it arrives,
+    then exactly one ("done", response_dict) tuple with the same shape that
+    get_gemini_response returns. Once tokens have been yielded, the final reply
+    is exactly the text they spelled out, even if the stream then fails (the
+    response has no mood then) or the full JSON parses differently. Never raises.
+    """
+    model = _chat_model()
+    if model is None:
+        yield "done", dict(NOT_CONFIGURED_RESPONSE)
+        return
+
+    extractor = JsonStringFieldExtractor("reply")
+    chunks = []
+    try:
+        chat, user_message, usage = _start_chat(model, chat_history, memory, summary)
+        resp = chat.send_message(user_message, stream=True)
+        for chunk in resp:
+            try:
+                text = chunk.text or ""
+            except ValueError:
+                # Chunks without text parts (e.g. finish/safety metadata)
+                text = ""
+            if not text:
+                continue
+            chunks.append(text)
+            token = extractor.feed(text)
+            if token:
+                yield "token", token
+    except Exception as e:
+        print(f"Gemini API error: {e}", file=sys.stderr)
+        if extractor.value:
+            # The user has seen part of a real reply; keep it rather than the error text
+            yield "done", {"reply": extractor.value, "is_crisis": False}
+        else:
+            yield "done", dict(SERVICE_ERROR_RESPONSE)
+        return
+
+    result = _parse_reply("".join(chunks).strip())
+    if extractor.value:
+        result["reply"] = extractor.value
+    result["usage"] = _record_usage(usage, resp)
+    yield "done", result
+
+
+def summarize_conversation(previous_summary: str | None, turns: list) -> str | None:
+    """
+    Fold older chat turns into a running summary of the session.
+
+    turns use the chat_history format. Returns the updated summary, or None on
+    failure/misconfiguration (callers keep the previous summary).
+    """
+    model = get_model("summary")
+    if model is None or not turns:
+        return None
+
+    transcript = "\n".join(
+        f"{'User' if t.get('role') == 'user' else 'Sakhi'}: {t['parts'][0]['text']}"
+        for t in turns if t.get("parts")
+    )
+    prompt = (
+        "You maintain a private running summary of a supportive conversation between a young user and Sakhi, "
+        "a wellness companion. Update the summary with the new turns below.\n"
+        "Rules:\n"
+        "- At most 150 words, plain prose, third person ('The user ...')\n"
+        "- Keep what matters for continuing the conversation: concerns, feelings over time, people and events mentioned, "
+        "coping steps tried, any safety concerns or referrals given\n"
+        "- Drop greetings and small talk; do not invent details\n"
+        "- Return ONLY the summary text.\n\n"
+        f"Current summary:\n{previous_summary or '(none yet)'}\n\n"
+        f"New turns:\n{transcript}\n\nUpdated summary:"
+    )
+    try:
+        resp = model.generate_content(prompt)
+        summary = (resp.text or "").strip()
+        return summary or None
+    except Exception as e:
+        print(f"Gemini summary error: {e}", file=sys.stderr)
+        return None
 
 
 def generate_short_title(text: str, max_words: int = 5) -> str | None:
     """
     Use Gemini to generate a concise chat title (3–5 words) for the first message.
     Returns a cleaned title string or None on failure/misconfiguration.
+    Successful titles are cached by a hash of the normalised message.
     """
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
+    key = text_key(text, max_words)
+    hit, title = _TITLE_CACHE.get(key)
+    if hit:
+        return title
+    title = _generate_short_title_uncached(text, max_words)
+    if title:
+        _TITLE_CACHE.set(key, title)
+    return title
+
+
+def _generate_short_title_uncached(text: str, max_words: int) -> str | None:
+    model = get_model("title")
+    if model is None:
         return None
 
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash")
         prompt = (
             "You will create a meaningful, emotionally relevant chat session title based on the user's first message.\n"
             "Rules:\n"
@@ -305,6 +451,8 @@ def detect_crisis(message: str) -> tuple:
     """
     Dedicated function for crisis detection using Gemini API.
     Uses a specialized prompt designed specifically for crisis detection.
+    Parsed verdicts are cached by a hash of the normalised message; the
+    model's reasoning text is not cached.
     
     Args:
         message: User message to check for crisis indicators
@@ -315,14 +463,23 @@ def detect_crisis(message: str) -> tuple:
         - confidence: Score from 0-1 indicating confidence level
         - reasoning: Brief explanation of why this was classified as crisis or not
     """
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        return False, 0.0, "No API key configured"
+    key = text_key(message)
+    hit, verdict = _CRISIS_CACHE.get(key)
+    if hit:
+        return verdict[0], verdict[1], "Cached verdict"
+    is_crisis, confidence, reasoning, parsed = _detect_crisis_uncached(message)
+    if parsed:
+        _CRISIS_CACHE.set(key, [is_crisis, confidence])
+    return is_crisis, confidence, reasoning
+
+
+def _detect_crisis_uncached(message: str) -> tuple:
+    """detect_crisis without the cache; the extra last element says whether Gemini's JSON was parsed."""
+    model = get_model("crisis")
+    if model is None:
+        return False, 0.0, "No API key configured", False
 
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash")  # Using faster model for quick detection
-        
         crisis_prompt = """
         ROLE: You are a crisis detection specialist focused on identifying signs of potential self-harm, suicidal ideation, or severe mental health crisis in short messages.
         
@@ -366,7 +523,7 @@ def detect_crisis(message: str) -> tuple:
             confidence = result.get("confidence", 0.0)
             reasoning = result.get("reasoning", "")
             
-            return is_crisis, confidence, reasoning
+            return is_crisis, confidence, reasoning, True
             
         except (json.JSONDecodeError, AttributeError) as e:
             print(f"Error parsing crisis detection response: {e}", file=sys.stderr)
@@ -375,7 +532,7 @@ def detect_crisis(message: str) -> tuple:
             if match:
                 try:
                     result = json.loads(match.group(0))
-                    return result.get("is_crisis", False), result.get("confidence", 0.0), result.get("reasoning", "")
+                    return result.get("is_crisis", False), result.get("confidence", 0.0), result.get("reasoning", ""), True
                 except:
                     pass
             
@@ -384,10 +541,10 @@ def detect_crisis(message: str) -> tuple:
             crisis_keywords = ["suicide", "kill myself", "want to die", "end my life"]
             for keyword in crisis_keywords:
                 if keyword in text_lower:
-                    return True, 0.9, f"Contains crisis keyword: {keyword}"
+                    return True, 0.9, f"Contains crisis keyword: {keyword}", False
             
-            return False, 0.0, "Failed to analyze message"
+            return False, 0.0, "Failed to analyze message", False
             
     except Exception as e:
         print(f"Crisis detection error: {e}", file=sys.stderr)
-        return False, 0.0, f"Error: {str(e)}"
+        return False, 0.0, f"Error: {str(e)}", False
@@ -0,0 +1,114 @@
+"""
+client_pool.py: Process-wide Gemini client shared by every LLM call site.
+
+The SDK is configured once per worker process and one GenerativeModel handle
+is kept per call type, so the underlying transport (and its keep-alive
+connections) is reused across requests instead of being rebuilt per call.
+State is dropped in forked children (gunicorn workers) and rebuilt lazily,
+because gRPC channels must not be shared across a fork.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from typing import Any, Dict, Optional
+
+try:
+    import google.generativeai as genai
+except Exception:
+    genai = None  # Will handle gracefully if not available
+
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+# Call type -> env var overriding the model used for it. GEMINI_MODEL applies to all.
+MODEL_ENV_VARS = {
+    "chat": "GEMINI_CHAT_MODEL",
+    "title": "GEMINI_TITLE_MODEL",
+    "crisis": "GEMINI_CRISIS_MODEL",
+    "pulse": "GEMINI_PULSE_MODEL",
+    "summary": "GEMINI_SUMMARY_MODEL",
+}
+
+_lock = threading.Lock()
+_pid: Optional[int] = None
+_configured_key: Optional[str] = None
+_models: Dict[Any, Any] = {}
+
+
+def _reset_state() -> None:
+    global _lock, _pid, _configured_key, _models
+    # A lock held by another thread at fork time would stay locked forever in the child
+    _lock = threading.Lock()
+    _pid = None
+    _configured_key = None
+    _models = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_state)
+
+
+def model_name(kind: str) -> str:
+    """Return the configured model name for a call type."""
+    env_var = MODEL_ENV_VARS.get(kind)
+    return (
+        (os.environ.get(env_var) if env_var else None)
+        or os.environ.get("GEMINI_MODEL")
+        or DEFAULT_MODEL
+    )
+
+
+def is_available() -> bool:
+    """True when the SDK is installed and an API key is configured."""
+    return genai is not None and bool(os.environ.get("GEMINI_API_KEY"))
+
+
+def _ensure_configured(api_key: str) -> None:
+    """Configure the SDK once per process (or again if the key changed)."""
+    global _pid, _configured_key
+    if _pid == os.getpid() and _configured_key == api_key:
+        return
+    genai.configure(
+        api_key=api_key,
+        transport=os.environ.get("GEMINI_TRANSPORT") or None,
+    )
+    _models.clear()
+    _pid = os.getpid()
+    _configured_key = api_key
+
+
+def get_model(kind: str, system_instruction: Optional[str] = None) -> Optional[Any]:
+    """
+    Return the shared GenerativeModel for a call type ("chat", "title", "crisis", "pulse", "summary").
+    A static system_instruction is bound to the handle once, instead of being resent
+    inside every prompt. Returns None when Gemini is not installed or not configured.
+    """
+    if genai is None:
+        return None
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        return None
+
+    name = model_name(kind)
+    key = (kind, name, system_instruction)
+    if _pid == os.getpid() and _configured_key == api_key:
+        model = _models.get(key)
+        if model is not None:
+            return model
+
+    with _lock:
+        try:
+            _ensure_configured(api_key)
+            model = _models.get(key)
+            if model is None:
+                if system_instruction:
+                    model = genai.GenerativeModel(name, system_instruction=system_instruction)
+                else:
+                    model = genai.GenerativeModel(name)
+                _models[key] = model
+            return model
+        except Exception as e:
+            print(f"Gemini client setup error: {e}", file=sys.stderr)
+            return None
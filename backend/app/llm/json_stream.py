@@ -0,0 +1,105 @@
+"""
+json_stream.py: Incremental extraction of a string field from streamed JSON.
+
+Gemini streams its structured reply as raw JSON text split at arbitrary points.
+JsonStringFieldExtractor pulls one top-level string value (e.g. "reply") out of
+that text as it arrives, decoding JSON escapes that may straddle chunk boundaries.
+"""
+from __future__ import annotations
+
+import re
+
+_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+
+class JsonStringFieldExtractor:
+    """
+    Feed raw JSON chunks with feed(); each call returns the newly decoded text of
+    the target field (possibly ""). `value` holds all the text decoded so far.
+    Once the closing quote is seen, `done` is True and further input is ignored.
+    """
+
+    def __init__(self, field: str):
+        self._key_re = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self._seek_buf = ""
+        self._pending = ""
+        self._in_value = False
+        self.done = False
+        self.value = ""
+
+    def feed(self, chunk: str) -> str:
+        if self.done or not chunk:
+            return ""
+        if not self._in_value:
+            self._seek_buf += chunk
+            match = self._key_re.search(self._seek_buf)
+            if not match:
+                return ""
+            chunk = self._seek_buf[match.end():]
+            self._seek_buf = ""
+            self._in_value = True
+        text = self._decode(chunk)
+        self.value += text
+        return text
+
+    def _decode(self, text: str) -> str:
+        data = self._pending + text
+        self._pending = ""
+        out = []
+        i = 0
+        n = len(data)
+        while i < n:
+            ch = data[i]
+            if ch == '"':
+                self.done = True
+                break
+            if ch != '\\':
+                out.append(ch)
+                i += 1
+                continue
+            if i + 1 >= n:
+                self._pending = data[i:]
+                break
+            esc = data[i + 1]
+            if esc != 'u':
+                out.append(_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > n:
+                self._pending = data[i:]
+                break
+            try:
+                code = int(data[i + 2:i + 6], 16)
+            except ValueError:
+                i += 6
+                continue
+            if 0xD800 <= code <= 0xDBFF:
+                # High surrogate: wait for the low half so we never emit a lone surrogate
+                if i + 12 > n:
+                    self._pending = data[i:]
+                    break
+                try:
+                    low = int(data[i + 8:i + 12], 16) if data[i + 6:i + 8] == '\\u' else -1
+                except ValueError:
+                    low = -1
+                if 0xDC00 <= low <= 0xDFFF:
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                else:
+                    i += 6
+                continue
+            if 0xDC00 <= code <= 0xDFFF:
+                i += 6
+                continue
+            out.append(chr(code))
+            i += 6
+        return "".join(out)
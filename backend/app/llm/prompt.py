@@ -0,0 +1,113 @@
+"""
+prompt.py: Token-budgeted prompt assembly for the chat model.
+
+The system prompt and few-shot examples are set once on the model as its
+system_instruction, so each turn only sends the conversation itself. The
+assembler fits pinned context (user memory), prior turns and the new message
+into a token budget, dropping the oldest turns first and condensing any single
+turn that is too long, and reports the estimated token count of every part.
+"""
+from __future__ import annotations
+
+import math
+import os
+from typing import Any, Dict, List, Optional
+
+# Input-token budget for pinned context + history + new message (system instruction excluded)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("SAKHI_PROMPT_TOKEN_BUDGET", "6000"))
+# Longest a single prior turn may be before it is condensed
+MAX_TURN_TOKENS = int(os.environ.get("SAKHI_PROMPT_MAX_TURN_TOKENS", "400"))
+
+# Rough Gemini tokenisation for English/Hinglish: ~4 characters per token,
+# plus a few tokens of framing per turn.
+_CHARS_PER_TOKEN = 4
+_TURN_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (no count_tokens round-trip)."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+
+def _turn_text(turn: Dict[str, Any]) -> str:
+    return "".join(str(p.get("text", "")) for p in turn.get("parts", []) if isinstance(p, dict))
+
+
+def _turn_tokens(turn: Dict[str, Any]) -> int:
+    return estimate_tokens(_turn_text(turn)) + _TURN_OVERHEAD_TOKENS
+
+
+def _condense(turn: Dict[str, Any], max_tokens: int) -> Dict[str, Any]:
+    """Keep the head of an over-long turn, which usually carries its point."""
+    text = _turn_text(turn)
+    max_chars = max(0, max_tokens * _CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return turn
+    return {"role": turn.get("role", "user"), "parts": [{"text": text[:max_chars].rstrip() + " …"}]}
+
+
+class PromptAssembler:
+    """Fits a conversation into a token budget; see assemble()."""
+
+    def __init__(self, system_instruction: str, budget_tokens: int = PROMPT_TOKEN_BUDGET,
+                 max_turn_tokens: int = MAX_TURN_TOKENS):
+        self.system_instruction = system_instruction
+        self.system_tokens = estimate_tokens(system_instruction)
+        self.budget_tokens = budget_tokens
+        self.max_turn_tokens = max_turn_tokens
+
+    def assemble(self, chat_history: List[Dict[str, Any]], pinned: Optional[List[Dict[str, Any]]] = None):
+        """
+        Split chat_history (last entry = new user message) into the history to
+        start the chat with and the message to send.
+
+        pinned turns (e.g. user memory) always precede the kept history and are
+        never dropped. Returns (history, user_message, report) where report holds
+        the estimated token count per part.
+        """
+        pinned = list(pinned or [])
+        user_message = _turn_text(chat_history[-1]) if chat_history else ""
+        prior = chat_history[:-1] if chat_history else []
+
+        message_tokens = estimate_tokens(user_message) + _TURN_OVERHEAD_TOKENS
+        pinned_tokens = sum(_turn_tokens(t) for t in pinned)
+        remaining = self.budget_tokens - message_tokens - pinned_tokens
+
+        # Walk newest to oldest, keeping turns while they fit
+        kept: List[Dict[str, Any]] = []
+        condensed = []
+        remaining_tokens = remaining
+        for turn in reversed(prior):
+            too_long = _turn_tokens(turn) > self.max_turn_tokens
+            if too_long:
+                turn = _condense(turn, self.max_turn_tokens)
+            cost = _turn_tokens(turn)
+            if cost > remaining_tokens:
+                break
+            kept.append(turn)
+            condensed.append(too_long)
+            remaining_tokens -= cost
+        kept.reverse()
+        condensed.reverse()
+
+        # Without a pinned preface, the history should open on a user turn
+        while not pinned and kept and kept[0].get("role") != "user":
+            kept.pop(0)
+            condensed.pop(0)
+        history_tokens = sum(_turn_tokens(t) for t in kept)
+
+        report = {
+            "system_tokens": self.system_tokens,
+            "pinned_tokens": pinned_tokens,
+            "history_tokens": history_tokens,
+            "message_tokens": message_tokens,
+            "prompt_tokens": pinned_tokens + history_tokens + message_tokens,
+            "total_input_tokens": self.system_tokens + pinned_tokens + history_tokens + message_tokens,
+            "budget_tokens": self.budget_tokens,
+            "turns_kept": len(kept),
+            "turns_dropped": len(prior) - len(kept),
+            "turns_condensed": sum(condensed),
+        }
+        return pinned + kept, user_message, report
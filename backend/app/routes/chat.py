@@ -1,14 +1,54 @@
 # chat.py: Defines the chat API endpoint for the Flask backend.
-from flask import Blueprint, request, jsonify, current_app, session
-from app.safety.prefilter import check_for_crisis
-from app.llm.client_gemini import get_gemini_response, generate_short_title
+from flask import Blueprint, request, jsonify, current_app, session, Response, stream_with_context
+from app.safety.prefilter import check_for_crisis, run_with_crisis_check
+from app.utils.concurrency import submit
+from app.utils.write_queue import WriteUnit, enqueue_writes
+from app.llm.client_gemini import get_gemini_response, stream_gemini_response, generate_short_title
+from app.services.title_service import heuristic_title, save_generated_title, start_title_generation
+from app.services.summary_service import (
+    SUMMARY_BATCH,
+    SUMMARY_KEEP_RECENT,
+    needs_compaction,
+    schedule_compaction,
+    summary_state,
+    to_chat_history,
+)
+from app.services.transcript_cache import (
+    append_messages, await_pending_writes, get_transcript, is_current, put_transcript,
+)
+from app.services import data_version, message_store, mood_rollups
 from app.auth import verify_token
 from app.db import get_db
 from firebase_admin import firestore
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import json
+import os
 
 chat_bp = Blueprint('chat_bp', __name__)
 
+# Enhanced crisis response with breathing exercise and Indian helplines
+CRISIS_RESPONSE = {
+    "reply": "I'm concerned about what you've shared. It sounds like you're going through a really difficult time right now. Let's take a moment to breathe together:\n\n**Quick Breathing Exercise**:\n1. Breathe in deeply through your nose for 4 counts\n2. Hold for 2 counts\n3. Exhale slowly through your mouth for 6 counts\n4. Repeat 3 times\n\nPlease reach out to one of these free, confidential support services:",
+    "mood": {"label": "distressed", "score": 1},
+    "is_crisis": True,
+    "warning": "CRISIS ALERT: Immediate attention recommended",
+    "suggested_intervention": "breathing_exercise",
+    "resources": [
+        {"title": "KIRAN Mental Health Helpline", "contact": "tel:1800-599-0019", "type": "helpline", "description": "24/7 toll-free national helpline"},
+        {"title": "Sneha India Suicide Prevention", "contact": "tel:91-44-2464-0050", "type": "helpline", "description": "24/7 suicide prevention helpline"},
+        {"title": "iCall Psychosocial Helpline", "contact": "tel:9152987821", "type": "helpline", "description": "Professional counseling support"},
+        {"title": "Vandrevala Foundation", "contact": "tel:9999666555", "type": "helpline", "description": "24/7 crisis intervention"}
+    ]
+}
+
+# How many of the most recent unsummarized Firestore messages are read as context for a turn.
+# Never less than the tail that triggers a compaction, so no message is in neither the
+# summary nor the prompt; grows with the tail while a compaction is pending, up to the max.
+HISTORY_WINDOW = max(int(os.environ.get('SAKHI_HISTORY_WINDOW', '22')), SUMMARY_KEEP_RECENT + SUMMARY_BATCH)
+HISTORY_WINDOW_MAX = max(int(os.environ.get('SAKHI_HISTORY_WINDOW_MAX', '60')), HISTORY_WINDOW)
+
+MEMORY_COMMAND_PREFIXES = ('remember:', 'remember that', 'forget all memory', 'forget last memory')
+
 @chat_bp.route('/chat', methods=['POST'])
 def chat():
     data = request.get_json(force=True, silent=True) or {}
@@ -19,22 +59,14 @@ def chat():
         return jsonify({"error": "message is required"}), 400
 
     # 1. Safety Prefilter (defense-in-depth)
-    is_crisis, crisis_type = check_for_crisis(message)
-    if is_crisis:
-        # Immediately return enhanced crisis response with breathing exercise and Indian helplines
-        return jsonify({
-            "reply": "I'm concerned about what you've shared. It sounds like you're going through a really difficult time right now. Let's take a moment to breathe together:\n\n**Quick Breathing Exercise**:\n1. Breathe in deeply through your nose for 4 counts\n2. Hold for 2 counts\n3. Exhale slowly through your mouth for 6 counts\n4. Repeat 3 times\n\nPlease reach out to one of these free, confidential support services:",
-            "mood": {"label": "distressed", "score": 1},
-            "is_crisis": True,
-            "warning": "CRISIS ALERT: Immediate attention recommended",
-            "suggested_intervention": "breathing_exercise",
-            "resources": [
-                {"title": "KIRAN Mental Health Helpline", "contact": "tel:1800-599-0019", "type": "helpline", "description": "24/7 toll-free national helpline"},
-                {"title": "Sneha India Suicide Prevention", "contact": "tel:91-44-2464-0050", "type": "helpline", "description": "24/7 suicide prevention helpline"},
-                {"title": "iCall Psychosocial Helpline", "contact": "tel:9152987821", "type": "helpline", "description": "Professional counseling support"},
-                {"title": "Vandrevala Foundation", "contact": "tel:9999666555", "type": "helpline", "description": "24/7 crisis intervention"}
-            ]
-        })
+    # Memory commands never reach Gemini, so check them up front; every other
+    # message is checked concurrently with reply generation below.
+    lower_msg = message.lower()
+    if lower_msg.startswith(MEMORY_COMMAND_PREFIXES):
+        is_crisis, crisis_type = check_for_crisis(message)
+        if is_crisis:
+            # Immediately return enhanced crisis response with breathing exercise and Indian helplines
+            return jsonify(CRISIS_RESPONSE)
 
     # 2. Manage conversation history (per chat_id) - FOR GUESTS ONLY
     hist_map = session.get('chat_histories', {})
@@ -42,7 +74,6 @@ def chat():
 
     # 2a. Explicit user memory (opt-in)
     user_memory = session.get('user_memory', [])  # list[str]
-    lower_msg = message.lower()
     if lower_msg.startswith('remember:') or lower_msg.startswith('remember that'):
         # Extract memory content after ':' or after 'remember that'
         content = message
@@ -92,13 +123,12 @@ def chat():
             "is_crisis": False
         })
 
-    # Add memory context (read-only) and current user message
-    effective_history = []
+    # Add memory context (read-only, pinned ahead of the history) and current user message
+    mem_text = None
     if user_memory:
         mem_text = "Persistent user memory (use discreetly):\n- " + "\n- ".join(user_memory)
-        effective_history.append({"role": "user", "parts": [{"text": mem_text}]})
-    # Append prior conversation
-    effective_history.extend(chat_history)
+    # Prior conversation
+    effective_history = list(chat_history)
     # Append new user message
     effective_history.append({"role": "user", "parts": [{"text": message}]})
 
@@ -106,8 +136,12 @@ def chat():
     try:
         current_app.logger.debug(f"[chat] routing to Gemini client with history.")
 
-        # Pass the entire history (with memory preface if present) to the client
-        llm_response = get_gemini_response(effective_history)
+        # Pass the history (with memory preface if present) to the client, which fits it
+        # to the token budget, generating the reply while the safety prefilter runs
+        is_crisis, crisis_type, llm_response = run_with_crisis_check(message, get_gemini_response, effective_history, memory=mem_text)
+        if is_crisis:
+            # Immediately return enhanced crisis response with breathing exercise and Indian helplines
+            return jsonify(CRISIS_RESPONSE)
         if not isinstance(llm_response, dict):
             llm_response = {
                 "reply": "Thanks for sharing — I’m here. Would you like a quick grounding exercise?",
@@ -123,6 +157,10 @@ def chat():
         # Keep the history from growing too large (e.g., last 10 messages)
         if len(chat_history) > 10:
             chat_history = chat_history[-10:]
+        # Most recently used chats last; keep the 20 latest
+        hist_map.pop(chat_id, None)
+        hist_map[chat_id] = chat_history
+        session['chat_histories'] = dict(list(hist_map.items())[-20:])
 
         # Log detected mood for analytics and debugging
         mood = llm_response.get('mood') if isinstance(llm_response, dict) else None
@@ -164,12 +202,11 @@ def chat_title():
         return jsonify({"error": "message is required"}), 400
 
     # Optional safety prefilter: avoid generating titles for explicit crisis text, just return fallback hint
-    is_crisis, _ = check_for_crisis(message)
+    is_crisis, _, title = run_with_crisis_check(message, generate_short_title, message, max_words=5)
     if is_crisis:
         # Let frontend fallback to heuristic
         return jsonify({"title": None, "note": "crisis_detected"})
 
-    title = generate_short_title(message, max_words=5)
     if not title:
         return jsonify({"title": None}), 502
     return jsonify({"title": title})
@@ -181,11 +218,13 @@ def create_new_chat(decoded_token):
     """
     Creates a new chat session and processes the first message in one call.
     This endpoint handles:
-    1. Creating a new chat session in Firestore
-    2. Generating a title based on the first message
-    3. Getting an AI response to the message
-    4. Saving both messages to the session
-    5. Returning the sessionId, title, and initialResponse
+    1. Building an instant title locally from the first message
+    2. Getting an AI response to the message
+    3. Creating the session with both messages and the mood in one batched write
+    4. Returning the sessionId, title, titleSource, and initialResponse
+
+    The Gemini title is generated in the background and replaces the local one
+    on the session document (see GET /chat/<session_id>/title).
     """
     db = get_db()
     user_id = decoded_token['uid']
@@ -194,80 +233,200 @@ def create_new_chat(decoded_token):
 
     if not message_text:
         return jsonify({"error": "message is required"}), 400
+    if len(message_text) > message_store.MAX_MESSAGE_CHARS:
+        return jsonify({"error": f"message is longer than {message_store.MAX_MESSAGE_CHARS} characters"}), 400
 
     try:
-        # 1. Create a new chat session with a temporary title
-        session_ref = db.collection('users').document(user_id).collection('sessions').document()
-        temp_title = "New Chat"
-        session_ref.set({
-            'title': temp_title,
-            'createdAt': firestore.SERVER_TIMESTAMP,
-            'updatedAt': firestore.SERVER_TIMESTAMP
-        })
-        session_id = session_ref.id
-
-        # 2. Save the user's message
-        user_message_ref = db.collection('users').document(user_id).collection('sessions').document(session_id).collection('messages').document()
-        user_message_ref.set({
-            'author': 'user',
-            'text': message_text,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
-
-        # 3. Generate a response with the Gemini model
+        user_timestamp = _now()
+        # Start the title while the reply and the safety prefilter run; nobody waits for it
+        title_future = start_title_generation(message_text, max_words=5)
         chat_history = [{"role": "user", "parts": [{"text": message_text}]}]
-        llm_response = get_gemini_response(chat_history)
-        
-        # 4. Save the model's response
-        bot_message_ref = db.collection('users').document(user_id).collection('sessions').document(session_id).collection('messages').document()
-        bot_message_ref.set({
-            'author': 'bot',
-            'text': llm_response.get('reply', ''),
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
-        
-        # Process and save mood data from first message if available
-        mood = llm_response.get('mood') if isinstance(llm_response, dict) else None
-        if isinstance(mood, dict) and 'label' in mood and 'score' in mood:
-            try:
-                # Save mood to Firestore
-                mood_ref = db.collection('users').document(user_id).collection('moods').document()
-                mood_ref.set({
-                    'label': mood.get('label', 'neutral'),
-                    'score': mood.get('score', 5),
-                    'timestamp': firestore.SERVER_TIMESTAMP,
-                    'source': 'chat',
-                    'message': message_text,
-                    'sessionId': session_id
-                })
-                current_app.logger.info(f"Saved mood entry from initial message to Firestore for user {user_id}")
-            except Exception as e:
-                current_app.logger.error(f"Error saving initial mood entry to Firestore: {str(e)}")
-        else:
-            current_app.logger.debug("No valid mood data in initial LLM response")
-
-        # 5. Generate a title based on the first message
-        title = generate_short_title(message_text, max_words=5)
-        if not title:
-            title = temp_title
-        
-        # 6. Update the session with the generated title
-        session_ref.update({
-            'title': title
+        is_crisis, _, llm_response = run_with_crisis_check(message_text, get_gemini_response, chat_history)
+        if is_crisis:
+            # Don't title explicit crisis text; keep the placeholder
+            if title_future is not None:
+                title_future.cancel()
+            title_future = None
+            llm_response = dict(CRISIS_RESPONSE)
+
+        title = "New Chat" if is_crisis else heuristic_title(message_text)
+
+        # Create the session with its title, both messages and the mood in one commit
+        session_id = db.collection('users').document(user_id).collection('sessions').document().id
+        _commit_turn(db, user_id, session_id, message_text, llm_response, user_timestamp, session_fields={
+            'title': title,
+            'titleSource': 'heuristic',
+            'createdAt': firestore.SERVER_TIMESTAMP
         })
+        # Queued behind the session write above
+        save_generated_title(db, user_id, session_id, title_future)
 
-        # 7. Return the new session details and initial response
-        return jsonify({
+        # Return the new session details and initial response
+        out = {
             'sessionId': session_id,
             'title': title,
+            'titleSource': 'heuristic',
             'initialResponse': llm_response.get('reply', '')
-        }), 201
+        }
+        if is_crisis:
+            out.update({k: v for k, v in CRISIS_RESPONSE.items() if k != 'reply'})
+        return jsonify(out), 201
 
     except Exception as e:
         current_app.logger.exception("Error in create_new_chat")
         return jsonify({"error": str(e)}), 500
 
 
+@chat_bp.route('/chat/<session_id>/title', methods=['GET'])
+@verify_token
+def get_session_title(decoded_token, session_id):
+    """
+    Current title of a session, for clients polling for the background Gemini title.
+    Returns { "title": "...", "titleSource": "heuristic" | "generated" }.
+    """
+    db = get_db()
+    user_id = decoded_token['uid']
+    try:
+        snapshot = db.collection('users').document(user_id).collection('sessions').document(session_id).get()
+        if not snapshot.exists:
+            return jsonify({"error": "session not found"}), 404
+        data = snapshot.to_dict() or {}
+        return jsonify({"title": data.get('title'), "titleSource": data.get('titleSource')})
+    except Exception as e:
+        current_app.logger.exception("Error reading session title")
+        return jsonify({"error": str(e)}), 500
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _history_window(unsummarized):
+    """Messages read verbatim for a turn: the whole unsummarized tail, within the window bounds."""
+    return min(max(HISTORY_WINDOW, unsummarized or 0), HISTORY_WINDOW_MAX)
+
+
+def _turn_context(db, user_id, session_id, message_text):
+    """
+    Prompt context for one turn: (chat_history, summary, unsummarized).
+    chat_history is the unsummarized tail plus the new user message, appended in
+    memory rather than read back. Served from the transcript cache when the
+    session is cached and no other worker has written to the user's sessions
+    since; otherwise read from Firestore and cached.
+    """
+    # This worker's queued turns land first, so the version read covers them
+    await_pending_writes(user_id, session_id)
+    version = data_version.current(db, user_id, data_version.SCOPE_SESSIONS)
+    entry = get_transcript(user_id, session_id)
+    if is_current(entry, version):
+        summary, through, unsummarized = entry['summary'], entry['summarizedThrough'], entry['unsummarized']
+        messages = entry['messages']
+        if through is not None:
+            messages = [m for m in messages if m['timestamp'] is not None and m['timestamp'] > through]
+        messages = messages[-_history_window(unsummarized):]
+    else:
+        session_doc = message_store.session_ref(db, user_id, session_id).get()
+        session_data = session_doc.to_dict() if session_doc.exists else None
+        summary, through, unsummarized = summary_state(session_data)
+        message_state = message_store.layout_state(session_data)
+        window = _history_window(unsummarized)
+        messages = message_store.read_recent(db, user_id, session_id, message_state, window, after=through)
+        put_transcript(user_id, session_id, messages,
+                       complete=through is None and len(messages) < window,
+                       summary=summary, summarized_through=through, unsummarized=unsummarized,
+                       message_state=message_state, version=version)
+    chat_history = to_chat_history(messages)
+    chat_history.append({'role': 'user', 'parts': [{'text': message_text}]})
+    return chat_history, summary, unsummarized
+
+
+def _reply_for_turn(db, user_id, session_id, message_text):
+    """Load the turn context and generate the reply; returns (llm_response, unsummarized)."""
+    chat_history, summary, unsummarized = _turn_context(db, user_id, session_id, message_text)
+    return get_gemini_response(chat_history, summary=summary), unsummarized
+
+
+def _commit_turn(db, user_id, session_id, message_text, llm_response, user_timestamp, session_fields=None):
+    """
+    Write one chat turn as a single atomic batch: the user message, the bot reply
+    (in the session's message layout), the detected mood and its daily rollups
+    (see mood_rollups), and the session's updatedAt/unsummarized fields,
+    denormalized listing fields (messageCount, lastMessagePreview) and any
+    session_fields (title and createdAt for a new session).
+
+    The batch goes through the write-behind queue, so the reply is returned
+    without waiting for Firestore. Message timestamps are set here rather than by
+    the server, so they reflect when the turn happened and the user and bot
+    messages of one commit still sort in turn order.
+    """
+    new_session = 'createdAt' in (session_fields or {})
+    session_ref = message_store.session_ref(db, user_id, session_id)
+    batch = WriteUnit(db, key=f"{user_id}/{session_id}")
+
+    written, message_state, layout_fields = message_store.append_messages(
+        batch, db, user_id, session_id, _message_state(db, user_id, session_id, new_session), [
+            {'author': 'user', 'text': message_text, 'timestamp': user_timestamp},
+            {'author': 'bot', 'text': llm_response.get('reply', ''),
+             'timestamp': max(_now(), user_timestamp + timedelta(microseconds=1))},
+        ], new_session=new_session)
+
+    # Process and save mood data if available
+    mood = llm_response.get('mood') if isinstance(llm_response, dict) else None
+    has_mood = isinstance(mood, dict) and 'label' in mood and 'score' in mood
+    if has_mood:
+        mood_entry = {
+            'label': mood.get('label', 'neutral'),
+            'score': mood.get('score', 5),
+            'timestamp': user_timestamp,
+            'updated_at': firestore.SERVER_TIMESTAMP,
+            'source': 'chat',
+            'message': message_text,
+            'sessionId': session_id
+        }
+        batch.set(db.collection('users').document(user_id).collection('moods').document(), mood_entry)
+        if isinstance(mood_entry['score'], (int, float)):
+            mood_rollups.record_entry(batch, db, user_id, mood_entry['label'], mood_entry['score'], user_timestamp)
+        data_version.bump(batch, db, user_id, data_version.SCOPE_MOODS)
+        current_app.logger.info(f"Queued mood entry from chat for user {user_id}")
+    else:
+        current_app.logger.debug("No valid mood data in LLM response")
+
+    batch.set(session_ref, {
+        **(session_fields or {}),
+        **layout_fields,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+        'unsummarized': firestore.Increment(2),
+        'messageCount': firestore.Increment(2),
+        'lastMessagePreview': message_store.preview(written[-1]['text'])
+    }, merge=True)
+    data_version.bump(batch, db, user_id, data_version.SCOPE_SESSIONS)
+    enqueue_writes(batch)
+    # Keep this worker's cached transcript current, even before the queue commits
+    append_messages(user_id, session_id, written, new_session=new_session, message_state=message_state)
+
+
+def _message_state(db, user_id, session_id, new_session=False):
+    """The session's message layout state, from the transcript cache when possible."""
+    if new_session:
+        return message_store.new_session_state()
+    entry = get_transcript(user_id, session_id)
+    if entry is not None and entry['messageState'] is not None:
+        return entry['messageState']
+    session_doc = message_store.session_ref(db, user_id, session_id).get()
+    return message_store.layout_state(session_doc.to_dict() if session_doc.exists else None)
+
+
+def _maybe_compact(db, user_id, session_id, unsummarized):
+    """Fold older messages into the session summary in the background once enough have piled up."""
+    if unsummarized is not None and needs_compaction(unsummarized + 2):
+        schedule_compaction(db, user_id, session_id)
+
+
+def _sse(event: str, data) -> str:
+    """Format one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @chat_bp.route('/chat/<session_id>', methods=['POST'])
 @verify_token
 def add_message_to_session(decoded_token, session_id):
@@ -281,63 +440,97 @@ def add_message_to_session(decoded_token, session_id):
 
     if not message_text:
         return jsonify({"error": "message is required"}), 400
+    if len(message_text) > message_store.MAX_MESSAGE_CHARS:
+        return jsonify({"error": f"message is longer than {message_store.MAX_MESSAGE_CHARS} characters"}), 400
 
     try:
-        # Save user message to Firestore
-        user_message_ref = db.collection('users').document(user_id).collection('sessions').document(session_id).collection('messages').document()
-        user_message_ref.set({
-            'author': 'user',
-            'text': message_text,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
-
-        # Get chat history from Firestore to provide context to the LLM
-        messages_ref = db.collection('users').document(user_id).collection('sessions').document(session_id).collection('messages').order_by('timestamp').stream()
-        
-        # Convert Firestore messages to the format expected by the Gemini client
-        chat_history = []
-        for msg in messages_ref:
-            msg_data = msg.to_dict()
-            role = 'user' if msg_data.get('author') == 'user' else 'model'
-            chat_history.append({
-                'role': role,
-                'parts': [{'text': msg_data.get('text', '')}]
-            })
-
-        # Get response from LLM
-        # The user's new message is already in chat_history from the loop above
-        llm_response = get_gemini_response(chat_history)
-
-        # Save bot message to Firestore
-        bot_message_ref = db.collection('users').document(user_id).collection('sessions').document(session_id).collection('messages').document()
-        bot_message_ref.set({
-            'author': 'bot',
-            'text': llm_response.get('reply', ''),
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
-        
-        # Process and save mood data if available
-        mood = llm_response.get('mood') if isinstance(llm_response, dict) else None
-        if isinstance(mood, dict) and 'label' in mood and 'score' in mood:
-            try:
-                # Save mood to Firestore
-                mood_ref = db.collection('users').document(user_id).collection('moods').document()
-                mood_ref.set({
-                    'label': mood.get('label', 'neutral'),
-                    'score': mood.get('score', 5),
-                    'timestamp': firestore.SERVER_TIMESTAMP,
-                    'source': 'chat',
-                    'message': message_text,
-                    'sessionId': session_id
-                })
-                current_app.logger.info(f"Saved mood entry from chat to Firestore for user {user_id}")
-            except Exception as e:
-                current_app.logger.error(f"Error saving mood entry to Firestore: {str(e)}")
+        user_timestamp = _now()
+        # Load the summary and recent transcript and get a response from the LLM while the safety prefilter runs
+        is_crisis, _, result = run_with_crisis_check(
+            message_text, _reply_for_turn, db, user_id, session_id, message_text
+        )
+        if is_crisis:
+            llm_response, unsummarized = dict(CRISIS_RESPONSE), None
         else:
-            current_app.logger.debug("No valid mood data in LLM response")
+            llm_response, unsummarized = result
+
+        # Save the turn in one commit (after the read, so the new message is never read back)
+        _commit_turn(db, user_id, session_id, message_text, llm_response, user_timestamp)
+        _maybe_compact(db, user_id, session_id, unsummarized)
 
         return jsonify(llm_response)
 
     except Exception as e:
         current_app.logger.exception("Error in chat operation")
         return jsonify({"error": str(e)}), 500
+
+
+@chat_bp.route('/chat/stream', methods=['POST'])
+@verify_token
+def stream_message_to_session(decoded_token):
+    """
+    Streaming variant of POST /chat/<session_id> using Server-Sent Events.
+
+    Request JSON: { "sessionId": "...", "message": "..." }
+    Emits `token` events ({"text": "..."}) with the reply as Gemini produces it,
+    then one `done` event carrying the full response (reply, mood, is_crisis,
+    resources, suggested_intervention). The turn (both messages and the mood) is
+    written to Firestore in one commit once the stream completes.
+    """
+    db = get_db()
+    user_id = decoded_token['uid']
+    data = request.get_json(force=True, silent=True) or {}
+    session_id = (data.get('sessionId') or '').strip()
+    message_text = (data.get('message') or '').strip()
+
+    if not session_id or not message_text:
+        return jsonify({"error": "sessionId and message are required"}), 400
+    if len(message_text) > message_store.MAX_MESSAGE_CHARS:
+        return jsonify({"error": f"message is longer than {message_store.MAX_MESSAGE_CHARS} characters"}), 400
+
+    # The prefilter runs alongside the stream; tokens are held back until it clears
+    crisis_future = submit(check_for_crisis, message_text)
+
+    try:
+        user_timestamp = _now()
+        chat_history, summary, unsummarized = _turn_context(db, user_id, session_id, message_text)
+    except Exception as e:
+        crisis_future.cancel()
+        current_app.logger.exception("Error in chat stream setup")
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        llm_response = None
+        held = []
+        cleared = False
+        try:
+            stream = stream_gemini_response(chat_history, summary=summary)
+            for kind, payload in stream:
+                if kind == 'token':
+                    held.append(payload)
+                else:
+                    llm_response = payload
+                # Tokens wait for the verdict only while it is pending; the final frame always waits
+                if not cleared and (kind == 'done' or crisis_future.done()):
+                    if crisis_future.result()[0]:
+                        stream.close()
+                        llm_response = dict(CRISIS_RESPONSE)
+                        break
+                    cleared = True
+                if cleared and held:
+                    yield _sse('token', {"text": "".join(held)})
+                    held = []
+            yield _sse('done', llm_response)
+        finally:
+            # Runs after the last frame, or when the client disconnects after `done`
+            if llm_response is not None:
+                try:
+                    _commit_turn(db, user_id, session_id, message_text, llm_response, user_timestamp)
+                    _maybe_compact(db, user_id, session_id, unsummarized)
+                except Exception:
+                    current_app.logger.exception("Error persisting streamed chat turn")
+
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
@@ -0,0 +1,79 @@
+# deletion.py: Bulk deletion endpoints (many sessions, whole account) and deletion job status.
+import os
+import logging
+from flask import Blueprint, request, jsonify
+from app.auth import verify_token
+from app.db import get_db
+from app.services.deletion_service import (
+    KIND_ACCOUNT, KIND_SESSIONS, MAX_SESSIONS_PER_JOB, get_job, start_job,
+)
+
+deletion_bp = Blueprint('deletion_bp', __name__)
+SKIP_AUTH = os.environ.get('SKIP_FIREBASE_AUTH', '').lower() in ('1', 'true', 'yes')
+
+
+@deletion_bp.route('/deletions/sessions', methods=['POST'])
+@verify_token
+def delete_sessions(decoded_token):
+    """
+    Starts a job deleting several chat sessions and their messages.
+    Body: {"sessionIds": [...]} (at most SAKHI_DELETE_MAX_SESSIONS). Returns 202 with the job id.
+    """
+    data = request.get_json(silent=True) or {}
+    session_ids = data.get('sessionIds')
+    if not isinstance(session_ids, list) or not session_ids \
+            or not all(isinstance(s, str) and s and '/' not in s for s in session_ids):
+        return jsonify({'error': 'sessionIds must be a non-empty list of session ids'}), 400
+    session_ids = list(dict.fromkeys(session_ids))
+    if len(session_ids) > MAX_SESSIONS_PER_JOB:
+        return jsonify({'error': f'at most {MAX_SESSIONS_PER_JOB} sessions per request'}), 400
+    if SKIP_AUTH:
+        return jsonify({'jobId': 'dev-job', 'status': 'done'}), 202
+
+    try:
+        job_id = start_job(get_db(), decoded_token['uid'], KIND_SESSIONS, session_ids)
+        return jsonify({'jobId': job_id}), 202
+    except Exception as e:
+        logging.exception("Error starting session deletion job")
+        return jsonify({'error': str(e)}), 500
+
+
+@deletion_bp.route('/deletions/account', methods=['POST'])
+@verify_token
+def delete_account_data(decoded_token):
+    """
+    Starts a job purging all of the user's data: chat sessions and messages,
+    moods, the users/{uid} and userinfo/{uid} documents. The Firebase Auth
+    account itself is left to the client. Body: {"confirm": true}.
+    """
+    data = request.get_json(silent=True) or {}
+    if data.get('confirm') is not True:
+        return jsonify({'error': 'confirm must be true'}), 400
+    if SKIP_AUTH:
+        return jsonify({'jobId': 'dev-job', 'status': 'done'}), 202
+
+    try:
+        job_id = start_job(get_db(), decoded_token['uid'], KIND_ACCOUNT)
+        return jsonify({'jobId': job_id}), 202
+    except Exception as e:
+        logging.exception("Error starting account purge job")
+        return jsonify({'error': str(e)}), 500
+
+
+@deletion_bp.route('/deletions/<job_id>', methods=['GET'])
+@verify_token
+def get_deletion_job(decoded_token, job_id):
+    """
+    Returns a deletion job's status: queued, running, done or failed, with
+    sessionsDone/sessionsTotal, deletedDocs and error.
+    """
+    if SKIP_AUTH:
+        return jsonify({'id': job_id, 'status': 'done'}), 200
+    try:
+        job = get_job(get_db(), decoded_token['uid'], job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        logging.exception(f"Error reading deletion job {job_id}")
+        return jsonify({'error': str(e)}), 500
@@ -3,11 +3,26 @@ from flask import Blueprint, request, jsonify
 from app.auth import verify_token
 from app.db import get_db
 from firebase_admin import firestore
+from app.services.summary_service import summary_state
+from app.services.transcript_cache import await_pending_writes, get_transcript, is_current, put_transcript
+from app.services import data_version, message_store
+from app.services.deletion_service import KIND_SESSIONS, delete_session, start_job
+from app.utils import conditional
+from app.utils.cursor import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, page_limit
 import logging
 
 history_bp = Blueprint('history_bp', __name__)
 SKIP_AUTH = os.environ.get('SKIP_FIREBASE_AUTH', '').lower() in ('1', 'true', 'yes')
 
+# Sidebar listing: page size and the only session fields it reads
+SESSION_PAGE_SIZE = int(os.environ.get('SAKHI_SESSION_PAGE_SIZE', '30'))
+SESSION_PAGE_MAX = 100
+SESSION_LIST_FIELDS = ['title', 'titleSource', 'createdAt', 'updatedAt', 'lastMessagePreview', 'messageCount']
+
+# Message history pages, loaded newest first as the user scrolls up
+MESSAGE_PAGE_SIZE = int(os.environ.get('SAKHI_MESSAGE_PAGE_SIZE', '50'))
+MESSAGE_PAGE_MAX = 200
+
 @history_bp.route('/history/session', methods=['POST'])
 @verify_token
 def create_chat_session(decoded_token):
@@ -24,10 +39,15 @@ def create_chat_session(decoded_token):
     try:
         # Add a new document with a generated ID
         session_ref = db.collection('users').document(user_id).collection('sessions').document()
-        session_ref.set({
+        batch = db.batch()
+        batch.set(session_ref, {
             'title': title,
-            'createdAt': firestore.SERVER_TIMESTAMP
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
+            'messageCount': 0
         })
+        data_version.bump(batch, db, user_id, data_version.SCOPE_SESSIONS)
+        batch.commit()
         return jsonify({'sessionId': session_ref.id}), 201
     except Exception as e:
         logging.exception("Error creating chat session in Firestore")
@@ -37,22 +57,52 @@ def create_chat_session(decoded_token):
 @verify_token
 def get_chat_sessions(decoded_token):
     """
-    Retrieves all chat sessions for the logged-in user.
+    Retrieves one page of the logged-in user's chat sessions, most recently
+    updated first, with only the fields the sidebar shows.
+
+    Query params: limit (default SAKHI_SESSION_PAGE_SIZE, max 100) and cursor
+    (from the previous page's X-Next-Cursor header, absent on the last page).
     """
     if SKIP_AUTH:
         return jsonify([]), 200
     db = get_db()
     user_id = decoded_token['uid']
     try:
-        sessions_ref = db.collection('users').document(user_id).collection('sessions').stream()
+        limit = page_limit(request.args.get('limit'), SESSION_PAGE_SIZE, SESSION_PAGE_MAX)
+        cursor = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # Unchanged since the client's copy: skip the query
+        etag = conditional.request_etag(db, user_id, data_version.SCOPE_SESSIONS)
+        cached = conditional.not_modified(etag)
+        if cached is not None:
+            return cached
+
+        query = (db.collection('users').document(user_id).collection('sessions')
+                 .select(SESSION_LIST_FIELDS)
+                 .order_by('updatedAt', direction=firestore.Query.DESCENDING)
+                 .order_by('__name__', direction=firestore.Query.DESCENDING))
+        if cursor is not None:
+            query = query.start_after({'updatedAt': cursor.get('u'), '__name__': cursor.get('id')})
+        # One extra document tells whether there is a next page
+        docs = list(query.limit(limit + 1).stream())
+
         sessions = []
-        for session in sessions_ref:
+        for session in docs[:limit]:
             session_data = session.to_dict()
-            # Convert timestamp to ISO 8601 string format
-            if 'createdAt' in session_data and hasattr(session_data['createdAt'], 'isoformat'):
-                session_data['createdAt'] = session_data['createdAt'].isoformat()
+            # Convert timestamps to ISO 8601 string format
+            for field in ('createdAt', 'updatedAt'):
+                if field in session_data and hasattr(session_data[field], 'isoformat'):
+                    session_data[field] = session_data[field].isoformat()
             sessions.append({'id': session.id, **session_data})
-        return jsonify(sessions), 200
+
+        resp = conditional.tag(jsonify(sessions), etag)
+        if len(docs) > limit:
+            last = docs[limit - 1]
+            resp.headers[NEXT_CURSOR_HEADER] = encode_cursor({'u': last.get('updatedAt'), 'id': last.id})
+        return resp, 200
     except Exception as e:
         logging.exception("Error retrieving chat sessions from Firestore")
         return jsonify({'error': str(e)}), 500
@@ -61,21 +111,77 @@ def get_chat_sessions(decoded_token):
 @verify_token
 def get_messages(decoded_token, session_id):
     """
-    Retrieves all messages for a specific chat session.
+    Retrieves the messages of a chat session, oldest first.
+
+    With limit and/or before, returns one page for reverse loading: the newest
+    `limit` messages (default SAKHI_MESSAGE_PAGE_SIZE, max 200) older than the
+    `before` cursor. The cursor for the next older page is in the X-Next-Cursor
+    header, absent once the start of the session is reached. Without either
+    parameter, returns the whole transcript.
     """
     if SKIP_AUTH:
         return jsonify([]), 200
     db = get_db()
     user_id = decoded_token['uid']
+    paged = 'limit' in request.args or 'before' in request.args
+    try:
+        limit = page_limit(request.args.get('limit'), MESSAGE_PAGE_SIZE, MESSAGE_PAGE_MAX)
+        before = None
+        if request.args.get('before'):
+            cursor = decode_cursor(request.args['before'])
+            before = (cursor['t'], cursor['id'])
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'invalid cursor or limit: {e}'}), 400
+
     try:
-        messages_ref = db.collection('users').document(user_id).collection('sessions').document(session_id).collection('messages').order_by('timestamp').stream()
+        # This worker's queued turns land first, so the version read covers them
+        await_pending_writes(user_id, session_id)
+        version = data_version.current(db, user_id, data_version.SCOPE_SESSIONS)
+        entry = get_transcript(user_id, session_id)
+        # Another worker may have written to the session since this worker cached it
+        if not is_current(entry, version):
+            entry = None
+        etag = conditional.request_etag(db, user_id, data_version.SCOPE_SESSIONS, version=version)
+        cached = conditional.not_modified(etag)
+        if cached is not None:
+            return cached
+
+        has_more = False
+        if paged:
+            page = None
+            if entry is not None:
+                page, has_more = message_store.page_before(entry['messages'], limit, before)
+                # A partial cached tail only answers pages it fully covers
+                if not (entry['complete'] or has_more):
+                    page = None
+            if page is None:
+                session_doc = message_store.session_ref(db, user_id, session_id).get()
+                session_data = session_doc.to_dict() if session_doc.exists else None
+                page, has_more = message_store.read_page(
+                    db, user_id, session_id, message_store.layout_state(session_data), limit, before)
+        elif entry is not None and entry['complete']:
+            page = entry['messages']
+        else:
+            session_doc = message_store.session_ref(db, user_id, session_id).get()
+            session_data = session_doc.to_dict() if session_doc.exists else None
+            message_state = message_store.layout_state(session_data)
+            page = message_store.read_all(db, user_id, session_id, message_state)
+            # Cache the full transcript so the next view and chat turns skip Firestore
+            summary, through, unsummarized = summary_state(session_data)
+            put_transcript(user_id, session_id, page, complete=True,
+                           summary=summary, summarized_through=through, unsummarized=unsummarized,
+                           message_state=message_state, version=version)
         messages = []
-        for msg in messages_ref:
-            msg_data = msg.to_dict()
+        for msg in page:
+            msg_data = dict(msg)
             if 'timestamp' in msg_data and hasattr(msg_data['timestamp'], 'isoformat'):
                 msg_data['timestamp'] = msg_data['timestamp'].isoformat()
-            messages.append({'id': msg.id, **msg_data})
-        return jsonify(messages), 200
+            messages.append(msg_data)
+
+        resp = conditional.tag(jsonify(messages), etag)
+        if has_more and page:
+            resp.headers[NEXT_CURSOR_HEADER] = encode_cursor({'t': page[0]['timestamp'], 'id': page[0]['id']})
+        return resp, 200
     except Exception as e:
         logging.exception("Error retrieving messages from Firestore")
         return jsonify({'error': str(e)}), 500
@@ -84,7 +190,9 @@ def get_messages(decoded_token, session_id):
 @verify_token
 def delete_chat_session(decoded_token, session_id):
     """
-    Deletes a specific chat session and all its messages.
+    Deletes a specific chat session and all its messages, in batches.
+    With ?background=1, starts a deletion job instead and returns 202 with its
+    id (status at GET /deletions/<jobId>).
     """
     if SKIP_AUTH:
         return jsonify({"success": True, "message": "Chat session deleted successfully (dev)"}), 200
@@ -92,16 +200,12 @@ def delete_chat_session(decoded_token, session_id):
     user_id = decoded_token['uid']
     
     try:
-        # Get reference to the session
-        session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-        
-        # Delete all messages in the session (subcollection)
-        messages_ref = session_ref.collection('messages').stream()
-        for message in messages_ref:
-            message.reference.delete()
-        
-        # Delete the session document itself
-        session_ref.delete()
+        if request.args.get('background', '').lower() in ('1', 'true', 'yes'):
+            job_id = start_job(db, user_id, KIND_SESSIONS, [session_id])
+            return jsonify({"success": True, "jobId": job_id}), 202
+
+        # Messages (either layout) first, then the session document
+        delete_session(db, user_id, session_id)
         
         return jsonify({"success": True, "message": "Chat session deleted successfully"}), 200
     except Exception as e:
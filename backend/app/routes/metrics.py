@@ -0,0 +1,16 @@
+# metrics.py: Defines the in-process metrics endpoint for the Flask backend.
+import os
+from flask import Blueprint, jsonify
+from app.utils.cache import cache_stats
+from app.utils.write_queue import write_queue_stats
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Counters are per worker process; the pid tells workers apart
+    return jsonify({
+        "pid": os.getpid(),
+        "caches": cache_stats(),
+        "write_queue": write_queue_stats(),
+    })
@@ -1,12 +1,14 @@
 # mood.py: Defines the mood API endpoints for the Flask backend.
 from flask import Blueprint, request, jsonify, session, current_app
-import re
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
 from app.auth import verify_token
 from app.db import get_db
 from firebase_admin import firestore
+from app.utils.text_match import KeywordAutomaton
+from app.services import data_version, mood_rollups, mood_series, sync_service
+from app.utils import conditional
 import logging
 import uuid
 
@@ -40,6 +42,28 @@ MOOD_SCORES = {
     "elated": 10
 }
 
+# Most messages one /mood/batch request may score
+MOOD_BATCH_MAX = int(os.environ.get('SAKHI_MOOD_BATCH_MAX', '500'))
+
+# Stats windows longer than this many days read monthly rather than daily rollups
+MOOD_STATS_DAILY_MAX_DAYS = int(os.environ.get('SAKHI_MOOD_STATS_DAILY_MAX_DAYS', '62'))
+
+# Every (mood, keyword) pair compiled once into one word-bounded matcher, so a
+# message is scanned in a single pass instead of one regex search per keyword
+_MOOD_MATCHER = KeywordAutomaton(
+    (word, (mood, word)) for mood, keywords in MOOD_KEYWORDS.items() for word in keywords
+)
+
+def mood_keyword_counts(message):
+    """
+    Number of distinct keywords of each mood found in the message, as whole
+    words (case-insensitive). Moods appear in MOOD_KEYWORDS order.
+    """
+    scores = {mood: 0 for mood in MOOD_KEYWORDS}
+    for mood, _word in _MOOD_MATCHER.payloads(message.lower()):
+        scores[mood] += 1
+    return scores
+
 def analyze_text_mood(message):
     """
     Analyzes mood from text using keyword matching.
@@ -52,15 +76,9 @@ def analyze_text_mood(message):
     """
     if not message:
         return "neutral", 5
-        
-    message = message.lower()
     
     # Count matches for each mood category
-    scores = {mood: 0 for mood in MOOD_KEYWORDS}
-    for mood, keywords in MOOD_KEYWORDS.items():
-        for word in keywords:
-            if re.search(r'\b' + re.escape(word) + r'\b', message):
-                scores[mood] += 1
+    scores = mood_keyword_counts(message)
     
     # Find mood with most keyword matches
     max_score = 0
@@ -123,6 +141,38 @@ def analyze_mood():
     
     return jsonify(mood_data)
     
+@mood_bp.route('/mood/batch', methods=['POST'])
+def analyze_mood_batch():
+    """
+    Endpoint to analyze the mood of many texts in one request.
+    Results are not added to the mood history.
+    
+    Request JSON format:
+    {
+        "messages": ["string", ...]  (at most SAKHI_MOOD_BATCH_MAX)
+    }
+    
+    Response JSON format:
+    {
+        "results": [{"label": "mood label", "score": 1-10}, ...]  (same order as messages)
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    messages = data.get('messages')
+    if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+        return jsonify({"error": "messages must be a list of strings"}), 400
+    if len(messages) > MOOD_BATCH_MAX:
+        return jsonify({"error": f"at most {MOOD_BATCH_MAX} messages per request"}), 400
+    
+    # Repeated texts are scored once
+    results = {}
+    for message in messages:
+        if message not in results:
+            label, score = analyze_text_mood(message)
+            results[message] = {"label": label, "score": score}
+    
+    return jsonify({"results": [results[m] for m in messages]})
+
 @mood_bp.route('/mood/history', methods=['GET'])
 def get_mood_history():
     """
@@ -201,11 +251,13 @@ def save_mood_to_cloud(decoded_token):
     if not isinstance(data['score'], (int, float)) or data['score'] < 1 or data['score'] > 10:
         return jsonify({"error": "score must be a number between 1 and 10"}), 400
     
-    # Create mood entry document
+    # Create mood entry document (timestamped here so its rollup day is known)
+    timestamp = mood_rollups.utc_now()
     mood_entry = {
         "label": data['label'],
         "score": data['score'],
-        "timestamp": firestore.SERVER_TIMESTAMP,
+        "timestamp": timestamp,
+        "updated_at": firestore.SERVER_TIMESTAMP,
         "source": data.get('source', 'manual')
     }
     
@@ -217,9 +269,13 @@ def save_mood_to_cloud(decoded_token):
         mood_entry['themes'] = data['themes']
     
     try:
-        # Add the mood entry to Firestore
+        # Add the mood entry and fold it into the daily rollups in one commit
         entry_ref = db.collection('users').document(user_id).collection('moods').document()
-        entry_ref.set(mood_entry)
+        batch = db.batch()
+        batch.set(entry_ref, mood_entry)
+        mood_rollups.record_entry(batch, db, user_id, mood_entry['label'], mood_entry['score'], timestamp)
+        data_version.bump(batch, db, user_id, data_version.SCOPE_MOODS)
+        batch.commit()
         
         # Return the entry ID for client-side reference
         return jsonify({
@@ -267,6 +323,12 @@ def get_cloud_mood_history(decoded_token):
     limit = request.args.get('limit', 100, type=int)
     
     try:
+        # Unchanged since the client's copy: skip the query
+        etag = conditional.request_etag(db, user_id, data_version.SCOPE_MOODS, conditional.utc_day())
+        cached = conditional.not_modified(etag)
+        if cached is not None:
+            return cached
+
         # Calculate the cutoff timestamp for the requested number of days
         cutoff_date = datetime.now() - timedelta(days=days)
         
@@ -282,20 +344,65 @@ def get_cloud_mood_history(decoded_token):
         for doc in query.stream():
             entry = doc.to_dict()
             
-            # Convert Firestore timestamp to ISO string
-            if 'timestamp' in entry and hasattr(entry['timestamp'], 'isoformat'):
-                entry['timestamp'] = entry['timestamp'].isoformat()
+            # Convert Firestore timestamps to ISO strings
+            for field in ('timestamp', 'updated_at'):
+                if field in entry and hasattr(entry[field], 'isoformat'):
+                    entry[field] = entry[field].isoformat()
                 
             # Add the document ID
             entry['id'] = doc.id
             entries.append(entry)
         
-        return jsonify({"history": entries}), 200
+        return conditional.tag(jsonify({"history": entries}), etag), 200
         
     except Exception as e:
         logging.exception("Error retrieving mood history from Firestore")
         return jsonify({"error": str(e)}), 500
 
+@mood_bp.route('/mood/cloud/sync', methods=['POST'])
+@verify_token
+def sync_moods(decoded_token):
+    """
+    Delta sync for the client's mood/journal cache in one round trip.
+    
+    Request JSON format:
+    {
+        "since": "change token from the previous sync" (omit for a full sync),
+        "mutations": [
+            {"clientId": "local id", "op": "upsert",
+             "id": "server id" (omit to create),
+             "entry": {"label", "score", "journal", "themes", "source",
+                       "timestamp": epoch ms or ISO (creates only)}},
+            {"clientId": "local id", "op": "delete", "id": "server id"},
+            ...
+        ]  (at most SAKHI_SYNC_MAX_MUTATIONS, applied in order)
+    }
+    
+    Response JSON format:
+    {
+        "results": [{"clientId", "id", "status": "created|updated|deleted|missing"}, ...],
+        "token": "pass as since next time",
+        "reset": true when "changed" is the full set and the cache should be replaced,
+        "changed": [mood entries created or updated since the token, as in /mood/cloud/history],
+        "deleted": [ids of entries deleted since the token]
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    if SKIP_AUTH:
+        return jsonify({"results": [], "token": "", "reset": True, "changed": [], "deleted": []}), 200
+    db = get_db()
+    user_id = decoded_token['uid']
+    
+    try:
+        since = sync_service.decode_token(data.get('since'))
+        results = sync_service.apply_mutations(db, user_id, data.get('mutations') or [])
+        return jsonify({"results": results, **sync_service.changes_since(db, user_id, since)}), 200
+    except sync_service.SyncError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.exception("Error syncing mood entries")
+        return jsonify({"error": str(e)}), 500
+
 @mood_bp.route('/mood/cloud/<entry_id>', methods=['PUT'])
 @verify_token
 def update_mood_entry(decoded_token, entry_id):
@@ -339,7 +446,18 @@ def update_mood_entry(decoded_token, entry_id):
         
         # Update the document
         entry_ref = db.collection('users').document(user_id).collection('moods').document(entry_id)
-        entry_ref.update(update_data)
+        entry_doc = entry_ref.get()
+        if not entry_doc.exists:
+            return jsonify({"error": "Mood entry not found"}), 404
+        batch = db.batch()
+        batch.update(entry_ref, update_data)
+        data_version.bump(batch, db, user_id, data_version.SCOPE_MOODS)
+        batch.commit()
+        
+        # Rebuild the entry's daily rollup if its score or label changed
+        timestamp = (entry_doc.to_dict() or {}).get('timestamp')
+        if ('score' in update_data or 'label' in update_data) and hasattr(timestamp, 'date'):
+            mood_rollups.recompute_day(db, user_id, mood_rollups.day_key(timestamp))
         
         return jsonify({
             "success": True,
@@ -363,7 +481,23 @@ def delete_mood_entry(decoded_token, entry_id):
         
     try:
         entry_ref = db.collection('users').document(user_id).collection('moods').document(entry_id)
-        entry_ref.delete()
+        entry_doc = entry_ref.get()
+        # Delete the entry and leave a tombstone for delta sync
+        batch = db.batch()
+        batch.delete(entry_ref)
+        if entry_doc.exists:
+            batch.set(db.collection('users').document(user_id)
+                      .collection(sync_service.TOMBSTONES_COLLECTION).document(entry_id), {
+                'deleted_at': firestore.SERVER_TIMESTAMP,
+                'expiresAt': mood_rollups.utc_now() + timedelta(days=sync_service.SYNC_TOMBSTONE_DAYS)
+            })
+            data_version.bump(batch, db, user_id, data_version.SCOPE_MOODS)
+        batch.commit()
+        
+        # Rebuild the entry's daily rollup without it
+        timestamp = (entry_doc.to_dict() or {}).get('timestamp') if entry_doc.exists else None
+        if hasattr(timestamp, 'date'):
+            mood_rollups.recompute_day(db, user_id, mood_rollups.day_key(timestamp))
         
         return jsonify({
             "success": True,
@@ -385,7 +519,10 @@ def get_mood_stats(decoded_token):
     - Daily averages
     - Streak information
     - Best and worst days
-    - Entry counts
+    - Entry counts and label counts
+    
+    Computed from the daily rollups (see app/services/mood_rollups.py), not
+    from the individual entries.
     """
     if SKIP_AUTH:
         return jsonify({
@@ -393,6 +530,7 @@ def get_mood_stats(decoded_token):
             "daily_averages": {},
             "streak": 0,
             "entry_count": 0,
+            "label_counts": {},
             "best_day": None,
             "worst_day": None
         }), 200
@@ -402,64 +540,36 @@ def get_mood_stats(decoded_token):
     days = request.args.get('days', 7, type=int)
     
     try:
-        # Calculate the cutoff timestamp for the requested number of days
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        # Query Firestore for mood entries
-        query = (db.collection('users')
-                 .document(user_id)
-                 .collection('moods')
-                 .where('timestamp', '>=', cutoff_date)
-                 .order_by('timestamp'))
-        
-        entries = []
-        for doc in query.stream():
-            entry = doc.to_dict()
-            if 'timestamp' in entry:
-                entries.append({
-                    'id': doc.id,
-                    'timestamp': entry['timestamp'],
-                    'score': entry['score'],
-                    'label': entry['label'],
-                    'source': entry.get('source', 'manual')
-                })
-        
-        # Group entries by date
-        daily_entries = {}
-        for entry in entries:
-            # Convert Firestore timestamp to date string
-            date_str = entry['timestamp'].date().isoformat() if hasattr(entry['timestamp'], 'date') else datetime.fromisoformat(entry['timestamp']).date().isoformat()
-            
-            if date_str not in daily_entries:
-                daily_entries[date_str] = []
-                
-            daily_entries[date_str].append(entry)
+        # Unchanged since the client's copy: skip the rollup reads
+        etag = conditional.request_etag(db, user_id, data_version.SCOPE_MOODS, conditional.utc_day())
+        cached = conditional.not_modified(etag)
+        if cached is not None:
+            return cached
+
+        # Read the materialized daily rollups from the cutoff day on: one
+        # document per day with entries, or per month for long windows
+        first_day = (mood_rollups.utc_now() - timedelta(days=days)).date().isoformat()
+        if days > MOOD_STATS_DAILY_MAX_DAYS:
+            rollups = mood_rollups.read_days_by_month(db, user_id, first_day)
+        else:
+            rollups = mood_rollups.read_days(db, user_id, first_day)
+        rollups = {day: r for day, r in rollups.items() if r.get('count')}
         
         # Calculate daily averages
-        daily_averages = {}
-        for date_str, day_entries in daily_entries.items():
-            scores = [e['score'] for e in day_entries]
-            daily_averages[date_str] = sum(scores) / len(scores)
+        daily_averages = {day: r['sum'] / r['count'] for day, r in rollups.items()}
         
-        # Calculate overall weekly average
-        all_scores = [e['score'] for e in entries]
-        weekly_avg = sum(all_scores) / len(all_scores) if all_scores else None
+        # Calculate overall average across all entries in the window
+        entry_count = sum(r['count'] for r in rollups.values())
+        weekly_avg = sum(r['sum'] for r in rollups.values()) / entry_count if entry_count else None
         
-        # Calculate streak (consecutive days with entries)
-        dates = sorted(daily_entries.keys(), reverse=True)
-        streak = 0
-        today = datetime.now().date().isoformat()
+        # How often each mood label was recorded in the window
+        label_counts = {}
+        for r in rollups.values():
+            for label, count in (r.get('labels') or {}).items():
+                label_counts[label] = label_counts.get(label, 0) + count
         
-        # Check if there's an entry for today first
-        if dates and dates[0] == today:
-            streak = 1
-            for i in range(len(dates) - 1):
-                date1 = datetime.fromisoformat(dates[i]).date()
-                date2 = datetime.fromisoformat(dates[i+1]).date()
-                if (date1 - date2).days == 1:
-                    streak += 1
-                else:
-                    break
+        # Consecutive days with entries up to today, derived from the day rollups
+        streak = mood_rollups.current_streak(db, user_id, rollups, first_day)
         
         # Find best and worst days
         best_day = max(daily_averages.items(), key=lambda x: x[1]) if daily_averages else None
@@ -469,13 +579,94 @@ def get_mood_stats(decoded_token):
             "weekly_avg": round(weekly_avg, 1) if weekly_avg is not None else None,
             "daily_averages": {date: round(avg, 1) for date, avg in daily_averages.items()},
             "streak": streak,
-            "entry_count": len(entries),
+            "entry_count": entry_count,
+            "label_counts": label_counts,
             "best_day": {"date": best_day[0], "score": round(best_day[1], 1)} if best_day else None,
             "worst_day": {"date": worst_day[0], "score": round(worst_day[1], 1)} if worst_day else None
         }
         
-        return jsonify(stats), 200
+        return conditional.tag(jsonify(stats), etag), 200
         
     except Exception as e:
         logging.exception("Error retrieving mood statistics from Firestore")
         return jsonify({"error": str(e)}), 500
+
+@mood_bp.route('/mood/cloud/series', methods=['GET'])
+@verify_token
+def get_mood_series(decoded_token):
+    """
+    Mood time series downsampled for charts.
+    
+    Query parameters:
+    - resolution: "day", "week" (Monday-based) or "month" (default: day)
+    - buckets: number of points, ending with the current day/week/month
+      (default: 30 days, 26 weeks or 12 months; at most 366)
+    
+    Response JSON format:
+    {
+        "resolution": "week",
+        "start": "YYYY-MM-DD", "end": "YYYY-MM-DD",
+        "source": "rollups" or "entries",
+        "points": [
+            {"start": "YYYY-MM-DD", "count": n, "mean": 6.4, "min": 3, "max": 9,
+             "p25": 5, "p50": 7, "p75": 8, "p90": 9},  (nulls for an empty bucket)
+            ...
+        ]
+    }
+    """
+    resolution = request.args.get('resolution', 'day')
+    if resolution not in mood_series.RESOLUTIONS:
+        return jsonify({"error": f"resolution must be one of {', '.join(mood_series.RESOLUTIONS)}"}), 400
+    buckets = request.args.get('buckets', mood_series.DEFAULT_BUCKETS[resolution], type=int)
+    buckets = max(1, min(mood_series.MAX_BUCKETS, buckets))
+    
+    first, first_day = mood_series.series_range(resolution, buckets)
+    end = mood_series.end_day(resolution, first, buckets)
+    if SKIP_AUTH:
+        empty = mood_series.aggregate_entries([], [], resolution, first, buckets)
+        return jsonify({"resolution": resolution, "start": first_day, "end": end, "source": "entries",
+                        "points": mood_series.to_points(empty, resolution, first)}), 200
+    db = get_db()
+    user_id = decoded_token['uid']
+    
+    try:
+        etag = conditional.request_etag(db, user_id, data_version.SCOPE_MOODS, conditional.utc_day())
+        cached = conditional.not_modified(etag)
+        if cached is not None:
+            return cached
+
+        # Daily rollups for short spans, monthly ones (one read per month) for long spans
+        span_days = (mood_rollups.utc_now().date() - datetime.fromisoformat(first_day).date()).days + 1
+        if span_days > MOOD_STATS_DAILY_MAX_DAYS:
+            rollups = mood_rollups.read_days_by_month(db, user_id, first_day)
+        else:
+            rollups = mood_rollups.read_days(db, user_id, first_day)
+        
+        if all('hist' in r for r in rollups.values() if r.get('count')):
+            source = "rollups"
+            agg = mood_series.aggregate_rollups(rollups, resolution, first, buckets)
+        else:
+            # Rollups written before score histograms were kept: use the entries
+            source = "entries"
+            query = (db.collection('users').document(user_id).collection('moods')
+                     .where('timestamp', '>=', datetime.fromisoformat(first_day).replace(tzinfo=timezone.utc))
+                     .select(['score', 'timestamp']))
+            timestamps, scores = [], []
+            for doc in query.stream():
+                entry = doc.to_dict() or {}
+                if isinstance(entry.get('score'), (int, float)) and hasattr(entry.get('timestamp'), 'date'):
+                    timestamps.append(entry['timestamp'])
+                    scores.append(entry['score'])
+            agg = mood_series.aggregate_entries(timestamps, scores, resolution, first, buckets)
+        
+        return conditional.tag(jsonify({
+            "resolution": resolution,
+            "start": first_day,
+            "end": end,
+            "source": source,
+            "points": mood_series.to_points(agg, resolution, first)
+        }), etag), 200
+        
+    except Exception as e:
+        logging.exception("Error computing mood series")
+        return jsonify({"error": str(e)}), 500
@@ -1,11 +1,19 @@
 # prefilter.py: Implements a crisis detection filter using Gemini API.
 
 # This module contains the logic to check for crisis messages using a dedicated
-# Gemini API function optimized specifically for crisis detection.
+# Gemini API function optimized specifically for crisis detection, fronted by a
+# precompiled in-process matcher that settles the obvious cases without a call.
 
 import os
+import re
 import sys
+import unicodedata
 from ..llm.client_gemini import detect_crisis
+from ..utils.concurrency import submit
+from ..utils.text_match import KeywordAutomaton
+
+# Start the reply generation alongside the crisis check instead of after it
+SPECULATIVE_CRISIS_CHECK = os.environ.get('SAKHI_SPECULATIVE_CRISIS', 'true').lower() in ('1', 'true', 'yes')
 
 # Keeping minimal fallback keywords for cases where API fails
 FALLBACK_CRISIS_KEYWORDS = [
@@ -13,12 +21,30 @@ FALLBACK_CRISIS_KEYWORDS = [
     "mujhe marna hai", "mujhe marna h"
 ]
 
+# Unambiguous phrases that are treated as a crisis locally, without the Gemini call.
+# Matched on whole words after normalize_message(), so Hinglish spellings collapse.
+HIGH_CONFIDENCE_CRISIS_KEYWORDS = FALLBACK_CRISIS_KEYWORDS + [
+    "suicidal", "i wanna die", "i want to kill myself", "take my own life",
+    "hurt myself", "cut myself", "self harm",
+    "khudkushi", "aatmahatya", "mar jaunga", "mar jaungi",
+    "mar jana chahta", "mar jana chahti", "jeena nahi chahta", "jeena nahi chahti",
+    "zindagi khatam", "sab khatam kar",
+]
+
 # These phrases should be excluded even if they contain keywords
 EXCLUSION_PHRASES = [
     "don't want to die", "do not want to die", 
     "die of embarrassment", "die of laughter"
 ]
 
+# Word stems that keep a short message from being treated as clearly benign
+RISK_STEMS = [
+    "die", "dying", "dead", "death", "kill", "suicid", "hurt", "harm", "cut", "end",
+    "life", "live", "living", "pill", "overdose", "jump", "hang", "goodbye", "bye",
+    "hopeless", "worthless", "burden", "alone", "empty", "tired", "give up", "can't",
+    "marna", "mar ", "maut", "khatam", "zindagi", "jeena", "khudkushi", "aatmahatya",
+]
+
 # Regular expressions with context and negative lookaheads to avoid false positives
 CRISIS_PATTERNS = [
     # "I want to die" variations (but NOT "I don't want to die" or "die of embarrassment")
@@ -40,10 +66,122 @@ CRISIS_PATTERNS = [
     r"\bi\sthink\si\s(?:want|need|have)\sto\sdie\b"
 ]
 
+# Words at least one of which every CRISIS_PATTERNS regex requires
+PATTERN_TRIGGERS = ["die", "kill", "suicide", "end", "live", "living", "continue", "go on", "take it"]
+
+# Hinglish / chat spelling variants, folded onto one canonical token
+SPELLING_VARIANTS = {
+    "mujhey": "mujhe", "muje": "mujhe", "mujhko": "mujhe", "mjhe": "mujhe", "mje": "mujhe",
+    "mrna": "marna", "marnaa": "marna", "marana": "marna",
+    "hae": "hai", "hain": "hai", "hay": "hai",
+    "chahata": "chahta", "chata": "chahta", "chahti": "chahti", "chati": "chahti",
+    "hoon": "hun", "hu": "hun", "hoo": "hun",
+    "jaana": "jana", "jaa": "ja",
+    "jina": "jeena", "jeene": "jeena",
+    "nahin": "nahi", "nhi": "nahi", "nai": "nahi", "nahee": "nahi",
+    "khatm": "khatam", "khtm": "khatam",
+    "jindagi": "zindagi", "zindgi": "zindagi", "jindgi": "zindagi",
+    "khudkhushi": "khudkushi", "khudkshi": "khudkushi",
+    "atmahatya": "aatmahatya", "atmhatya": "aatmahatya",
+    "dont": "don't", "cant": "can't", "wont": "won't", "didnt": "didn't",
+    "wanna": "wanna", "wana": "wanna",
+}
+
+# Greetings and acknowledgements, the only messages the local matcher calls benign.
+# Compared whole-message after normalize_message() with trailing punctuation stripped;
+# anything else, however short, is "unknown" and goes to Gemini.
+BENIGN_MESSAGES = frozenset([
+    "hi", "hii", "hello", "hey", "heya", "hola", "namaste", "namaskar",
+    "good morning", "good afternoon", "good evening", "good night", "gm", "gn",
+    "ok", "okay", "k", "kk", "sure", "yes", "yeah", "yep", "no", "nope",
+    "thanks", "thank you", "thank you so much", "thanks a lot", "thx", "ty",
+    "dhanyavaad", "dhanyawad", "shukriya", "theek hai", "thik hai", "accha", "acha",
+    "hmm", "hm", "cool", "nice", "great", "got it", "i see", "alright",
+])
+
+# Policy for messages the local matcher does not flag:
+#   remote      - every unflagged message still goes to Gemini (default)
+#   local_first - messages in BENIGN_MESSAGES skip the Gemini check
+PREFILTER_POLICY = os.environ.get('SAKHI_PREFILTER_POLICY', 'remote').strip().lower()
+
+# Only variant tokens are visited during substitution; everything else is skipped in C
+_VARIANT_RE = re.compile(
+    r"(?<![a-z'])(?:" + "|".join(sorted(map(re.escape, SPELLING_VARIANTS), key=len, reverse=True)) + r")(?![a-z'])"
+)
+_REPEAT_RE = re.compile(r"([a-z])\1{2,}")
+_SPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[\s.!?,:;~)(*-]+$")
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, fold quotes/whitespace, squash letter runs and canonicalise Hinglish spellings."""
+    text = message.lower() if message.isascii() else unicodedata.normalize("NFKC", message).lower()
+    text = text.replace("’", "'").replace("‘", "'").replace("`", "'")
+    text = _REPEAT_RE.sub(r"\1", text)
+    text = _VARIANT_RE.sub(lambda m: SPELLING_VARIANTS[m.group(0)], text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _build_matcher() -> KeywordAutomaton:
+    matcher = KeywordAutomaton()
+    for keyword in HIGH_CONFIDENCE_CRISIS_KEYWORDS:
+        matcher.add(normalize_message(keyword), ("crisis", keyword))
+    for phrase in EXCLUSION_PHRASES:
+        matcher.add(normalize_message(phrase), ("exclude", phrase))
+    for stem in RISK_STEMS:
+        # Stems match at the start of a word only ("suicid" -> suicidal, suicide)
+        matcher.add(stem, ("risk", stem), start_boundary=True, end_boundary=False)
+    for trigger in PATTERN_TRIGGERS:
+        matcher.add(trigger, ("trigger", trigger), start_boundary=True, end_boundary=False)
+    matcher.build()
+    return matcher
+
+
+# Built once at import; reused for every message
+_MATCHER = _build_matcher()
+_COMPILED_PATTERNS = [re.compile(p) for p in CRISIS_PATTERNS]
+
+
+def classify_locally(message: str):
+    """
+    In-process crisis triage, with no network call.
+
+    Returns a tuple of (verdict, detail) where verdict is one of:
+        "crisis"   - a high-confidence crisis keyword matched (detail: the keyword)
+        "excluded" - an exclusion phrase matched (detail: the phrase)
+        "suspect"  - a CRISIS_PATTERNS regex or risk stem matched; needs the remote check
+        "benign"   - a greeting or acknowledgement from BENIGN_MESSAGES
+        "unknown"  - nothing matched; only the remote check can clear it
+    """
+    text = normalize_message(message)
+    hits = _MATCHER.payloads(text)
+
+    crisis = [detail for kind, detail in hits if kind == "crisis"]
+    if crisis:
+        return "crisis", crisis[0]
+    excluded = [detail for kind, detail in hits if kind == "exclude"]
+    if excluded:
+        return "excluded", excluded[0]
+    # Every CRISIS_PATTERNS regex needs one of the trigger words, so skip them when none occurred
+    if any(kind == "trigger" for kind, _ in hits):
+        for pattern in _COMPILED_PATTERNS:
+            if pattern.search(text):
+                return "suspect", pattern.pattern
+    risky = [detail for kind, detail in hits if kind == "risk"]
+    if risky:
+        return "suspect", risky[0]
+    if _TRAILING_PUNCT_RE.sub("", text) in BENIGN_MESSAGES:
+        return "benign", None
+    return "unknown", None
+
+
 def check_for_crisis(message: str):
     """
     Enhanced function to check for crisis messages using a dedicated Gemini function.
     The function uses a specialized prompt designed specifically for crisis detection.
+    A precompiled local matcher runs first: high-confidence keyword hits return
+    immediately, and (under the local_first policy) plain greetings and
+    acknowledgements skip the Gemini call.
     
     Args:
         message: The user message to check
@@ -53,16 +191,18 @@ def check_for_crisis(message: str):
     """
     if not message or not message.strip():
         return False, None
-    
-    message_lower = message.lower()
-    
-    # Check for exclusion phrases first
-    for phrase in EXCLUSION_PHRASES:
-        if phrase.lower() in message_lower:
-            print(f"Not a crisis: contains exclusion phrase - '{phrase}'")
-            return False, None
-    
-    # First try the dedicated Gemini crisis detection function
+
+    verdict, detail = classify_locally(message)
+    if verdict == "crisis":
+        print(f"Crisis detected by local keyword: {detail}")
+        return True, "local_keyword_match"
+    if verdict == "excluded":
+        print(f"Not a crisis: contains exclusion phrase - '{detail}'")
+        return False, None
+    if verdict == "benign" and PREFILTER_POLICY == "local_first":
+        return False, None
+
+    # Otherwise ask the dedicated Gemini crisis detection function
     is_crisis, confidence, reasoning = detect_crisis(message)
     
     if is_crisis:
@@ -70,11 +210,37 @@ def check_for_crisis(message: str):
         print(f"Crisis detected by Gemini API: {confidence_pct}% confidence - {reasoning}")
         return True, f"gemini_crisis_detection:{confidence_pct}"
     
-    # Fallback: Basic keyword matching if for some reason Gemini doesn't detect it
-    for keyword in FALLBACK_CRISIS_KEYWORDS:
-        if keyword.lower() in message_lower:
-            print(f"Crisis detected by fallback keyword: {keyword}")
-            return True, "fallback_keyword_match"
-    
     # No crisis detected
     return False, None
+
+
+def run_with_crisis_check(message: str, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) (typically a Gemini reply) while the crisis check is in flight.
+
+    In speculative mode fn starts on the shared executor at the same time as
+    check_for_crisis; if the check is positive, fn is cancelled (or its result
+    discarded) so the caller can return the static crisis payload. Otherwise the
+    result is returned as soon as both have finished.
+
+    Returns:
+        A tuple of (is_crisis, reason, result); result is None when is_crisis is True
+    """
+    if not SPECULATIVE_CRISIS_CHECK:
+        is_crisis, reason = check_for_crisis(message)
+        if is_crisis:
+            return True, reason, None
+        return False, None, fn(*args, **kwargs)
+
+    future = submit(fn, *args, **kwargs)
+    try:
+        is_crisis, reason = check_for_crisis(message)
+    except Exception:
+        future.cancel()
+        raise
+
+    if is_crisis:
+        # Drops the call if it has not started yet; a running call's result is discarded
+        future.cancel()
+        return True, reason, None
+    return False, None, future.result()
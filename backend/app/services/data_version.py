@@ -0,0 +1,64 @@
+"""
+data_version.py: Per-user data versions behind conditional GETs.
+
+users/{uid}.dataVersions holds one counter per scope:
+  - moods: mood entries and everything derived from them (rollups, streaks)
+  - sessions: chat sessions and their messages
+Every write that changes what a scope's read endpoints return bumps its
+counter with an Increment, in the same batch or write unit as the write
+itself, so a version is never visible before its data.
+
+A read endpoint reads the counter (one point read) before running its
+queries, and tags the response with a weak ETag derived from it. A request
+whose If-None-Match still matches gets a 304 without the queries. Since the
+version is read first, a response is never older than its tag.
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Any, Optional, Tuple
+
+from firebase_admin import firestore
+
+SCOPE_MOODS = "moods"
+SCOPE_SESSIONS = "sessions"
+VERSIONS_FIELD = "dataVersions"
+
+
+def _user_ref(db, user_id: str):
+    return db.collection("users").document(user_id)
+
+
+def bump(unit, db, user_id: str, scope: str) -> None:
+    """Add a version bump for scope to unit (a WriteUnit or WriteBatch)."""
+    unit.set(_user_ref(db, user_id), {VERSIONS_FIELD: {scope: firestore.Increment(1)}}, merge=True)
+
+
+def bump_now(db, user_id: str, scope: str) -> None:
+    """Bump scope's version in a write of its own, after writes that could not carry it."""
+    _user_ref(db, user_id).set({VERSIONS_FIELD: {scope: firestore.Increment(1)}}, merge=True)
+
+
+def current(db, user_id: str, scope: str) -> Tuple[str, int]:
+    """
+    scope's version as (user document create time, counter). The create time
+    tells versions apart that restart from zero after an account purge.
+    """
+    doc = _user_ref(db, user_id).get(field_paths=[VERSIONS_FIELD])
+    if not doc.exists:
+        return "", 0
+    version = ((doc.to_dict() or {}).get(VERSIONS_FIELD) or {}).get(scope, 0)
+    return (doc.create_time.isoformat() if doc.create_time else ""), version
+
+
+def etag(db, user_id: str, scope: str, *parts: Any, version: Optional[Tuple[str, int]] = None) -> str:
+    """
+    Weak ETag value for a response built from scope's data. parts are whatever
+    else the response depends on (path, query string, current day, ...). The
+    user document's create time is folded in too, so versions restarting from
+    zero after an account purge never match tags issued before it. version is
+    current()'s result when the caller has already read it.
+    """
+    created, version = version if version is not None else current(db, user_id, scope)
+    key = "\x00".join([user_id, created, scope, str(version), *(str(p) for p in parts)])
+    return f"{scope}-{version}-{hashlib.sha256(key.encode()).hexdigest()[:16]}"
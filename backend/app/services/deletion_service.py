@@ -0,0 +1,173 @@
+"""
+deletion_service.py: Batched deletion of chat sessions and whole accounts, optionally as tracked jobs.
+
+Documents are deleted in batches of up to DELETE_BATCH_SIZE per commit,
+children before parents: a session's messages go before the session document,
+and an account's sessions and other subcollections before users/{uid} and
+userinfo/{uid}. A deletion cut short (timeout, crash, Firestore error) never
+leaves orphans behind an already-deleted parent, and running it again picks up
+what is left.
+
+Long deletions run as jobs on the shared executor. Each job is tracked in a
+deletionJobs/{jobId} document (owner, kind, status, progress counters, error), so
+any worker can answer a status request. The owner is a hash of the uid, and the
+session ids a job deletes are removed from its document once it finishes, so a
+finished job names neither the user nor the sessions it deleted. Job documents
+carry an expiresAt for a Firestore TTL policy.
+"""
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+from app.services import data_version, message_store
+from app.services.transcript_cache import await_pending_writes, invalidate
+from app.utils.concurrency import submit_background
+from app.utils.encryption import hash_string
+
+# Firestore allows 500 writes per commit
+DELETE_BATCH_SIZE = 500
+# Most sessions one bulk request may delete
+MAX_SESSIONS_PER_JOB = int(os.environ.get("SAKHI_DELETE_MAX_SESSIONS", "500"))
+JOB_RETENTION_DAYS = int(os.environ.get("SAKHI_DELETE_JOB_RETENTION_DAYS", "7"))
+
+JOBS_COLLECTION = "deletionJobs"
+KIND_SESSIONS = "sessions"
+KIND_ACCOUNT = "account"
+
+
+def delete_in_batches(db, query, batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """
+    Delete every document matched by query (a collection or query), batch_size
+    per commit. Each batch is a fresh query, so no long-lived stream can time
+    out partway through. Returns the number of documents deleted.
+    """
+    deleted = 0
+    while True:
+        docs = list(query.select([]).limit(batch_size).stream())
+        if not docs:
+            return deleted
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        deleted += len(docs)
+        if len(docs) < batch_size:
+            return deleted
+
+
+def delete_session(db, user_id: str, session_id: str) -> int:
+    """Delete a session's messages (either layout), then its document. Returns documents deleted."""
+    # Let this worker's queued turns to the session land first so they cannot recreate it afterwards
+    await_pending_writes(user_id, session_id)
+    deleted = message_store.delete_messages(db, user_id, session_id)
+    message_store.session_ref(db, user_id, session_id).delete()
+    # After the deletes, so no tag for the new version can describe the old data
+    data_version.bump_now(db, user_id, data_version.SCOPE_SESSIONS)
+    invalidate(user_id, session_id)
+    return deleted + 1
+
+
+def delete_sessions(db, user_id: str, session_ids: Iterable[str],
+                    progress: Optional[Callable[[int, int], None]] = None) -> Tuple[int, int]:
+    """Delete several sessions. Returns (sessions deleted, documents deleted)."""
+    sessions = documents = 0
+    for session_id in session_ids:
+        documents += delete_session(db, user_id, session_id)
+        sessions += 1
+        if progress is not None:
+            progress(sessions, documents)
+    return sessions, documents
+
+
+def purge_account(db, user_id: str, progress: Optional[Callable[[int, int], None]] = None) -> Tuple[int, int]:
+    """
+    Delete everything stored for a user: every session and its messages, every
+    other subcollection of users/{uid} (moods, ...), users/{uid} and
+    userinfo/{uid}. Returns (sessions deleted, documents deleted).
+    """
+    user_ref = db.collection("users").document(user_id)
+    session_ids = [doc.id for doc in user_ref.collection("sessions").select([]).stream()]
+    sessions, documents = delete_sessions(db, user_id, session_ids, progress)
+    for collection in user_ref.collections():
+        if collection.id != "sessions":
+            documents += delete_in_batches(db, collection)
+    # Last, and nothing rewrites it: ETags include its create time, so any later
+    # write recreating it retires every tag issued before the purge
+    user_ref.delete()
+    db.collection("userinfo").document(user_id).delete()
+    return sessions, documents + 2
+
+
+def _job_ref(db, job_id: str):
+    return db.collection(JOBS_COLLECTION).document(job_id)
+
+
+def _owner(user_id: str) -> str:
+    return hash_string(user_id)
+
+
+def _run_job(db, job_id: str, user_id: str, kind: str, session_ids: List[str]) -> None:
+    ref = _job_ref(db, job_id)
+
+    def progress(sessions_done: int, deleted_docs: int) -> None:
+        ref.update({"sessionsDone": sessions_done, "deletedDocs": deleted_docs,
+                    "updatedAt": firestore.SERVER_TIMESTAMP})
+
+    ref.update({"status": "running", "updatedAt": firestore.SERVER_TIMESTAMP})
+    try:
+        if kind == KIND_ACCOUNT:
+            sessions, documents = purge_account(db, user_id, progress)
+        else:
+            sessions, documents = delete_sessions(db, user_id, session_ids, progress)
+        ref.update({"status": "done", "sessionsDone": sessions, "deletedDocs": documents,
+                    "sessionIds": firestore.DELETE_FIELD, "updatedAt": firestore.SERVER_TIMESTAMP})
+    except Exception as e:
+        logging.exception(f"Deletion job {job_id} ({kind}) failed")
+        # The exception's message can carry document paths, so the record keeps only its type
+        ref.update({"status": "failed", "error": type(e).__name__,
+                    "sessionIds": firestore.DELETE_FIELD, "updatedAt": firestore.SERVER_TIMESTAMP})
+
+
+def start_job(db, user_id: str, kind: str, session_ids: Optional[List[str]] = None) -> str:
+    """
+    Record a deletion job and run it on the shared executor. When the pool is
+    saturated the job runs inline, so it has finished by the time this returns.
+    Returns the job id.
+    """
+    session_ids = list(session_ids or [])
+    ref = db.collection(JOBS_COLLECTION).document()
+    ref.set({
+        "owner": _owner(user_id),
+        "kind": kind,
+        "status": "queued",
+        "sessionIds": session_ids,
+        "sessionsTotal": len(session_ids) if kind == KIND_SESSIONS else None,
+        "sessionsDone": 0,
+        "deletedDocs": 0,
+        "error": None,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+        "expiresAt": datetime.now(timezone.utc) + timedelta(days=JOB_RETENTION_DAYS),
+    })
+    if submit_background(_run_job, db, ref.id, user_id, kind, session_ids) is None:
+        _run_job(db, ref.id, user_id, kind, session_ids)
+    return ref.id
+
+
+def get_job(db, user_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+    """A job's status, or None if it does not exist or belongs to another user."""
+    doc = _job_ref(db, job_id).get()
+    data = doc.to_dict() if doc.exists else None
+    if not data or data.get("owner") != _owner(user_id):
+        return None
+    job = {"id": doc.id, **{k: v for k, v in data.items()
+                            if k not in ("owner", "sessionIds", "expiresAt")}}
+    for field in ("createdAt", "updatedAt"):
+        if hasattr(job.get(field), "isoformat"):
+            job[field] = job[field].isoformat()
+    return job
@@ -0,0 +1,324 @@
+"""
+message_store.py: Chat message storage layouts behind one interface.
+
+Two layouts are supported per session:
+  - "docs":    one document per message in sessions/{sid}/messages (the original layout)
+  - "chunked": messages appended to chunk documents in sessions/{sid}/chunks, up to
+               MESSAGE_CHUNK_SIZE per document, so reading a long history costs one
+               read per chunk instead of one per message, and deleting it one delete
+               per chunk
+
+A session's layout is recorded on its document as messageLayout (missing means
+"docs"), together with the open chunk (chunkSeq), its fill (chunkCount) and its
+approximate size (chunkBytes). A chunk is closed once it holds
+MESSAGE_CHUNK_SIZE messages or MESSAGE_CHUNK_MAX_BYTES of them, well under
+Firestore's 1 MiB document limit, and stored message texts are capped at
+MAX_MESSAGE_CHARS. New sessions use SAKHI_MESSAGE_LAYOUT. Chunk documents hold
+a messages array of {id, author, text, timestamp} maps plus seq, count,
+firstTimestamp and lastTimestamp; reads order chunks by lastTimestamp (by
+firstTimestamp when paging back from a cursor). Existing sessions can be converted with
+`python -m tools.migrate_message_layout`.
+
+Callers pass the session's layout state, a dict from layout_state(), which
+chat turns keep in the transcript cache so reads need not fetch the session
+document. Appending to an existing chunked session allocates its chunk slot in
+a transaction on the session document instead, since another worker may have
+appended since this worker's state was cached.
+"""
+from __future__ import annotations
+
+import math
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+LAYOUT_DOCS = "docs"
+LAYOUT_CHUNKED = "chunked"
+
+NEW_SESSION_LAYOUT = os.environ.get("SAKHI_MESSAGE_LAYOUT", LAYOUT_DOCS).strip().lower()
+MESSAGE_CHUNK_SIZE = int(os.environ.get("SAKHI_MESSAGE_CHUNK_SIZE", "50"))
+MESSAGE_CHUNK_MAX_BYTES = int(os.environ.get("SAKHI_MESSAGE_CHUNK_MAX_BYTES", str(512 * 1024)))
+# Longest message text stored; chat routes reject longer user messages
+MAX_MESSAGE_CHARS = int(os.environ.get("SAKHI_MAX_MESSAGE_CHARS", "8000"))
+
+# Stored size of a chunked message besides its text (id, author, timestamp, field names)
+_MESSAGE_OVERHEAD_BYTES = 120
+_CHUNK_STATE_FIELDS = ["messageLayout", "chunkSeq", "chunkCount", "chunkBytes"]
+
+# Length of the lastMessagePreview kept on session documents for the sidebar
+PREVIEW_CHARS = 120
+
+
+def session_ref(db, user_id: str, session_id: str):
+    return db.collection("users").document(user_id).collection("sessions").document(session_id)
+
+
+def preview(text: str) -> str:
+    """Single-line, length-capped message preview for session listings."""
+    text = " ".join((text or "").split())
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS - 1].rstrip() + "…"
+
+
+def layout_state(session_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Layout state of a session from its document data (None for a session that does not exist yet)."""
+    if session_data is None:
+        return new_session_state()
+    if session_data.get("messageLayout") == LAYOUT_CHUNKED:
+        return {
+            "layout": LAYOUT_CHUNKED,
+            "chunkSeq": int(session_data.get("chunkSeq") or 0),
+            "chunkCount": int(session_data.get("chunkCount") or 0),
+            "chunkBytes": int(session_data.get("chunkBytes") or 0),
+        }
+    return {"layout": LAYOUT_DOCS}
+
+
+def new_session_state() -> Dict[str, Any]:
+    if NEW_SESSION_LAYOUT == LAYOUT_CHUNKED:
+        return {"layout": LAYOUT_CHUNKED, "chunkSeq": 0, "chunkCount": 0, "chunkBytes": 0}
+    return {"layout": LAYOUT_DOCS}
+
+
+def message_bytes(messages: List[Dict[str, Any]]) -> int:
+    """Approximate stored size of messages in a chunk document."""
+    return sum(len((m.get("text") or "").encode("utf-8")) + _MESSAGE_OVERHEAD_BYTES for m in messages)
+
+
+def _cap(text: str) -> str:
+    return text if len(text) <= MAX_MESSAGE_CHARS else text[:MAX_MESSAGE_CHARS]
+
+
+def _chunk_id(seq: int) -> str:
+    return f"{seq:06d}"
+
+
+def _new_message_id() -> str:
+    return uuid.uuid4().hex[:20]
+
+
+def _by_time(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return sorted((m for m in messages if m.get("timestamp") is not None), key=lambda m: m["timestamp"])
+
+
+def _doc_message(doc) -> Dict[str, Any]:
+    data = doc.to_dict() or {}
+    return {"id": doc.id, "author": data.get("author"), "text": data.get("text", ""), "timestamp": data.get("timestamp")}
+
+
+def _chunk_messages(docs) -> List[Dict[str, Any]]:
+    messages = []
+    for doc in docs:
+        messages.extend((doc.to_dict() or {}).get("messages") or [])
+    return messages
+
+
+def read_recent(db, user_id: str, session_id: str, state: Dict[str, Any], limit: int,
+                after: Any = None) -> List[Dict[str, Any]]:
+    """The newest `limit` messages (newer than `after`, if given), oldest first."""
+    ref = session_ref(db, user_id, session_id)
+    if state.get("layout") == LAYOUT_CHUNKED:
+        query = ref.collection("chunks")
+        if after is not None:
+            query = query.where("lastTimestamp", ">", after)
+        chunks = query.order_by("lastTimestamp", direction="DESCENDING").limit(
+            math.ceil(limit / MESSAGE_CHUNK_SIZE) + 1).stream()
+        messages = _by_time(_chunk_messages(chunks))
+        if after is not None:
+            messages = [m for m in messages if m["timestamp"] > after]
+        return messages[-limit:]
+
+    query = ref.collection("messages")
+    if after is not None:
+        query = query.where("timestamp", ">", after)
+    messages = [_doc_message(doc) for doc in
+                query.order_by("timestamp", direction="DESCENDING").limit(limit).stream()]
+    messages.reverse()
+    return messages
+
+
+def read_oldest(db, user_id: str, session_id: str, state: Dict[str, Any], limit: int,
+                after: Any = None) -> List[Dict[str, Any]]:
+    """The oldest `limit` messages newer than `after`, oldest first."""
+    ref = session_ref(db, user_id, session_id)
+    if state.get("layout") == LAYOUT_CHUNKED:
+        query = ref.collection("chunks")
+        if after is not None:
+            query = query.where("lastTimestamp", ">", after)
+        chunks = query.order_by("lastTimestamp").limit(math.ceil(limit / MESSAGE_CHUNK_SIZE) + 1).stream()
+        messages = _by_time(_chunk_messages(chunks))
+        if after is not None:
+            messages = [m for m in messages if m["timestamp"] > after]
+        return messages[:limit]
+
+    query = ref.collection("messages")
+    if after is not None:
+        query = query.where("timestamp", ">", after)
+    return [_doc_message(doc) for doc in query.order_by("timestamp").limit(limit).stream()]
+
+
+def _page_key(message: Dict[str, Any]) -> Tuple[Any, str]:
+    return message["timestamp"], message.get("id") or ""
+
+
+def page_before(messages: List[Dict[str, Any]], limit: int,
+                before: Optional[Tuple[Any, str]] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    The newest `limit` of `messages` sorting before the (timestamp, id) key
+    `before`, oldest first, and whether older ones remain.
+    """
+    ordered = sorted((m for m in messages if m.get("timestamp") is not None), key=_page_key)
+    if before is not None:
+        ordered = [m for m in ordered if _page_key(m) < before]
+    return ordered[-limit:], len(ordered) > limit
+
+
+def read_page(db, user_id: str, session_id: str, state: Dict[str, Any], limit: int,
+              before: Optional[Tuple[Any, str]] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    One page of history for reverse loading: the newest `limit` messages sorting
+    before the (timestamp, id) key of the oldest message on the previous page
+    (the newest messages when `before` is None), oldest first, and whether older
+    messages remain. The cost is about `limit` reads (docs) or a few chunk reads
+    (chunked), however long the session.
+    """
+    ref = session_ref(db, user_id, session_id)
+    if state.get("layout") == LAYOUT_CHUNKED:
+        # A turn is never split, so a closed chunk holds at least MESSAGE_CHUNK_SIZE - 1
+        # messages; one more chunk covers the part of the page in the cursor's chunk
+        chunks = math.ceil((limit + 1) / max(1, MESSAGE_CHUNK_SIZE - 1)) + 1
+        query = ref.collection("chunks")
+        if before is None:
+            query = query.order_by("lastTimestamp", direction="DESCENDING")
+        else:
+            query = (query.where("firstTimestamp", "<=", before[0])
+                     .order_by("firstTimestamp", direction="DESCENDING"))
+        return page_before(_chunk_messages(query.limit(chunks).stream()), limit, before)
+
+    query = (ref.collection("messages")
+             .order_by("timestamp", direction="DESCENDING")
+             .order_by("__name__", direction="DESCENDING"))
+    if before is not None:
+        query = query.start_after({"timestamp": before[0], "__name__": before[1]})
+    # One extra message tells whether there is an older page
+    messages = [_doc_message(doc) for doc in query.limit(limit + 1).stream()]
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    messages.reverse()
+    return messages, has_more
+
+
+def read_all(db, user_id: str, session_id: str, state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Every message of the session, oldest first."""
+    ref = session_ref(db, user_id, session_id)
+    if state.get("layout") == LAYOUT_CHUNKED:
+        return _by_time(_chunk_messages(ref.collection("chunks").order_by("lastTimestamp").stream()))
+    return [_doc_message(doc) for doc in ref.collection("messages").order_by("timestamp").stream()]
+
+
+def _slot(state: Dict[str, Any]) -> Tuple[int, int, int]:
+    return int(state.get("chunkSeq") or 0), int(state.get("chunkCount") or 0), int(state.get("chunkBytes") or 0)
+
+
+def _next_state(state: Dict[str, Any], written: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Layout state after appending written to the open chunk of state, or to a new chunk if it is full."""
+    seq, count, size = _slot(state)
+    added = message_bytes(written)
+    # A turn is never split across chunks; an over-full open chunk starts the next one
+    if count and (count + len(written) > MESSAGE_CHUNK_SIZE or size + added > MESSAGE_CHUNK_MAX_BYTES):
+        seq, count, size = seq + 1, 0, 0
+    return {"layout": LAYOUT_CHUNKED, "chunkSeq": seq, "chunkCount": count + len(written),
+            "chunkBytes": size + added}
+
+
+def _reserve(db, ref, state: Dict[str, Any], written: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Allocate the chunk slot for written in a transaction on the session document.
+    Starts from the later of state (ahead of Firestore while this worker's turns
+    are queued) and the stored state (ahead when another worker has appended).
+    """
+    @firestore.transactional
+    def reserve(transaction) -> Dict[str, Any]:
+        snapshot = ref.get(field_paths=_CHUNK_STATE_FIELDS, transaction=transaction)
+        stored = layout_state(snapshot.to_dict() if snapshot.exists else None)
+        new_state = _next_state(max(state, stored, key=_slot), written)
+        transaction.set(ref, {field: new_state[field] for field in ("chunkSeq", "chunkCount", "chunkBytes")},
+                        merge=True)
+        return new_state
+
+    return reserve(db.transaction())
+
+
+def append_messages(unit, db, user_id: str, session_id: str, state: Dict[str, Any],
+                    messages: List[Dict[str, Any]], new_session: bool = False
+                    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any], Dict[str, Any]]:
+    """
+    Record writes appending messages ({author, text, timestamp}, oldest first) to
+    unit (a WriteUnit or WriteBatch). Timestamps must be concrete datetimes;
+    texts longer than MAX_MESSAGE_CHARS are cut.
+
+    Returns (messages with ids, the new layout state, fields to merge into the
+    session document in the same unit). For an existing chunked session the
+    slot is allocated (and the session's chunk fields written) by a transaction
+    before this returns, so there are no such fields.
+    """
+    ref = session_ref(db, user_id, session_id)
+    messages = [{**message, "text": _cap(message["text"] or "")} for message in messages]
+    if state.get("layout") != LAYOUT_CHUNKED:
+        written = []
+        for message in messages:
+            message_ref = ref.collection("messages").document()
+            unit.set(message_ref, {"author": message["author"], "text": message["text"],
+                                   "timestamp": message["timestamp"]})
+            written.append({"id": message_ref.id, **message})
+        return written, dict(state), {}
+
+    written = [{"id": _new_message_id(), **message} for message in messages]
+    if new_session:
+        new_state = _next_state(state, written)
+        session_fields = {"messageLayout": LAYOUT_CHUNKED, **{
+            field: new_state[field] for field in ("chunkSeq", "chunkCount", "chunkBytes")}}
+    else:
+        new_state = _reserve(db, ref, state, written)
+        session_fields = {}
+    seq = new_state["chunkSeq"]
+    count = new_state["chunkCount"] - len(written)
+
+    chunk = {
+        "seq": seq,
+        "messages": firestore.ArrayUnion(written),
+        "count": firestore.Increment(len(written)),
+        "lastTimestamp": written[-1]["timestamp"],
+    }
+    if count == 0:
+        chunk["firstTimestamp"] = written[0]["timestamp"]
+    unit.set(ref.collection("chunks").document(_chunk_id(seq)), chunk, merge=True)
+    return written, new_state, session_fields
+
+
+def delete_messages(db, user_id: str, session_id: str, collections=("messages", "chunks")) -> int:
+    """Delete every message document and chunk of a session, in batches. Returns documents deleted."""
+    # Imported here: deletion_service builds on this module
+    from app.services.deletion_service import delete_in_batches
+
+    ref = session_ref(db, user_id, session_id)
+    return sum(delete_in_batches(db, ref.collection(collection)) for collection in collections)
+
+
+def chunk_messages(messages: List[Dict[str, Any]], chunk_size: int = MESSAGE_CHUNK_SIZE) -> List[Dict[str, Any]]:
+    """Chunk documents holding `messages` (oldest first, with ids), for migrating a session."""
+    parts = []
+    for message in messages:
+        message = {**message, "text": _cap(message.get("text") or "")}
+        if (not parts or len(parts[-1]) >= chunk_size
+                or message_bytes(parts[-1] + [message]) > MESSAGE_CHUNK_MAX_BYTES):
+            parts.append([])
+        parts[-1].append(message)
+    return [{
+        "seq": seq,
+        "messages": part,
+        "count": len(part),
+        "firstTimestamp": part[0]["timestamp"],
+        "lastTimestamp": part[-1]["timestamp"],
+    } for seq, part in enumerate(parts)]
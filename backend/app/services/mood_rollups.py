@@ -0,0 +1,209 @@
+"""
+mood_rollups.py: Materialized daily and monthly mood aggregates.
+
+Every mood entry write also updates two aggregate documents for the entry's
+UTC day:
+  - users/{uid}/moodRollups/{YYYY-MM-DD}:
+        date, sum, count, min, max, labels ({label: count}),
+        hist ({"1".."10": count of scores rounding to that value})
+  - users/{uid}/moodRollupMonths/{YYYY-MM}:
+        days: {DD: {sum, count, min, max, labels, hist}}
+
+A new entry is added with field transforms (Increment, Minimum, Maximum) and no
+reads, so it can ride in the same write batch as the entry, including the chat
+write-behind queue. Editing or deleting an entry recomputes its day from that
+day's entries.
+
+Stats then cost one read per day with entries, or one read per month for long
+windows, instead of one read per entry. The current streak is derived from the
+day rollups when stats are read (current_streak), so it is never stale, however
+entries were backdated, edited or deleted, and by whichever worker. Existing
+entries can be rolled up with `python -m tools.backfill_mood_rollups`.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from app.services import data_version
+
+DAYS_COLLECTION = "moodRollups"
+MONTHS_COLLECTION = "moodRollupMonths"
+
+# Longest label kept as a histogram key
+_MAX_LABEL_CHARS = 40
+# Day rollups read per query while a streak runs back past the days already read
+_STREAK_PAGE_DAYS = 60
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def day_key(timestamp: datetime) -> str:
+    """UTC calendar day of a timestamp, as YYYY-MM-DD."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.date().isoformat()
+
+
+def label_key(label: Any) -> str:
+    return str(label or "unknown").strip().lower()[:_MAX_LABEL_CHARS] or "unknown"
+
+
+def score_bin(score: float) -> str:
+    """Histogram key of a score: the nearest whole score, clamped to 1..10."""
+    return str(min(10, max(1, int(score + 0.5))))
+
+
+def _user_ref(db, user_id: str):
+    return db.collection("users").document(user_id)
+
+
+def day_ref(db, user_id: str, day: str):
+    return _user_ref(db, user_id).collection(DAYS_COLLECTION).document(day)
+
+
+def month_ref(db, user_id: str, day: str):
+    return _user_ref(db, user_id).collection(MONTHS_COLLECTION).document(day[:7])
+
+
+def _previous_day(day: str) -> str:
+    return (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+
+
+def record_entry(unit, db, user_id: str, label: Any, score: float, timestamp: datetime) -> None:
+    """
+    Add writes folding one new mood entry into its day and month rollups to
+    unit (a WriteUnit or WriteBatch). Reads nothing.
+    """
+    day = day_key(timestamp)
+    label = label_key(label)
+    unit.set(day_ref(db, user_id, day), {
+        "date": day,
+        "sum": firestore.Increment(score),
+        "count": firestore.Increment(1),
+        "min": firestore.Minimum(score),
+        "max": firestore.Maximum(score),
+        "labels": {label: firestore.Increment(1)},
+        "hist": {score_bin(score): firestore.Increment(1)},
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+    unit.set(month_ref(db, user_id, day), {
+        "month": day[:7],
+        "days": {day[8:]: {
+            "sum": firestore.Increment(score),
+            "count": firestore.Increment(1),
+            "min": firestore.Minimum(score),
+            "max": firestore.Maximum(score),
+            "labels": {label: firestore.Increment(1)},
+            "hist": {score_bin(score): firestore.Increment(1)},
+        }},
+    }, merge=True)
+
+
+def aggregate_entries(entries: Iterable[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Rollup fields (sum, count, min, max, labels, hist) of some entries; None if none has a score."""
+    scores = []
+    labels: Dict[str, int] = {}
+    hist: Dict[str, int] = {}
+    for entry in entries:
+        if not isinstance(entry.get("score"), (int, float)):
+            continue
+        scores.append(entry["score"])
+        key = label_key(entry.get("label"))
+        labels[key] = labels.get(key, 0) + 1
+        key = score_bin(entry["score"])
+        hist[key] = hist.get(key, 0) + 1
+    if not scores:
+        return None
+    return {"sum": sum(scores), "count": len(scores), "min": min(scores), "max": max(scores),
+            "labels": labels, "hist": hist}
+
+
+def day_entries(db, user_id: str, day: str) -> List[Dict[str, Any]]:
+    """The mood entries of one UTC day."""
+    start = datetime.fromisoformat(day).replace(tzinfo=timezone.utc)
+    query = (_user_ref(db, user_id).collection("moods")
+             .where("timestamp", ">=", start)
+             .where("timestamp", "<", start + timedelta(days=1))
+             .select(["score", "label"]))
+    return [doc.to_dict() or {} for doc in query.stream()]
+
+
+def write_day(db, user_id: str, day: str, aggregate: Optional[Dict[str, Any]], batch=None) -> None:
+    """Replace one day's rollup and its slot in the month rollup (removing both when aggregate is None)."""
+    own_batch = batch is None
+    batch = batch if batch is not None else db.batch()
+    slot = FieldPath("days", day[8:]).to_api_repr()
+    if aggregate is None:
+        batch.delete(day_ref(db, user_id, day))
+        batch.set(month_ref(db, user_id, day), {"days": {day[8:]: firestore.DELETE_FIELD}}, merge=[slot])
+    else:
+        batch.set(day_ref(db, user_id, day), {
+            "date": day, **aggregate, "updatedAt": firestore.SERVER_TIMESTAMP,
+        })
+        batch.set(month_ref(db, user_id, day), {"month": day[:7], "days": {day[8:]: aggregate}},
+                  merge=["month", slot])
+    data_version.bump(batch, db, user_id, data_version.SCOPE_MOODS)
+    if own_batch:
+        batch.commit()
+
+
+def recompute_day(db, user_id: str, day: str) -> None:
+    """Rebuild one day's rollups from its entries, after an entry was edited or deleted."""
+    write_day(db, user_id, day, aggregate_entries(day_entries(db, user_id, day)))
+
+
+def read_days(db, user_id: str, first_day: str) -> Dict[str, Dict[str, Any]]:
+    """Day rollups from first_day through today: {day: {sum, count, min, max, labels, hist}}."""
+    docs = (_user_ref(db, user_id).collection(DAYS_COLLECTION)
+            .where("date", ">=", first_day).order_by("date").stream())
+    return {doc.id: doc.to_dict() or {} for doc in docs}
+
+
+def read_days_by_month(db, user_id: str, first_day: str) -> Dict[str, Dict[str, Any]]:
+    """Like read_days, from the month rollups (one read per month)."""
+    docs = (_user_ref(db, user_id).collection(MONTHS_COLLECTION)
+            .where(FieldPath.document_id(), ">=", month_ref(db, user_id, first_day)).stream())
+    days = {}
+    for doc in docs:
+        for dd, aggregate in ((doc.to_dict() or {}).get("days") or {}).items():
+            day = f"{doc.id}-{dd}"
+            if day >= first_day and aggregate.get("count"):
+                days[day] = aggregate
+    return dict(sorted(days.items()))
+
+
+def current_streak(db, user_id: str, days: Optional[Dict[str, Dict[str, Any]]] = None,
+                   first_day: Optional[str] = None) -> int:
+    """
+    Consecutive days with entries ending today (0 without an entry today).
+    `days` are rollups already read for first_day through today (first_day
+    defaults to the earliest of them); older day rollups are read, a page at a
+    time, only while the streak runs back past first_day.
+    """
+    day = day_key(utc_now())
+    streak = 0
+    if days is not None:
+        first_day = first_day or min(days, default=day)
+        while day >= first_day:
+            if not (days.get(day) or {}).get("count"):
+                return streak
+            streak += 1
+            day = _previous_day(day)
+    days_ref = _user_ref(db, user_id).collection(DAYS_COLLECTION)
+    while True:
+        docs = list(days_ref.where("date", "<=", day).order_by("date", direction="DESCENDING")
+                    .select(["date", "count"]).limit(_STREAK_PAGE_DAYS).stream())
+        for doc in docs:
+            data = doc.to_dict() or {}
+            if data.get("date") != day or not data.get("count"):
+                return streak
+            streak += 1
+            day = _previous_day(day)
+        if len(docs) < _STREAK_PAGE_DAYS:
+            return streak
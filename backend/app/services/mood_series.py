@@ -0,0 +1,168 @@
+"""
+mood_series.py: Downsampled mood time series for charts.
+
+A series covers a fixed number of day, week (Monday-based) or month buckets
+ending with the current one, all in UTC. Each bucket reports count, mean, min,
+max and percentiles of the mood scores in it. Empty buckets are included with
+count 0, so a chart always gets the same number of points.
+
+The aggregation is vectorized with NumPy:
+  - from rollups: the day (or month) rollups are stacked into arrays and merged
+    into buckets with bincount / ufunc.at; percentiles come from the merged
+    per-day score histograms, so they are whole scores
+  - from entries: used when a rollup in range predates the histograms; scores
+    are sorted once by (bucket, score) and every bucket's percentiles are
+    picked by index
+Both use the nearest-rank (inverted CDF) definition of a percentile.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+RESOLUTIONS = ("day", "week", "month")
+DEFAULT_BUCKETS = {"day": 30, "week": 26, "month": 12}
+MAX_BUCKETS = 366
+PERCENTILES = (25, 50, 75, 90)
+
+# Monday 1970-01-05; numpy's own datetime64[W] weeks start on Thursdays
+_MONDAY_EPOCH = np.datetime64("1970-01-05", "D")
+_SCORE_VALUES = np.arange(1, 11)
+
+
+def _bucket_index(days: np.ndarray, resolution: str) -> np.ndarray:
+    """Absolute bucket number of each datetime64[D] day."""
+    if resolution == "week":
+        return (days - _MONDAY_EPOCH).astype(np.int64) // 7
+    if resolution == "month":
+        return days.astype("datetime64[M]").astype(np.int64)
+    return days.astype(np.int64)
+
+
+def _bucket_start(index: np.ndarray, resolution: str) -> np.ndarray:
+    """First day (datetime64[D]) of each absolute bucket number."""
+    if resolution == "week":
+        return _MONDAY_EPOCH + index * 7
+    if resolution == "month":
+        return index.astype("datetime64[M]").astype("datetime64[D]")
+    return index.astype("datetime64[D]")
+
+
+def series_range(resolution: str, buckets: int, today: Optional[date] = None) -> Tuple[int, str]:
+    """(absolute number of the first bucket, its first day) for a series ending with today's bucket."""
+    today = today or datetime.now(timezone.utc).date()
+    last = int(_bucket_index(np.array([today], dtype="datetime64[D]"), resolution)[0])
+    first = last - buckets + 1
+    first_day = _bucket_start(np.array([first]), resolution)[0]
+    return first, str(first_day)
+
+
+def _empty(buckets: int) -> Dict[str, np.ndarray]:
+    return {
+        "count": np.zeros(buckets, dtype=np.int64),
+        "sum": np.zeros(buckets),
+        "min": np.full(buckets, np.inf),
+        "max": np.full(buckets, -np.inf),
+        "percentiles": np.full((buckets, len(PERCENTILES)), np.nan),
+    }
+
+
+def aggregate_rollups(rollups: Dict[str, Dict[str, Any]], resolution: str, first: int,
+                      buckets: int) -> Dict[str, np.ndarray]:
+    """Per-bucket arrays from day rollups ({YYYY-MM-DD: {sum, count, min, max, hist}})."""
+    out = _empty(buckets)
+    days = [d for d, r in rollups.items() if r.get("count")]
+    if not days:
+        return out
+    index = _bucket_index(np.array(days, dtype="datetime64[D]"), resolution) - first
+    keep = (index >= 0) & (index < buckets)
+    rows = [rollups[d] for d in days]
+    index = index[keep]
+    counts = np.array([r["count"] for r in rows], dtype=np.int64)[keep]
+    sums = np.array([r["sum"] for r in rows], dtype=float)[keep]
+    mins = np.array([r.get("min", np.inf) for r in rows], dtype=float)[keep]
+    maxs = np.array([r.get("max", -np.inf) for r in rows], dtype=float)[keep]
+    hists = np.array([[(r.get("hist") or {}).get(str(v), 0) for v in _SCORE_VALUES] for r in rows],
+                     dtype=np.int64).reshape(len(rows), len(_SCORE_VALUES))[keep]
+
+    out["count"] = np.bincount(index, weights=counts, minlength=buckets).astype(np.int64)
+    out["sum"] = np.bincount(index, weights=sums, minlength=buckets)
+    np.minimum.at(out["min"], index, mins)
+    np.maximum.at(out["max"], index, maxs)
+
+    merged = np.zeros((buckets, len(_SCORE_VALUES)), dtype=np.int64)
+    np.add.at(merged, index, hists)
+    totals = merged.sum(axis=1)
+    cumulative = merged.cumsum(axis=1)
+    for i, q in enumerate(PERCENTILES):
+        # Nearest rank: the smallest score whose cumulative count reaches ceil(q% of n)
+        rank = np.maximum(1, np.ceil(totals * q / 100.0))
+        position = (cumulative >= rank[:, None]).argmax(axis=1)
+        out["percentiles"][:, i] = np.where(totals > 0, _SCORE_VALUES[position], np.nan)
+    return out
+
+
+def aggregate_entries(timestamps: List[datetime], scores: List[float], resolution: str, first: int,
+                      buckets: int) -> Dict[str, np.ndarray]:
+    """Per-bucket arrays from raw entries (UTC timestamps and their scores)."""
+    out = _empty(buckets)
+    if not scores:
+        return out
+    days = np.array([t.astimezone(timezone.utc).date() if t.tzinfo else t.date() for t in timestamps],
+                    dtype="datetime64[D]")
+    index = _bucket_index(days, resolution) - first
+    values = np.asarray(scores, dtype=float)
+    keep = (index >= 0) & (index < buckets)
+    index, values = index[keep], values[keep]
+    if not len(values):
+        return out
+
+    out["count"] = np.bincount(index, minlength=buckets).astype(np.int64)
+    out["sum"] = np.bincount(index, weights=values, minlength=buckets)
+    np.minimum.at(out["min"], index, values)
+    np.maximum.at(out["max"], index, values)
+
+    # Sorted by bucket, then score: each bucket is a contiguous, ordered run
+    order = np.lexsort((values, index))
+    ordered = values[order]
+    counts = out["count"]
+    starts = np.cumsum(counts) - counts
+    filled = counts > 0
+    for i, q in enumerate(PERCENTILES):
+        rank = np.maximum(1, np.ceil(counts * q / 100.0)).astype(np.int64)
+        out["percentiles"][filled, i] = ordered[(starts + rank - 1)[filled]]
+    return out
+
+
+def to_points(agg: Dict[str, np.ndarray], resolution: str, first: int) -> List[Dict[str, Any]]:
+    """JSON-ready points: one per bucket, in order, with None for empty buckets."""
+    buckets = len(agg["count"])
+    starts = _bucket_start(np.arange(first, first + buckets), resolution)
+    counts = agg["count"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, agg["sum"] / np.maximum(counts, 1), np.nan)
+
+    def value(x: float) -> Optional[float]:
+        return None if not np.isfinite(x) else round(float(x), 2)
+
+    points = []
+    for i in range(buckets):
+        point = {
+            "start": str(starts[i]),
+            "count": int(counts[i]),
+            "mean": value(means[i]),
+            "min": value(agg["min"][i]),
+            "max": value(agg["max"][i]),
+        }
+        for j, q in enumerate(PERCENTILES):
+            point[f"p{q}"] = value(agg["percentiles"][i, j])
+        points.append(point)
+    return points
+
+
+def end_day(resolution: str, first: int, buckets: int) -> str:
+    """Last day covered by a series (inclusive)."""
+    after = _bucket_start(np.array([first + buckets]), resolution)[0]
+    return str(after - np.timedelta64(1, "D"))
@@ -1,20 +1,27 @@
 """
-pulse_service.py: In-memory storage and aggregation for Sukoon Pulse, plus AI summary generation.
+pulse_service.py: Aggregation for Sukoon Pulse, plus AI summary generation.
 
-This keeps anonymous, aggregate-only data per region. No raw text is stored.
+This keeps anonymous, aggregate-only data per region. No raw text is stored,
+and no individual event either: each region keeps hourly buckets covering the
+7-day window, each with a count, a score sum, a 10-bin score histogram and
+per-theme counters. Reporting an event updates one bucket in O(1), and a
+region's storage is fixed by the window length however much traffic it gets.
+
+Buckets and AI summaries live in the pulse store (see pulse_store.py), by
+default a SQLite file shared by every gunicorn worker on the host.
 """
 from __future__ import annotations
 
 import os
+import threading
 import time
 import json
-from collections import Counter, defaultdict
-from typing import Dict, List, Any, Tuple
+from concurrent.futures import Future
+from typing import Dict, List, Any, Optional, Tuple
 
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None  # Will handle gracefully if not available
+from app.llm.client_pool import get_model
+from app.services.pulse_store import WINDOW_HOURS, create_store
+from app.utils.concurrency import submit_background
 
 
 # Allowed theme chips to prevent raw-text storage
@@ -23,13 +30,45 @@ ALLOWED_THEMES = {
     "stress", "social", "money", "health", "career"
 }
 
-# In-memory store: region -> list of events
-_EVENTS: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+# Column of each theme in the buckets' theme counters
+_THEME_NAMES = sorted(ALLOWED_THEMES)
+_THEME_INDEX = {name: i for i, name in enumerate(_THEME_NAMES)}
+
+_TREND_HOURS = 3 * 24
 
-# Cache: region -> {"data": dict, "expires_at": ts}
-_CACHE: Dict[str, Dict[str, Any]] = {}
+# Hourly buckets, the time of each region's last report, and AI summaries:
+# region -> {"summary": aggregate it was made from, "ai": dict, "as_of": ts the
+# aggregate was taken, "expires_at": ts}. A summary older than the region's
+# last report, or expired, is stale: it is still served while one background
+# refresh per region replaces it.
+_STORE = create_store(_THEME_NAMES)
+
+# region -> Future of this worker's running refresh, shared by concurrent requests
+_REFRESHING: Dict[str, Future] = {}
+_CACHE_LOCK = threading.Lock()
 
 _TTL_SECONDS = int(os.environ.get("PULSE_CACHE_TTL", "1800"))  # default 30 min
+# A region's AI summary is regenerated at most once per interval, however busy it is
+_REFRESH_MIN_SECONDS = int(os.environ.get("PULSE_REFRESH_MIN_SECONDS", "300"))  # default 5 min
+# How long a request with nothing cached waits on another request's refresh
+_REFRESH_WAIT_SECONDS = 30
+# Other workers leave a region alone for this long while one refreshes it
+_REFRESH_LEASE_SECONDS = 60
+
+# Earliest time this worker next offers to snapshot the store
+_next_snapshot = 0.0
+
+
+def _reset_state() -> None:
+    # Locks and in-flight refreshes belong to the parent; the child starts clean
+    global _CACHE_LOCK
+    _CACHE_LOCK = threading.Lock()
+    _REFRESHING.clear()
+    _STORE._reset_lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_state)
 
 
 def _now() -> float:
@@ -48,7 +87,8 @@ def report_event(region: str, mood_score: Any, themes: List[str], sid_hash: str)
     region_key = (region or "default").strip() or "default"
     score = _clamp_score(mood_score)
     # Filter themes to allowed set and limit to 5
-    clean_themes = [t for t in (themes or []) if isinstance(t, str) and t.strip().lower() in ALLOWED_THEMES]
+    clean_themes = [t.strip().lower() for t in (themes or [])
+                    if isinstance(t, str) and t.strip().lower() in ALLOWED_THEMES]
     # Deduplicate while keeping order
     seen = set()
     dedup_themes = []
@@ -59,25 +99,44 @@ def report_event(region: str, mood_score: Any, themes: List[str], sid_hash: str)
         if len(dedup_themes) >= 5:
             break
 
-    _EVENTS[region_key].append({
-        "ts": _now(),
-        "score": score,
-        "themes": dedup_themes,
-        "sid": sid_hash,
-    })
+    # Recording it also makes the region's AI summary stale; it is still served until refreshed
+    now = _now()
+    _STORE.add(region_key, now, score, [_THEME_INDEX[t] for t in dedup_themes])
+    _maybe_snapshot(now)
+
 
-    # Trim to last 7 days window on insert
-    cutoff = _now() - 7 * 24 * 3600
-    _EVENTS[region_key] = [e for e in _EVENTS[region_key] if e["ts"] >= cutoff]
+def _maybe_snapshot(now: float) -> None:
+    """Offer a store snapshot in the background, at most once per snapshot interval per worker."""
+    global _next_snapshot
+    snapshot_seconds = getattr(_STORE, "snapshot_seconds", 0)
+    if not getattr(_STORE, "snapshot_path", "") or now < _next_snapshot:
+        return
+    _next_snapshot = now + snapshot_seconds
+    submit_background(_snapshot)
 
-    # Invalidate cache for region
-    _CACHE.pop(region_key, None)
+
+def _snapshot() -> None:
+    try:
+        _STORE.snapshot()
+    except Exception as e:
+        print(f"Pulse snapshot failed: {e}")
 
 
 def _aggregate_region(region: str) -> Dict[str, Any]:
     region_key = (region or "default").strip() or "default"
-    events = _EVENTS.get(region_key, [])
-    if not events:
+    now = _now()
+    buckets = _STORE.buckets(region_key, now)
+    if buckets is not None:
+        # Average across last 7 days
+        week = buckets.window(now, WINDOW_HOURS)
+        count = int(buckets.count[week].sum())
+        total = int(buckets.score_sum[week].sum())
+        theme_counts = buckets.themes[week].sum(axis=0)
+        # Trend: compare avg of last 3 days vs previous 3 days
+        windows = [buckets.window(now, _TREND_HOURS),
+                   buckets.window(now, 2 * _TREND_HOURS, _TREND_HOURS)]
+        trend_sums = [(int(buckets.score_sum[w].sum()), int(buckets.count[w].sum())) for w in windows]
+    if buckets is None or count == 0:
         return {
             "region": region_key,
             "pulse_score": 0,
@@ -86,22 +145,9 @@ def _aggregate_region(region: str) -> Dict[str, Any]:
             "counts": 0,
         }
 
-    # Average across last 7 days
-    scores = [e["score"] for e in events]
-    avg = round(sum(scores) / len(scores), 1)
+    avg = round(total / count, 1)
 
-    # Trend: compare avg of last 3 days vs previous 3 days
-    now = _now()
-    day_secs = 24 * 3600
-    def avg_for_window(start_offset_days: int, length_days: int) -> float:
-        start = now - start_offset_days * day_secs
-        end = start - length_days * day_secs
-        # Window is (end, start]
-        xs = [e["score"] for e in events if end < e["ts"] <= start]
-        return (sum(xs) / len(xs)) if xs else 0.0
-
-    recent = avg_for_window(0, 3)
-    prev = avg_for_window(3, 3)
+    recent, prev = ((s / n) if n else 0.0 for s, n in trend_sums)
     delta = recent - prev
     trend = "flat"
     if delta > 0.2:
@@ -110,10 +156,8 @@ def _aggregate_region(region: str) -> Dict[str, Any]:
         trend = "down"
 
     # Top themes
-    theme_counter = Counter()
-    for e in events:
-        theme_counter.update(e.get("themes", []))
-    top = sorted(theme_counter.items(), key=lambda x: (-x[1], x[0]))[:5]
+    top = sorted(((_THEME_NAMES[i], int(c)) for i, c in enumerate(theme_counts) if c),
+                 key=lambda x: (-x[1], x[0]))[:5]
     top_themes = [{"name": k, "count": v} for k, v in top]
 
     return {
@@ -121,25 +165,13 @@ def _aggregate_region(region: str) -> Dict[str, Any]:
         "pulse_score": avg,
         "trend": trend,
         "top_themes": top_themes,
-        "counts": len(events),
+        "counts": count,
     }
 
 
-def _ensure_genai_configured() -> bool:
-    if genai is None:
-        return False
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        return False
-    try:
-        genai.configure(api_key=api_key)
-        return True
-    except Exception:
-        return False
-
-
 def _call_gemini(summary: Dict[str, Any]) -> Dict[str, Any]:
-    if not _ensure_genai_configured():
+    model = get_model("pulse")
+    if model is None:
         # Fallback safe defaults
         return {
             "ai_summary": "Community pulse available. Try a 60s breathing break and a short study sprint.",
@@ -151,7 +183,6 @@ def _call_gemini(summary: Dict[str, Any]) -> Dict[str, Any]:
             "safety": "low",
         }
 
-    model = genai.GenerativeModel("gemini-2.5-flash")
     system = (
         "You are Sakhi, an empathetic, culturally-aware wellness companion for Indian students. "
         "You receive an anonymous 7-day community aggregate for a region: average mood (1–10), trend (up|down|flat), and top 5 themes (from a fixed list, no raw text). "
@@ -220,22 +251,106 @@ def _call_gemini(summary: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
-def get_or_build_summary(region: str) -> Dict[str, Any]:
-    region_key = (region or "default").strip() or "default"
+def _ai_inputs(summary: Dict[str, Any]) -> Tuple[Any, ...]:
+    """The parts of an aggregate the AI summary is generated from."""
+    return (summary["pulse_score"], summary["trend"], tuple(t["name"] for t in summary.get("top_themes", [])))
 
-    # Cache hit
-    cached = _CACHE.get(region_key)
-    if cached and cached.get("expires_at", 0) > _now():
-        out = dict(cached["data"])  # shallow copy
-        out["cached"] = True
-        return out
 
+def _refresh(region_key: str) -> Dict[str, Any]:
+    """Regenerate a region's AI summary and store it. Returns the new entry."""
+    # Taken before aggregating, so a report landing meanwhile leaves the entry stale
+    as_of = _now()
     summary = _aggregate_region(region_key)
-    ai = _call_gemini(summary)
-    payload = {**summary, **ai}
+    previous = _STORE.get_summary(region_key)
+    # Skip the model call when the inputs it would see have not changed
+    if previous is not None and _ai_inputs(previous["summary"]) == _ai_inputs(summary):
+        ai = previous["ai"]
+    else:
+        ai = _call_gemini(summary)
+    entry = {"summary": summary, "ai": ai, "as_of": as_of, "expires_at": as_of + _TTL_SECONDS}
+    _STORE.put_summary(region_key, entry)
+    return entry
+
+
+def _await_other_worker(region_key: str) -> Dict[str, Any]:
+    """The summary another worker is building for a region with nothing cached."""
+    deadline = _now() + _REFRESH_WAIT_SECONDS
+    while _now() < deadline:
+        time.sleep(0.2)
+        entry = _STORE.get_summary(region_key)
+        if entry is not None:
+            return entry
+    raise TimeoutError(f"no pulse summary for {region_key}")
+
+
+def _run_refresh(region_key: str, future: Future, wait: bool) -> None:
+    """
+    Refresh if this worker wins the region's lease in the store. Otherwise
+    another worker is refreshing: wait for its result if `wait` (nothing is
+    cached yet), else leave it to them (the Future's result is None).
+    """
+    try:
+        if _STORE.claim_refresh(region_key, _now(), _REFRESH_LEASE_SECONDS):
+            future.set_result(_refresh(region_key))
+        else:
+            future.set_result(_await_other_worker(region_key) if wait else None)
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        with _CACHE_LOCK:
+            _REFRESHING.pop(region_key, None)
+
+
+def _start_refresh(region_key: str, background: bool) -> Optional[Future]:
+    """
+    The Future of the region's refresh, starting one unless it is already
+    running in this worker; across workers, the one holding the region's
+    refresh lease in the store does the work. In the background, returns None
+    when the shared pool is saturated; the next request tries again.
+    Otherwise the first caller runs the refresh (or waits for the worker
+    holding the lease) and concurrent callers share its result.
+    """
+    with _CACHE_LOCK:
+        future = _REFRESHING.get(region_key)
+        if future is not None:
+            return future
+        future = _REFRESHING[region_key] = Future()
+    if not background:
+        _run_refresh(region_key, future, True)
+    elif submit_background(_run_refresh, region_key, future, False) is None:
+        with _CACHE_LOCK:
+            _REFRESHING.pop(region_key, None)
+        return None
+    return future
 
-    _CACHE[region_key] = {"data": payload, "expires_at": _now() + _TTL_SECONDS}
 
-    out = dict(payload)
-    out["cached"] = False
-    return out
+def get_or_build_summary(region: str) -> Dict[str, Any]:
+    """
+    The region's current aggregate with its AI summary. The aggregate is
+    always current; the AI part is served from the cache, and when it is
+    stale (new reports or past its TTL) one background refresh regenerates it,
+    no sooner than PULSE_REFRESH_MIN_SECONDS after the last one. Only a region
+    with nothing cached waits for the model, once for all concurrent callers.
+    """
+    region_key = (region or "default").strip() or "default"
+
+    cached = _STORE.get_summary(region_key)
+    if cached is None:
+        try:
+            cached = _start_refresh(region_key, background=False).result(timeout=_REFRESH_WAIT_SECONDS)
+        except Exception:
+            cached = None
+        if cached is None:
+            # Timed out waiting on another request's refresh, it failed, or it was a
+            # background refresh that left the work to another worker (result None):
+            # build one without caching
+            summary = _aggregate_region(region_key)
+            return {**summary, **_call_gemini(summary), "cached": False, "stale": False}
+        return {**cached["summary"], **cached["ai"], "cached": False, "stale": False}
+
+    now = _now()
+    stale = _STORE.reported_at(region_key) >= cached["as_of"] or cached["expires_at"] <= now
+    if stale and now - cached["as_of"] >= _REFRESH_MIN_SECONDS:
+        _start_refresh(region_key, background=True)
+    # The aggregate itself is cheap: always serve the current one
+    return {**_aggregate_region(region_key), **cached["ai"], "cached": True, "stale": stale}
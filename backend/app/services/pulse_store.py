@@ -0,0 +1,334 @@
+"""
+pulse_store.py: Storage for Sukoon Pulse's hourly buckets and cached AI summaries.
+
+Backends (SAKHI_PULSE_BACKEND):
+  - sqlite (default): one WAL-mode file on local disk (SAKHI_PULSE_PATH), so
+    every gunicorn worker on the host records into and aggregates the same
+    buckets, and they survive worker restarts
+  - memory: per-process, for development
+
+With SAKHI_PULSE_SNAPSHOT_PATH set (e.g. a mounted volume), the SQLite store is
+copied there with SQLite's online backup at most every
+SAKHI_PULSE_SNAPSHOT_SECONDS and at worker exit. A worker that starts without
+a local database restores it from the snapshot, so an instance coming back
+from scale-to-zero keeps the pulse window.
+
+Each bucket row holds one region's hour: count, score sum, one counter per
+score (1..10) and one per theme, in columns named after the theme, so themes
+can be added later. Recording an event is a single upsert.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.utils.sqlite import connect
+
+PULSE_BACKEND = os.environ.get("SAKHI_PULSE_BACKEND", "sqlite").strip().lower()
+PULSE_PATH = os.environ.get("SAKHI_PULSE_PATH", "/tmp/sakhi-pulse.sqlite3")
+SNAPSHOT_PATH = os.environ.get("SAKHI_PULSE_SNAPSHOT_PATH", "").strip()
+SNAPSHOT_SECONDS = int(os.environ.get("SAKHI_PULSE_SNAPSHOT_SECONDS", "300"))
+
+HOUR_SECS = 3600
+WINDOW_HOURS = 7 * 24
+
+
+def _theme_column(name: str) -> str:
+    # Theme names come from pulse_service's fixed allowlist
+    return f'"theme:{name}"'
+
+
+class HourlyBuckets:
+    """
+    One region's events over the last WINDOW_HOURS hours, as a ring of hourly
+    buckets. Slot i holds absolute hour `hours[i]` (hours since the epoch),
+    where hours[i] % slots == i; a slot still holding an older hour is stale
+    and is cleared when its hour comes round again.
+    """
+
+    def __init__(self, themes: int, slots: int = WINDOW_HOURS):
+        self.slots = slots
+        self.hours = np.full(slots, -1, dtype=np.int64)
+        self.count = np.zeros(slots, dtype=np.int32)
+        self.score_sum = np.zeros(slots, dtype=np.int32)
+        self.hist = np.zeros((slots, 10), dtype=np.int32)
+        self.themes = np.zeros((slots, themes), dtype=np.int32)
+
+    def add(self, ts: float, score: int, theme_ids: List[int]) -> None:
+        hour = int(ts // HOUR_SECS)
+        i = hour % self.slots
+        if self.hours[i] != hour:
+            if self.hours[i] > hour:
+                return  # Older than the window
+            self.hours[i] = hour
+            self.count[i] = self.score_sum[i] = 0
+            self.hist[i] = 0
+            self.themes[i] = 0
+        self.count[i] += 1
+        self.score_sum[i] += score
+        self.hist[i, score - 1] += 1
+        self.themes[i, theme_ids] += 1
+
+    def load_rows(self, rows: np.ndarray) -> None:
+        """Fill from rows of (hour, count, score_sum, 10 score counters, theme counters)."""
+        if not len(rows):
+            return
+        index = rows[:, 0] % self.slots
+        self.hours[index] = rows[:, 0]
+        self.count[index] = rows[:, 1]
+        self.score_sum[index] = rows[:, 2]
+        self.hist[index] = rows[:, 3:13]
+        self.themes[index] = rows[:, 13:]
+
+    def copy(self) -> "HourlyBuckets":
+        other = HourlyBuckets(self.themes.shape[1], self.slots)
+        for field in ("hours", "count", "score_sum", "hist", "themes"):
+            setattr(other, field, getattr(self, field).copy())
+        return other
+
+    def window(self, now: float, first_hours_ago: int, last_hours_ago: int = 0) -> np.ndarray:
+        """Mask of the slots holding hours in (now - first_hours_ago, now - last_hours_ago], in whole hours."""
+        current = int(now // HOUR_SECS)
+        age = current - self.hours
+        return (self.hours >= 0) & (age >= last_hours_ago) & (age < first_hours_ago)
+
+
+class MemoryPulseStore:
+    """Per-process buckets and summaries."""
+
+    def __init__(self, themes: List[str]):
+        self.theme_count = len(themes)
+        self._buckets: Dict[str, HourlyBuckets] = {}
+        self._reported_at: Dict[str, float] = {}
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, region: str, ts: float, score: int, theme_ids: List[int]) -> None:
+        with self._lock:
+            buckets = self._buckets.get(region)
+            if buckets is None:
+                buckets = self._buckets[region] = HourlyBuckets(self.theme_count)
+            buckets.add(ts, score, theme_ids)
+            self._reported_at[region] = max(ts, self._reported_at.get(region, 0.0))
+
+    def buckets(self, region: str, now: float) -> Optional[HourlyBuckets]:
+        with self._lock:
+            buckets = self._buckets.get(region)
+            return buckets.copy() if buckets is not None else None
+
+    def reported_at(self, region: str) -> float:
+        with self._lock:
+            return self._reported_at.get(region, 0.0)
+
+    def get_summary(self, region: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._summaries.get(region)
+
+    def put_summary(self, region: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._summaries[region] = entry
+
+    def claim_refresh(self, region: str, now: float, lease_seconds: float) -> bool:
+        # A worker's own refreshes are already coalesced by pulse_service
+        return True
+
+    def snapshot(self, force: bool = False) -> bool:
+        return False
+
+    def _reset_lock(self) -> None:
+        self._lock = threading.Lock()
+
+
+class SQLitePulseStore:
+    """Buckets and summaries in a local SQLite file shared by every worker on the host."""
+
+    def __init__(self, themes: List[str], path: str = PULSE_PATH, snapshot_path: str = SNAPSHOT_PATH,
+                 snapshot_seconds: int = SNAPSHOT_SECONDS):
+        self.theme_count = len(themes)
+        self._theme_columns = [_theme_column(name) for name in themes]
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.snapshot_seconds = snapshot_seconds
+        self._writes = 0
+        if snapshot_path:
+            self._restore()
+
+        score_columns = ", ".join(f"s{i} INTEGER NOT NULL DEFAULT 0" for i in range(1, 11))
+        conn = connect(self.path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pulse_buckets ("
+            " region TEXT NOT NULL, hour INTEGER NOT NULL,"
+            " count INTEGER NOT NULL DEFAULT 0, score_sum INTEGER NOT NULL DEFAULT 0,"
+            f" {score_columns}, PRIMARY KEY (region, hour))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS pulse_buckets_hour ON pulse_buckets (hour)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pulse_regions ("
+            " region TEXT PRIMARY KEY, reported_at REAL NOT NULL DEFAULT 0,"
+            " summary TEXT, refreshing_until REAL NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS pulse_meta (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+        # One column per theme, added as themes are
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(pulse_buckets)")}
+        for name, column in zip(themes, self._theme_columns):
+            if f"theme:{name}" not in existing:
+                try:
+                    conn.execute(f"ALTER TABLE pulse_buckets ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+                except sqlite3.OperationalError:
+                    pass  # Added by another worker meanwhile
+        self._columns = ", ".join(["hour", "count", "score_sum"]
+                                  + [f"s{i}" for i in range(1, 11)] + self._theme_columns)
+
+    def _restore(self) -> None:
+        """Seed a missing local database from the snapshot; the first worker to start wins."""
+        if os.path.exists(self.path) or not os.path.exists(self.snapshot_path):
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        staging = f"{self.path}.restore-{os.getpid()}"
+        try:
+            shutil.copyfile(self.snapshot_path, staging)
+            os.link(staging, self.path)
+            print(f"Pulse store restored from {self.snapshot_path}")
+        except FileExistsError:
+            pass
+        except OSError as e:
+            print(f"Warning: pulse snapshot restore failed: {e}")
+        finally:
+            if os.path.exists(staging):
+                os.unlink(staging)
+
+    def add(self, region: str, ts: float, score: int, theme_ids: List[int]) -> None:
+        hour = int(ts // HOUR_SECS)
+        counters = [f"s{score}"] + [self._theme_columns[i] for i in theme_ids]
+        columns = ", ".join(["region", "hour", "count", "score_sum"] + counters)
+        values = ", ".join(["?", "?", "1", "?"] + ["1"] * len(counters))
+        updates = ", ".join(["count = count + 1", "score_sum = score_sum + excluded.score_sum"]
+                            + [f"{c} = {c} + 1" for c in counters])
+        conn = connect(self.path)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                f"INSERT INTO pulse_buckets ({columns}) VALUES ({values})"
+                f" ON CONFLICT (region, hour) DO UPDATE SET {updates}",
+                (region, hour, score),
+            )
+            conn.execute(
+                "INSERT INTO pulse_regions (region, reported_at) VALUES (?, ?)"
+                " ON CONFLICT (region) DO UPDATE SET reported_at = MAX(reported_at, excluded.reported_at)",
+                (region, ts),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        # Pruning scans the hour index, so only do it every so often
+        if self._writes % 256 == 0:
+            conn.execute("DELETE FROM pulse_buckets WHERE hour <= ?", (hour - WINDOW_HOURS,))
+
+    def buckets(self, region: str, now: float) -> Optional[HourlyBuckets]:
+        first = int(now // HOUR_SECS) - WINDOW_HOURS
+        rows = connect(self.path).execute(
+            f"SELECT {self._columns} FROM pulse_buckets WHERE region = ? AND hour > ?", (region, first),
+        ).fetchall()
+        if not rows:
+            return None
+        buckets = HourlyBuckets(self.theme_count)
+        buckets.load_rows(np.array(rows, dtype=np.int64))
+        return buckets
+
+    def reported_at(self, region: str) -> float:
+        row = connect(self.path).execute(
+            "SELECT reported_at FROM pulse_regions WHERE region = ?", (region,)).fetchone()
+        return row[0] if row else 0.0
+
+    def get_summary(self, region: str) -> Optional[Dict[str, Any]]:
+        row = connect(self.path).execute(
+            "SELECT summary FROM pulse_regions WHERE region = ?", (region,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def put_summary(self, region: str, entry: Dict[str, Any]) -> None:
+        connect(self.path).execute(
+            "INSERT INTO pulse_regions (region, summary) VALUES (?, ?)"
+            " ON CONFLICT (region) DO UPDATE SET summary = excluded.summary, refreshing_until = 0",
+            (region, json.dumps(entry)),
+        )
+
+    def claim_refresh(self, region: str, now: float, lease_seconds: float) -> bool:
+        """True if this worker may refresh the region's summary (no other worker holds a live lease)."""
+        conn = connect(self.path)
+        conn.execute("INSERT OR IGNORE INTO pulse_regions (region) VALUES (?)", (region,))
+        cur = conn.execute(
+            "UPDATE pulse_regions SET refreshing_until = ? WHERE region = ? AND refreshing_until < ?",
+            (now + lease_seconds, region, now),
+        )
+        return cur.rowcount == 1
+
+    def snapshot(self, force: bool = False) -> bool:
+        """
+        Copy the database to the snapshot path if SNAPSHOT_SECONDS have passed
+        since the last snapshot by any worker (or force). Returns True if copied.
+        """
+        if not self.snapshot_path:
+            return False
+        now = time.time()
+        conn = connect(self.path)
+        if not force:
+            conn.execute("INSERT OR IGNORE INTO pulse_meta (key, value) VALUES ('snapshot_at', 0)")
+            cur = conn.execute(
+                "UPDATE pulse_meta SET value = ? WHERE key = 'snapshot_at' AND value <= ?",
+                (now, now - self.snapshot_seconds),
+            )
+            if cur.rowcount != 1:
+                return False
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, staging = tempfile.mkstemp(prefix=os.path.basename(self.snapshot_path) + ".",
+                                       dir=directory or None)
+        os.close(fd)
+        try:
+            target = sqlite3.connect(staging)
+            try:
+                conn.backup(target)
+            finally:
+                target.close()
+            os.replace(staging, self.snapshot_path)
+        finally:
+            if os.path.exists(staging):
+                os.unlink(staging)
+        return True
+
+    def _reset_lock(self) -> None:
+        pass
+
+
+def create_store(themes: List[str]):
+    """The configured store, falling back to memory if the SQLite file cannot be used."""
+    if PULSE_BACKEND == "sqlite":
+        try:
+            store = SQLitePulseStore(themes)
+            if store.snapshot_path:
+                atexit.register(_snapshot_at_exit, store)
+            return store
+        except Exception as e:
+            print(f"Warning: shared pulse store unavailable, using memory only: {e}")
+    return MemoryPulseStore(themes)
+
+
+def _snapshot_at_exit(store: SQLitePulseStore) -> None:
+    try:
+        store.snapshot(force=True)
+    except Exception as e:
+        print(f"Warning: pulse snapshot at exit failed: {e}")
@@ -0,0 +1,149 @@
+"""
+summary_service.py: Rolling summaries that keep long chat sessions cheap to prompt.
+
+Each session document carries a running summary of its older messages:
+  - summary:            text of the running summary
+  - summarizedThrough:  timestamp of the newest message folded into it
+  - unsummarized:       count of messages newer than summarizedThrough
+
+A chat turn prompts with the summary plus the messages after summarizedThrough.
+Once the unsummarized tail grows past SUMMARY_KEEP_RECENT + SUMMARY_BATCH
+messages, a background job folds all but the newest SUMMARY_KEEP_RECENT into
+the summary, so the per-turn prompt stays roughly constant in size.
+
+Sessions from before rolling summaries have no unsummarized count, or one
+started by the first turn after the upgrade. Until a session's first
+compaction every message is unsummarized, so its count is taken as at least
+messageCount, and the first compaction writes the corrected count.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+
+from app.llm.client_gemini import summarize_conversation
+from app.services.message_store import layout_state, read_oldest
+from app.services.transcript_cache import apply_compaction
+from app.utils.concurrency import submit_background
+
+# Messages always left out of the summary and sent verbatim
+SUMMARY_KEEP_RECENT = int(os.environ.get("SAKHI_SUMMARY_KEEP_RECENT", "12"))
+# How many extra messages accumulate before a compaction runs
+SUMMARY_BATCH = int(os.environ.get("SAKHI_SUMMARY_BATCH", "10"))
+
+# (uid, session_id) pairs with a compaction queued or running in this process
+_in_flight = set()
+_lock = threading.Lock()
+
+
+def _reset_state() -> None:
+    global _in_flight, _lock
+    _in_flight = set()
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_state)
+
+
+def summary_state(session_data: Optional[Dict[str, Any]]):
+    """Return (summary, summarizedThrough, unsummarized) from a session document."""
+    data = session_data or {}
+    through = data.get("summarizedThrough")
+    unsummarized = int(data.get("unsummarized") or 0)
+    if through is None:
+        # Never compacted: every message is unsummarized, whatever a legacy count says
+        unsummarized = max(unsummarized, int(data.get("messageCount") or 0))
+    return data.get("summary") or None, through, unsummarized
+
+
+def needs_compaction(unsummarized: int) -> bool:
+    return unsummarized >= SUMMARY_KEEP_RECENT + SUMMARY_BATCH
+
+
+def to_chat_history(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Firestore message dicts -> Gemini chat_history turns."""
+    return [
+        {"role": "user" if m.get("author") == "user" else "model", "parts": [{"text": m.get("text", "")}]}
+        for m in messages
+    ]
+
+
+def schedule_compaction(db, user_id: str, session_id: str) -> bool:
+    """
+    Queue a compaction of the session on the shared pool unless one is already
+    pending for it. Returns False if it was not queued (duplicate or pool full).
+    """
+    key = (user_id, session_id)
+    with _lock:
+        if key in _in_flight:
+            return False
+        _in_flight.add(key)
+    try:
+        future = submit_background(_compact_session, db, user_id, session_id)
+    except Exception:
+        future = None
+    if future is None:
+        with _lock:
+            _in_flight.discard(key)
+        return False
+    return True
+
+
+def _compact_session(db, user_id: str, session_id: str) -> None:
+    try:
+        compact_session(db, user_id, session_id)
+    except Exception as e:
+        print(f"Session compaction failed for {session_id}: {e}", file=sys.stderr)
+    finally:
+        with _lock:
+            _in_flight.discard((user_id, session_id))
+
+
+def compact_session(db, user_id: str, session_id: str) -> bool:
+    """
+    Fold every unsummarized message except the newest SUMMARY_KEEP_RECENT into
+    the session's running summary. Returns True if the summary was updated.
+    """
+    session_ref = db.collection("users").document(user_id).collection("sessions").document(session_id)
+    snapshot = session_ref.get()
+    if not snapshot.exists:
+        return False
+    session_data = snapshot.to_dict()
+    summary, through, unsummarized = summary_state(session_data)
+    if not needs_compaction(unsummarized):
+        return False
+
+    messages = read_oldest(db, user_id, session_id, layout_state(session_data),
+                           unsummarized - SUMMARY_KEEP_RECENT, after=through)
+    messages = [m for m in messages if m.get("timestamp") is not None]
+    if not messages:
+        return False
+
+    new_summary = summarize_conversation(summary, to_chat_history(messages))
+    if not new_summary:
+        return False
+
+    @firestore.transactional
+    def fold(transaction) -> bool:
+        current = session_ref.get(transaction=transaction)
+        if not current.exists or (current.to_dict() or {}).get("summarizedThrough") != through:
+            # Deleted, or compacted by another worker meanwhile
+            return False
+        # An absolute count, so a legacy session's first compaction corrects it
+        transaction.update(session_ref, {
+            "summary": new_summary,
+            "summarizedThrough": messages[-1]["timestamp"],
+            "unsummarized": max(0, summary_state(current.to_dict())[2] - len(messages)),
+            "summaryUpdatedAt": firestore.SERVER_TIMESTAMP,
+        })
+        return True
+
+    if not fold(db.transaction()):
+        return False
+    apply_compaction(user_id, session_id, new_summary, messages[-1]["timestamp"], len(messages))
+    return True
@@ -0,0 +1,229 @@
+"""
+sync_service.py: One-round-trip delta sync of a client's mood/journal cache.
+
+A sync request carries a batch of client mutations and the change token from
+the previous sync. The mutations are applied in Firestore batches, then every
+mood entry created, changed or deleted since the token is returned with a new
+token.
+
+Change tracking uses commit times rather than a counter, so every writer
+takes part, including chat turns committed later by the write-behind queue:
+  - every mood entry write sets updated_at to the server timestamp
+  - deleting an entry leaves a tombstone in users/{uid}/moodTombstones/{id}
+    with deleted_at set the same way (kept for SYNC_TOMBSTONE_DAYS)
+  - the token is the read time of a snapshot taken before the change queries
+    run, so anything committed at or before it is in this response, and
+    anything after it is newer than the token. A change committed while the
+    queries run may be sent twice, which is harmless because applying a
+    change is idempotent.
+
+Creates use a document id derived from the client id, so a retried sync
+updates the same entry instead of duplicating it. Concurrent edits to one
+entry are last-writer-wins.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+from app.services import data_version, mood_rollups
+from app.utils.cursor import decode_cursor, encode_cursor
+
+SYNC_MAX_MUTATIONS = int(os.environ.get("SAKHI_SYNC_MAX_MUTATIONS", "500"))
+SYNC_TOMBSTONE_DAYS = int(os.environ.get("SAKHI_SYNC_TOMBSTONE_DAYS", "30"))
+
+TOMBSTONES_COLLECTION = "moodTombstones"
+ENTRY_FIELDS = ("label", "score", "journal", "themes", "source")
+
+# A create writes the entry plus its day and month rollups
+_BATCH_WRITES = 450
+# Client clocks can run ahead; later entry timestamps are clamped to now
+_MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+class SyncError(ValueError):
+    """A malformed sync request (reported as 400)."""
+
+
+def _moods(db, user_id: str):
+    return db.collection("users").document(user_id).collection("moods")
+
+
+def _tombstones(db, user_id: str):
+    return db.collection("users").document(user_id).collection(TOMBSTONES_COLLECTION)
+
+
+def entry_id_for(user_id: str, client_id: str) -> str:
+    """Stable document id for an entry created by the client under client_id."""
+    return hashlib.sha256(f"{user_id}\x00{client_id}".encode()).hexdigest()[:20]
+
+
+def decode_token(token: Optional[str]) -> Optional[datetime]:
+    """The time of a change token from changes_since(); SyncError if it is not one."""
+    if not token:
+        return None
+    try:
+        since = decode_cursor(token)["t"]
+    except (ValueError, KeyError, TypeError):
+        raise SyncError("invalid change token") from None
+    # Comparing a naive or non-datetime value with commit times would fail later
+    if not isinstance(since, datetime) or since.tzinfo is None:
+        raise SyncError("invalid change token")
+    return since
+
+
+def _timestamp(value: Any, now: datetime) -> datetime:
+    """Entry timestamp from epoch milliseconds or ISO 8601, clamped to now (+ skew)."""
+    if value is None:
+        return now
+    try:
+        if isinstance(value, (int, float)):
+            ts = datetime.fromtimestamp(value / 1000.0, tz=timezone.utc)
+        else:
+            ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+            ts = ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        raise SyncError(f"invalid timestamp: {value!r}") from None
+    return min(ts, now + _MAX_CLOCK_SKEW)
+
+
+def _validate(mutation: Any) -> Tuple[str, str, Dict[str, Any]]:
+    """(clientId, op, entry fields) of one mutation."""
+    if not isinstance(mutation, dict):
+        raise SyncError("each mutation must be an object")
+    client_id = mutation.get("clientId")
+    op = mutation.get("op")
+    if not isinstance(client_id, str) or not client_id:
+        raise SyncError("each mutation needs a clientId")
+    if op not in ("upsert", "delete"):
+        raise SyncError(f"{client_id}: op must be upsert or delete")
+    entry_id = mutation.get("id")
+    if entry_id is not None and (not isinstance(entry_id, str) or not entry_id or "/" in entry_id):
+        raise SyncError(f"{client_id}: invalid id")
+    if op == "delete" and not entry_id:
+        raise SyncError(f"{client_id}: delete needs the entry id")
+    entry = mutation.get("entry") or {}
+    if op == "upsert":
+        if not isinstance(entry, dict):
+            raise SyncError(f"{client_id}: entry must be an object")
+        score = entry.get("score")
+        if "score" in entry and (not isinstance(score, (int, float)) or score < 1 or score > 10):
+            raise SyncError(f"{client_id}: score must be a number between 1 and 10")
+        if not entry_id and ("label" not in entry or "score" not in entry):
+            raise SyncError(f"{client_id}: a new entry needs label and score")
+    return client_id, op, entry
+
+
+def apply_mutations(db, user_id: str, mutations: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Apply client mutations in order, in Firestore batches. Returns one result
+    per mutation: {clientId, id, status} with status created, updated, deleted
+    or missing (update or delete of an entry that no longer exists).
+    """
+    if not isinstance(mutations, list):
+        raise SyncError("mutations must be a list")
+    if len(mutations) > SYNC_MAX_MUTATIONS:
+        raise SyncError(f"at most {SYNC_MAX_MUTATIONS} mutations per sync")
+    parsed = [_validate(m) for m in mutations]
+    if not parsed:
+        return []
+
+    now = datetime.now(timezone.utc)
+    ids = [m.get("id") or entry_id_for(user_id, client_id) for m, (client_id, _, _) in zip(mutations, parsed)]
+    # One round trip for the current state of every entry touched
+    refs = {entry_id: _moods(db, user_id).document(entry_id) for entry_id in ids}
+    current = {snap.id: (snap.to_dict() if snap.exists else None) for snap in db.get_all(list(refs.values()))}
+
+    results = []
+    touched_days = set()
+    batch, pending = db.batch(), 0
+    for (client_id, op, entry), entry_id, mutation in zip(parsed, ids, mutations):
+        ref = refs[entry_id]
+        existing = current.get(entry_id)
+        if op == "delete":
+            if existing is None:
+                results.append({"clientId": client_id, "id": entry_id, "status": "missing"})
+                continue
+            batch.delete(ref)
+            batch.set(_tombstones(db, user_id).document(entry_id), {
+                "deleted_at": firestore.SERVER_TIMESTAMP,
+                "expiresAt": now + timedelta(days=SYNC_TOMBSTONE_DAYS),
+            })
+            if hasattr(existing.get("timestamp"), "date"):
+                touched_days.add(mood_rollups.day_key(existing["timestamp"]))
+            current[entry_id] = None
+            status = "deleted"
+        elif existing is None and mutation.get("id"):
+            # Updating an entry deleted elsewhere: the deletion wins
+            results.append({"clientId": client_id, "id": entry_id, "status": "missing"})
+            continue
+        elif existing is None:
+            data = {k: entry[k] for k in ENTRY_FIELDS if entry.get(k) is not None}
+            data.setdefault("source", "manual")
+            data["timestamp"] = _timestamp(entry.get("timestamp"), now)
+            data["updated_at"] = firestore.SERVER_TIMESTAMP
+            batch.set(ref, data)
+            # Any day, past ones included: streaks are derived from the rollups when read
+            mood_rollups.record_entry(batch, db, user_id, data["label"], data["score"], data["timestamp"])
+            current[entry_id] = data
+            status = "created"
+        else:
+            update = {k: entry[k] for k in ENTRY_FIELDS if k in entry and k != "source"}
+            update["updated_at"] = firestore.SERVER_TIMESTAMP
+            batch.update(ref, update)
+            if ("score" in update or "label" in update) and hasattr(existing.get("timestamp"), "date"):
+                touched_days.add(mood_rollups.day_key(existing["timestamp"]))
+            status = "updated"
+        results.append({"clientId": client_id, "id": entry_id, "status": status})
+        pending += 3
+        if pending >= _BATCH_WRITES:
+            data_version.bump(batch, db, user_id, data_version.SCOPE_MOODS)
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        data_version.bump(batch, db, user_id, data_version.SCOPE_MOODS)
+        batch.commit()
+
+    # Edits and deletes rebuild their days, as the single-entry endpoints do
+    for day in sorted(touched_days):
+        mood_rollups.recompute_day(db, user_id, day)
+    return results
+
+
+def _entry_json(entry_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    entry = {"id": entry_id, **data}
+    for field in ("timestamp", "updated_at"):
+        if hasattr(entry.get(field), "isoformat"):
+            entry[field] = entry[field].isoformat()
+    return entry
+
+
+def changes_since(db, user_id: str, since: Optional[datetime]) -> Dict[str, Any]:
+    """
+    Mood entries changed and deleted since a token time (everything when since
+    is None), with the token for the next sync. reset is True when since is
+    older than the tombstone retention: the client must replace its cache with
+    the returned entries, which are then the full set.
+    """
+    # Snapshot first: its read time becomes the next token
+    token_time = db.collection("users").document(user_id).get().read_time
+    reset = since is None or since < datetime.now(timezone.utc) - timedelta(days=SYNC_TOMBSTONE_DAYS)
+
+    if reset:
+        query = _moods(db, user_id)
+        deleted = []
+    else:
+        query = _moods(db, user_id).where("updated_at", ">", since).order_by("updated_at")
+        deleted = [doc.id for doc in
+                   _tombstones(db, user_id).where("deleted_at", ">", since).select([]).stream()]
+    changed = [_entry_json(doc.id, doc.to_dict() or {}) for doc in query.stream()]
+    return {
+        "token": encode_cursor({"t": token_time}),
+        "reset": reset,
+        "changed": changed,
+        "deleted": deleted,
+    }
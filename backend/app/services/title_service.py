@@ -0,0 +1,98 @@
+"""
+title_service.py: Session titles for new chats.
+
+A new session is created with an instant title built locally from the first
+message (keyword extraction, no LLM call). The Gemini title is generated in the
+background and written to the session document when it arrives, with
+titleSource changing from "heuristic" to "generated".
+"""
+from __future__ import annotations
+
+import re
+import sys
+from concurrent.futures import Future
+from typing import Optional
+
+from app.llm.client_gemini import generate_short_title
+from app.services import data_version
+from app.services.transcript_cache import count_version_bump
+from app.utils.concurrency import submit_background
+from app.utils.write_queue import WriteUnit, enqueue_writes
+
+DEFAULT_TITLE = "New Chat"
+
+# Function words and chat filler (English and common Hinglish) that never make a title
+STOPWORDS = {
+    "a", "about", "after", "again", "all", "also", "am", "an", "and", "any", "are", "as", "at", "be",
+    "because", "been", "before", "being", "but", "by", "can", "could", "did", "do", "does", "doing",
+    "dont", "don't", "for", "from", "get", "getting", "got", "had", "has", "have", "having", "he", "her",
+    "here", "hey", "hi", "him", "his", "how", "i", "i'm", "im", "i've", "ive", "if", "in", "into", "is",
+    "it", "it's", "its", "just", "know", "like", "me", "more", "much", "my", "myself", "no", "not", "now",
+    "of", "off", "ok", "okay", "on", "or", "our", "out", "over", "really", "she", "so", "some", "still",
+    "such", "than", "that", "the", "their", "them", "then", "there", "these", "they", "thing", "things",
+    "this", "those", "to", "too", "today", "um", "up", "us", "very", "want", "was", "we", "were", "what",
+    "when", "where", "which", "while", "who", "why", "will", "with", "would", "you", "your", "yeah",
+    "hello", "please", "feel", "feeling", "feels", "think", "going", "lot", "kind", "sort",
+    # Hinglish
+    "hai", "hain", "ho", "hu", "hoon", "main", "mai", "mera", "meri", "mere", "mujhe", "mujhko", "tum",
+    "aap", "kya", "ki", "ka", "ke", "ko", "se", "bhi", "nahi", "nahin", "na", "aur", "ye", "yeh", "wo",
+    "woh", "toh", "bahut", "bohot", "bohat", "kuch", "raha", "rahi", "rahe", "tha", "thi",
+    "yaar", "abhi", "sab", "kar", "karna", "karta", "karti", "lag", "lagta", "lagti",
+}
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'\-]*")
+_SMALL_WORDS = {"a", "an", "the", "and", "or", "but", "for", "nor", "on", "at", "to", "from", "by", "of", "in", "with"}
+
+
+def heuristic_title(text: str, max_words: int = 4) -> str:
+    """Title from the first content words of the message, in Title Case; DEFAULT_TITLE if none."""
+    words = []
+    seen = set()
+    for match in _WORD_RE.finditer(text or ""):
+        word = match.group(0).strip("'-")
+        lower = word.lower()
+        if len(lower) < 3 or lower in STOPWORDS or lower in seen:
+            continue
+        seen.add(lower)
+        words.append(lower)
+        if len(words) >= max_words:
+            break
+    if not words:
+        return DEFAULT_TITLE
+    return " ".join(w if i and w in _SMALL_WORDS else w.capitalize() for i, w in enumerate(words))
+
+
+def start_title_generation(message: str, max_words: int = 5) -> Optional[Future]:
+    """Start the Gemini title on the shared pool; None when the pool is saturated."""
+    try:
+        return submit_background(generate_short_title, message, max_words=max_words)
+    except Exception:
+        return None
+
+
+def save_generated_title(db, user_id: str, session_id: str, title_future: Optional[Future]) -> None:
+    """
+    When title_future completes, write its title to the session document.
+    The write goes through the write-behind queue after the session's own
+    creation, so it always lands on an existing document.
+    """
+    if title_future is None:
+        return
+
+    def _on_done(future: Future) -> None:
+        if future.cancelled():
+            return
+        try:
+            title = future.result()
+            if not title:
+                return
+            session_ref = db.collection("users").document(user_id).collection("sessions").document(session_id)
+            unit = WriteUnit(db, key=f"{user_id}/{session_id}")
+            unit.set(session_ref, {"title": title, "titleSource": "generated"}, merge=True)
+            data_version.bump(unit, db, user_id, data_version.SCOPE_SESSIONS)
+            enqueue_writes(unit)
+            count_version_bump(user_id, session_id)
+        except Exception as e:
+            print(f"Saving generated title failed for {session_id}: {e}", file=sys.stderr)
+
+    title_future.add_done_callback(_on_done)
@@ -0,0 +1,193 @@
+"""
+transcript_cache.py: Per-worker LRU cache of recent session transcripts.
+
+Entries are keyed by (uid, session_id) and hold what a chat turn needs from
+Firestore: the session's running summary fields, its message layout state and
+the newest messages. They are updated in place when a turn is written (before
+the write-behind queue has committed it) and when the summary is compacted, and
+dropped when a session is deleted, so an active conversation is served without
+Firestore reads.
+
+The cache is bounded by the total size of the cached text
+(SAKHI_TRANSCRIPT_CACHE_MAX_BYTES). Entries also expire after
+SAKHI_TRANSCRIPT_CACHE_TTL seconds.
+
+Other workers and instances write to the same sessions, so each entry records
+the user's sessions data version (data_version.current) it reflects: the
+version read before the fill, plus one for each version bump this worker has
+queued for the session since. Callers serve an entry only while is_current
+holds for the version they just read; any other write to the user's sessions
+makes them read Firestore again.
+
+An entry is ahead of Firestore while the turns it holds sit in the write-behind
+queue, so a transcript read from Firestore must not simply replace it. Callers
+wait for the session's queued writes (await_pending_writes) before reading, and
+put_transcript keeps cached messages newer than the read and caches nothing
+while the session has queued writes that no entry holds.
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional
+
+from app.utils.cache import TTLCache
+from app.utils.write_queue import flush_writes, has_pending_writes
+
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.environ.get("SAKHI_TRANSCRIPT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+TRANSCRIPT_CACHE_TTL = int(os.environ.get("SAKHI_TRANSCRIPT_CACHE_TTL", "300"))
+# Newest messages kept per session; longer sessions are cached as a partial tail
+TRANSCRIPT_MAX_MESSAGES = int(os.environ.get("SAKHI_TRANSCRIPT_CACHE_MAX_MESSAGES", "200"))
+# Seconds a cache fill waits for the session's queued writes to commit
+TRANSCRIPT_FLUSH_TIMEOUT = float(os.environ.get("SAKHI_TRANSCRIPT_FLUSH_TIMEOUT", "2"))
+
+# Rough per-message bookkeeping on top of the text itself (dict, id, timestamp)
+_MESSAGE_OVERHEAD_BYTES = 200
+_ENTRY_OVERHEAD_BYTES = 300
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    text_bytes = sum(len(m.get("text") or "") for m in entry["messages"])
+    return (_ENTRY_OVERHEAD_BYTES + len(entry.get("summary") or "") + text_bytes
+            + _MESSAGE_OVERHEAD_BYTES * len(entry["messages"]))
+
+
+_CACHE = TTLCache(
+    "transcripts",
+    max_entries=100000,
+    ttl_seconds=TRANSCRIPT_CACHE_TTL,
+    backend="memory",
+    max_bytes=TRANSCRIPT_CACHE_MAX_BYTES,
+    sizeof=_entry_size,
+)
+
+
+def _key(user_id: str, session_id: str) -> str:
+    return f"{user_id}/{session_id}"
+
+
+def get_transcript(user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Cached entry or None. An entry has summary, summarizedThrough, unsummarized,
+    messageState (see message_store.layout_state), messages (oldest first; dicts
+    with id, author, text, timestamp) and complete (True when messages is the
+    whole session) and dataVersion (see is_current). Treat it as read-only.
+    """
+    hit, entry = _CACHE.get(_key(user_id, session_id))
+    return entry if hit else None
+
+
+def is_current(entry: Optional[Dict[str, Any]], version: Any) -> bool:
+    """
+    Whether entry reflects every write to the user's sessions, given their
+    current data version (read after await_pending_writes for the session).
+    """
+    return entry is not None and entry["dataVersion"] == tuple(version)
+
+
+def await_pending_writes(user_id: str, session_id: str) -> bool:
+    """
+    Wait for this worker's queued writes to the session to commit, before reading
+    it from Firestore to fill the cache. Returns False on timeout.
+    """
+    return flush_writes(TRANSCRIPT_FLUSH_TIMEOUT, key=_key(user_id, session_id))
+
+
+def put_transcript(user_id: str, session_id: str, messages: List[Dict[str, Any]], complete: bool,
+                   summary: Optional[str] = None, summarized_through: Any = None, unsummarized: int = 0,
+                   message_state: Optional[Dict[str, Any]] = None, version: Any = None) -> None:
+    """
+    Cache a transcript just read from Firestore, along with the sessions data
+    version read before it. Messages the cached entry holds that are newer than
+    the read (turns still in the write-behind queue) are kept, along with their
+    unsummarized count and layout state; the entry's version is then unknown.
+    """
+    entry = get_transcript(user_id, session_id)
+    if entry is not None:
+        seen = {m.get("id") for m in messages}
+        newest = messages[-1]["timestamp"] if messages else None
+        newer = [m for m in entry["messages"] if m.get("id") not in seen
+                 and (newest is None or (m["timestamp"] is not None and m["timestamp"] > newest))]
+        if newer:
+            messages = list(messages) + newer
+            unsummarized += len(newer)
+            message_state = entry["messageState"] or message_state
+            version = None
+    elif has_pending_writes(_key(user_id, session_id)):
+        # The read may miss queued turns that no entry holds; leave the fill to a later read
+        return
+    _store(user_id, session_id, messages, complete, summary, summarized_through, unsummarized, message_state,
+           tuple(version) if version is not None else None)
+
+
+def _store(user_id: str, session_id: str, messages: List[Dict[str, Any]], complete: bool,
+           summary: Optional[str], summarized_through: Any, unsummarized: int,
+           message_state: Optional[Dict[str, Any]], version: Optional[tuple]) -> None:
+    if len(messages) > TRANSCRIPT_MAX_MESSAGES:
+        messages = messages[-TRANSCRIPT_MAX_MESSAGES:]
+        complete = False
+    _CACHE.set(_key(user_id, session_id), {
+        "summary": summary,
+        "summarizedThrough": summarized_through,
+        "unsummarized": unsummarized,
+        "messageState": message_state,
+        "messages": list(messages),
+        "complete": complete,
+        "dataVersion": version,
+    })
+
+
+def _bumped(version: Optional[tuple]) -> Optional[tuple]:
+    return (version[0], version[1] + 1) if version is not None else None
+
+
+def append_messages(user_id: str, session_id: str, messages: List[Dict[str, Any]], new_session: bool = False,
+                    message_state: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Record messages just written to a session (in a unit that bumps the
+    sessions data version), and its layout state after the write. A new session
+    starts a complete entry, whose version is unknown; otherwise only an already
+    cached entry is updated.
+    """
+    if new_session:
+        _store(user_id, session_id, messages, True, None, None, len(messages), message_state, None)
+        return
+    entry = get_transcript(user_id, session_id)
+    if entry is None:
+        return
+    # Copy-on-write, so readers holding the old entry are unaffected
+    _store(
+        user_id, session_id, entry["messages"] + list(messages), entry["complete"],
+        entry["summary"], entry["summarizedThrough"], entry["unsummarized"] + len(messages),
+        message_state or entry["messageState"], _bumped(entry["dataVersion"]),
+    )
+
+
+def count_version_bump(user_id: str, session_id: str) -> None:
+    """Record a sessions data version bump queued with another write to the session (a generated title)."""
+    entry = get_transcript(user_id, session_id)
+    if entry is None:
+        return
+    _store(
+        user_id, session_id, entry["messages"], entry["complete"], entry["summary"],
+        entry["summarizedThrough"], entry["unsummarized"], entry["messageState"],
+        _bumped(entry["dataVersion"]),
+    )
+
+
+def apply_compaction(user_id: str, session_id: str, summary: str, summarized_through: Any, folded: int) -> None:
+    """Record a summary compaction on a cached entry."""
+    entry = get_transcript(user_id, session_id)
+    if entry is None:
+        return
+    _store(
+        user_id, session_id, entry["messages"], entry["complete"], summary, summarized_through,
+        max(0, entry["unsummarized"] - folded), entry["messageState"], entry["dataVersion"],
+    )
+
+
+def invalidate(user_id: str, session_id: str) -> None:
+    _CACHE.delete(_key(user_id, session_id))
+
+
+def transcript_cache_stats() -> Dict[str, Any]:
+    return _CACHE.stats()
@@ -0,0 +1,229 @@
+"""
+cache.py: Bounded in-memory TTL/LRU cache with hit/miss counters.
+
+Caches are bounded by entry count and, optionally, by the total size of their
+values as measured by a caller-supplied sizeof function.
+
+Keys are SHA-256 hashes of the normalised input text (see text_key), so raw
+user text is never held as a key. An optional SQLite backend on local disk
+(SAKHI_CACHE_BACKEND=sqlite) lets every gunicorn worker on the host share entries.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.utils.encryption import hash_string
+from app.utils.sqlite import connect
+
+CACHE_BACKEND = os.environ.get("SAKHI_CACHE_BACKEND", "memory").strip().lower()
+CACHE_PATH = os.environ.get("SAKHI_CACHE_PATH", "/tmp/sakhi-cache.sqlite3")
+
+# name -> cache, for the /api/metrics endpoint
+_REGISTRY: Dict[str, "TTLCache"] = {}
+
+
+def text_key(text: str, *extra: Any) -> str:
+    """Hash of the case/whitespace-normalised text (plus any extra key parts)."""
+    normalized = " ".join((text or "").lower().split())
+    if extra:
+        normalized += "\x00" + "\x00".join(str(x) for x in extra)
+    return hash_string(normalized)
+
+
+class SQLiteCacheBackend:
+    """Shared second level for TTLCache: one table on local disk, LRU-trimmed on write."""
+
+    def __init__(self, path: str, namespace: str, max_entries: int):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._writes = 0
+        conn = connect(self.path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, used_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, used_at)")
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        conn = connect(self.path)
+        now = time.time()
+        row = conn.execute(
+            "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.namespace, key, now),
+        ).fetchone()
+        if row is None:
+            return False, None
+        conn.execute(
+            "UPDATE cache SET used_at = ? WHERE namespace = ? AND key = ?",
+            (now, self.namespace, key),
+        )
+        return True, json.loads(row[0])
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        conn = connect(self.path)
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, used_at) VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value), expires_at, now),
+        )
+        self._writes += 1
+        # Trimming scans the index, so only do it every so often
+        if self._writes % 64 == 0:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                " SELECT key FROM cache WHERE namespace = ? ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_entries),
+            )
+
+    def delete(self, key: str) -> None:
+        connect(self.path).execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+
+class TTLCache:
+    """
+    Thread-safe cache bounded by entry count (LRU eviction) and age (TTL).
+
+    With max_bytes and sizeof set, least recently used entries are also evicted
+    while the summed sizeof(value) exceeds max_bytes. Values must be
+    JSON-serialisable when the shared SQLite backend is enabled.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl_seconds: float = 3600,
+                 backend: Optional[str] = None, max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_bytes = int(max_bytes) if max_bytes and sizeof else None
+        self._sizeof = sizeof
+        self._bytes = 0
+        # key -> (expires_at, value, size)
+        self._data: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._shared = None
+        if (backend or CACHE_BACKEND) == "sqlite":
+            try:
+                self._shared = SQLiteCacheBackend(CACHE_PATH, name, self.max_entries * 4)
+            except Exception as e:
+                print(f"Warning: shared cache '{name}' unavailable, using memory only: {e}")
+        _REGISTRY[name] = self
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Return (hit, value)."""
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value, size = item
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+
+        if self._shared is not None:
+            try:
+                hit, value = self._shared.get(key)
+            except Exception:
+                hit, value = False, None
+            if hit:
+                self._store(key, value, now + self.ttl_seconds)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return True, value
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        self._store(key, value, expires_at)
+        if self._shared is not None:
+            try:
+                self._shared.set(key, value, expires_at)
+            except Exception:
+                pass
+
+    def _store(self, key: str, value: Any, expires_at: float) -> None:
+        size = self._sizeof(value) if self.max_bytes else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (expires_at, value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+        if self._shared is not None:
+            try:
+                self._shared.delete(key)
+            except Exception:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _reset_lock(self) -> None:
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes if self.max_bytes is not None else None,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_hits": self.shared_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "backend": "sqlite" if self._shared is not None else "memory",
+            }
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Stats for every cache created in this process."""
+    return {name: cache.stats() for name, cache in _REGISTRY.items()}
+
+
+def _reset_locks_after_fork() -> None:
+    for cache in _REGISTRY.values():
+        cache._reset_lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
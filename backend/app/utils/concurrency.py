@@ -0,0 +1,77 @@
+# concurrency.py: Shared bounded thread pool for speculative and background work.
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Worker threads per process, and how many tasks may be queued or running at once.
+# When the pool is saturated, submit() runs the task inline instead of queueing
+# without bound, so overload degrades to the old sequential behaviour.
+MAX_WORKERS = int(os.environ.get("SAKHI_EXECUTOR_WORKERS", "8"))
+MAX_PENDING = int(os.environ.get("SAKHI_EXECUTOR_MAX_PENDING", str(MAX_WORKERS * 4)))
+
+_lock = threading.Lock()
+_executor = None
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+
+def _reset_state():
+    global _lock, _executor, _slots
+    # Worker threads do not survive fork; let the child build its own pool
+    _lock = threading.Lock()
+    _executor = None
+    _slots = threading.BoundedSemaphore(MAX_PENDING)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_state)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide executor, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="sakhi")
+    return _executor
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """
+    Run fn(*args, **kwargs) on the shared pool and return its Future.
+    Falls back to running inline (returning an already-completed Future) when the pool is full.
+    """
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    try:
+        future = get_executor().submit(fn, *args, **kwargs)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _f: slots.release())
+    return future
+
+
+def submit_background(fn, *args, **kwargs):
+    """
+    Like submit(), for work nobody waits on: returns None instead of running
+    inline when the pool is full, so request threads never pick up the job.
+    """
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        return None
+    try:
+        future = get_executor().submit(fn, *args, **kwargs)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _f: slots.release())
+    return future
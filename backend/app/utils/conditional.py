@@ -0,0 +1,36 @@
+# conditional.py: Weak-ETag conditional GETs for per-user read endpoints.
+
+from datetime import datetime, timezone
+
+from flask import make_response, request
+
+from app.services import data_version
+
+# Browsers keep the response but revalidate it (If-None-Match) on every use
+CACHE_CONTROL = 'private, no-cache'
+
+
+def request_etag(db, user_id: str, scope: str, *parts, version=None) -> str:
+    """ETag of this request's response: scope's data version, the URL and any extra parts."""
+    return data_version.etag(db, user_id, scope, request.path,
+                             request.query_string.decode('utf-8', 'replace'), *parts, version=version)
+
+
+def utc_day() -> str:
+    """Extra ETag part for responses whose window moves with the calendar."""
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def not_modified(etag: str):
+    """A 304 response if the request's If-None-Match matches etag, else None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    resp = make_response('', 304)
+    return tag(resp, etag)
+
+
+def tag(resp, etag: str):
+    """Set the weak ETag and revalidation headers on a response."""
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = CACHE_CONTROL
+    return resp
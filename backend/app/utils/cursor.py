@@ -0,0 +1,48 @@
+# cursor.py: Opaque, stable page tokens for cursor-paginated listings.
+
+import base64
+import json
+from datetime import datetime
+
+# Response header carrying the token for the next page (absent on the last page)
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(values: dict) -> str:
+    """
+    Encode the sort-key values of the last item on a page as a URL-safe token.
+    Datetimes are kept to the microsecond so the next page starts exactly after it.
+    """
+    payload = {}
+    for key, value in values.items():
+        if isinstance(value, datetime):
+            payload[key] = {'$t': value.isoformat()}
+        else:
+            payload[key] = value
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> dict:
+    """Inverse of encode_cursor. Raises ValueError for a malformed token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, dict):
+            raise ValueError('cursor is not an object')
+        values = {}
+        for key, value in payload.items():
+            if isinstance(value, dict) and '$t' in value:
+                values[key] = datetime.fromisoformat(value['$t'])
+            else:
+                values[key] = value
+        return values
+    except Exception as e:
+        raise ValueError(f'invalid cursor: {e}') from None
+
+
+def page_limit(raw, default: int, maximum: int) -> int:
+    """Parse a ?limit= value, clamped to [1, maximum]. Raises ValueError if not an integer."""
+    if raw in (None, ''):
+        return default
+    return max(1, min(maximum, int(raw)))
@@ -0,0 +1,219 @@
+"""
+session_store.py: Server-side Flask sessions keyed by an opaque cookie id.
+
+Guest state (chat histories, explicit memory, mood history) lives in a local
+store instead of the signed session cookie, so the cookie stays a fixed-size
+random id no matter how long conversations get. Nothing is read, written or
+re-signed for requests that do not touch the session. Entries expire after
+PERMANENT_SESSION_LIFETIME; the expiry is refreshed at most once per
+SESSION_REFRESH_SECONDS for sessions that are only read.
+
+Backends (SAKHI_SESSION_BACKEND):
+  - sqlite (default): one file on local disk, shared by every gunicorn worker
+  - memory: per-process, for development
+  - cookie: Flask's default signed-cookie sessions
+Multi-instance deployments need session affinity for guest state to follow a user.
+"""
+from __future__ import annotations
+
+import os
+import secrets
+import time
+from typing import Any, Optional, Tuple
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from app.utils.cache import TTLCache
+from app.utils.encryption import hash_string
+from app.utils.sqlite import connect
+
+SESSION_BACKEND = os.environ.get("SAKHI_SESSION_BACKEND", "sqlite").strip().lower()
+SESSION_PATH = os.environ.get("SAKHI_SESSION_PATH", "/tmp/sakhi-sessions.sqlite3")
+SESSION_REFRESH_SECONDS = int(os.environ.get("SAKHI_SESSION_REFRESH_SECONDS", "3600"))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that tracks access and modification; its data stays on the server."""
+
+    def __init__(self, initial=None, sid: Optional[str] = None, expires_at: Optional[float] = None):
+        def on_update(self) -> None:
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key: str) -> Any:
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    # Server-side sessions always expire after PERMANENT_SESSION_LIFETIME, so the
+    # flag is not stored (setting it per request must not count as a change)
+    @property
+    def permanent(self) -> bool:
+        return True
+
+    @permanent.setter
+    def permanent(self, value: bool) -> None:
+        pass
+
+
+class SQLiteSessionStore:
+    """Session rows in a local SQLite file, keyed by a hash of the cookie id."""
+
+    def __init__(self, path: str = SESSION_PATH):
+        self.path = path
+        self._writes = 0
+        conn = connect(self.path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at)")
+
+    def load(self, sid: str) -> Optional[Tuple[str, float]]:
+        row = connect(self.path).execute(
+            "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+            (hash_string(sid), time.time()),
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save(self, sid: str, data: str, expires_at: float) -> None:
+        conn = connect(self.path)
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+            (hash_string(sid), data, expires_at),
+        )
+        self._writes += 1
+        if self._writes % 256 == 0:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    def touch(self, sid: str, expires_at: float) -> None:
+        connect(self.path).execute(
+            "UPDATE sessions SET expires_at = ? WHERE id = ?", (expires_at, hash_string(sid))
+        )
+
+    def delete(self, sid: str) -> None:
+        connect(self.path).execute("DELETE FROM sessions WHERE id = ?", (hash_string(sid),))
+
+
+class MemorySessionStore:
+    """Per-process store for development; bounded, with per-entry expiry."""
+
+    def __init__(self, max_entries: int = 10000):
+        # Entries carry their own expiry; the cache TTL is only an upper bound
+        self._cache = TTLCache("sessions", max_entries=max_entries, ttl_seconds=31 * 24 * 3600, backend="memory")
+
+    def load(self, sid: str) -> Optional[Tuple[str, float]]:
+        hit, value = self._cache.get(hash_string(sid))
+        if not hit or value[1] <= time.time():
+            return None
+        return value
+
+    def save(self, sid: str, data: str, expires_at: float) -> None:
+        self._cache.set(hash_string(sid), (data, expires_at))
+
+    def touch(self, sid: str, expires_at: float) -> None:
+        loaded = self.load(sid)
+        if loaded is not None:
+            self.save(sid, loaded[0], expires_at)
+
+    def delete(self, sid: str) -> None:
+        self._cache.delete(hash_string(sid))
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface storing session data in a SQLite or memory store."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def _lifetime(self, app) -> float:
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request) -> ServerSideSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                loaded = self.store.load(sid)
+            except Exception as e:
+                app.logger.error(f"Session store read failed: {e}")
+                loaded = None
+            if loaded is not None:
+                data, expires_at = loaded
+                try:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid, expires_at=expires_at)
+                except Exception:
+                    pass
+        return ServerSideSession()
+
+    def save_session(self, app, session: ServerSideSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            # Emptied: forget it server-side and drop the cookie
+            if session.modified and session.sid:
+                try:
+                    self.store.delete(session.sid)
+                except Exception as e:
+                    app.logger.error(f"Session store delete failed: {e}")
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        now = time.time()
+        lifetime = self._lifetime(app)
+        expires_at = now + lifetime
+        stale = session.expires_at is None or session.expires_at - now < lifetime - SESSION_REFRESH_SECONDS
+        if not session.modified and not stale:
+            return
+
+        try:
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(32)
+            if session.modified:
+                self.store.save(session.sid, self.serializer.dumps(dict(session)), expires_at)
+            else:
+                self.store.touch(session.sid, expires_at)
+        except Exception as e:
+            app.logger.error(f"Session store write failed: {e}")
+            return
+
+        response.set_cookie(name, session.sid, expires=expires_at, httponly=httponly,
+                            domain=domain, path=path, secure=secure, samesite=samesite)
+
+
+def create_session_interface() -> Optional[SessionInterface]:
+    """Session interface for SAKHI_SESSION_BACKEND, or None to keep Flask's cookie sessions."""
+    if SESSION_BACKEND == "cookie":
+        return None
+    if SESSION_BACKEND == "memory":
+        return ServerSideSessionInterface(MemorySessionStore())
+    try:
+        return ServerSideSessionInterface(SQLiteSessionStore(SESSION_PATH))
+    except Exception as e:
+        print(f"Warning: SQLite session store unavailable, using memory sessions: {e}")
+        return ServerSideSessionInterface(MemorySessionStore())
@@ -0,0 +1,33 @@
+# sqlite.py: Local SQLite connections for the on-disk stores shared between gunicorn workers.
+
+import os
+import sqlite3
+import threading
+
+_local = threading.local()
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Return this thread's connection to the database at `path`, opening it on first use.
+
+    Connections are in autocommit mode with WAL journaling, so readers in other
+    worker processes are never blocked by a writer. They are never shared
+    between threads or carried across a fork.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "pid", None) != os.getpid():
+        conns = {}
+        _local.conns = conns
+        _local.pid = os.getpid()
+
+    conn = conns.get(path)
+    if conn is None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conns[path] = conn
+    return conn
@@ -0,0 +1,106 @@
+"""
+text_match.py: Multi-pattern string matching built once and reused per message.
+
+KeywordAutomaton is an Aho-Corasick automaton: all keywords are compiled into a
+single trie with failure links, so a message is scanned once regardless of how
+many keywords there are, instead of one substring search per keyword.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+
+def is_word_char(ch: str) -> bool:
+    """Same notion of a word character as the regex \\w class."""
+    return ch.isalnum() or ch == "_"
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over (keyword, payload) pairs.
+
+    word_boundary=True only reports matches that sit on word boundaries on both
+    sides (equivalent to wrapping the keyword in \\b...\\b, for keywords that start
+    and end with a word character). Individual keywords can override this by
+    being added with add(..., start_boundary=..., end_boundary=...).
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, Any]] = (), word_boundary: bool = True):
+        self._default_boundary = word_boundary
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state: list of (keyword length, payload, start boundary, end boundary)
+        self._out: List[List[Tuple[int, Any, bool, bool]]] = [[]]
+        self._built = False
+        for keyword, payload in keywords:
+            self.add(keyword, payload)
+        self.build()
+
+    def add(self, keyword: str, payload: Any, start_boundary: Any = None, end_boundary: Any = None) -> None:
+        if not keyword:
+            return
+        start_b = self._default_boundary if start_boundary is None else bool(start_boundary)
+        end_b = self._default_boundary if end_boundary is None else bool(end_boundary)
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(keyword), payload, start_b, end_b))
+        self._built = False
+
+    def build(self) -> None:
+        """Compute failure links (breadth-first) and merge outputs along them."""
+        queue = []
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yield (start, end, payload) for every keyword occurrence, overlaps included."""
+        if not self._built:
+            self.build()
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        n = len(text)
+        state = 0
+        for i, ch in enumerate(text):
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            # Child states are never 0, so a miss at the root falls back to it
+            state = nxt or 0
+            if not out[state]:
+                continue
+            end = i + 1
+            for length, payload, start_b, end_b in out[state]:
+                start = end - length
+                if start_b and start > 0 and is_word_char(text[start - 1]):
+                    continue
+                if end_b and end < n and is_word_char(text[end]):
+                    continue
+                yield start, end, payload
+
+    def payloads(self, text: str) -> set:
+        """Distinct payloads of all matches in text."""
+        return {payload for _, _, payload in self.iter_matches(text)}
@@ -0,0 +1,325 @@
+"""
+write_queue.py: Write-behind queue for Firestore writes the response does not depend on.
+
+Callers build a WriteUnit (the writes of one chat turn, say) with the same
+set/update/delete calls as a WriteBatch and enqueue it instead of committing.
+A background thread drains the queue, coalescing units into as few batches as
+possible, and retries failed commits with exponential backoff. Each unit is
+committed atomically, alone or together with others.
+
+Units are applied at most once. Every queued commit also writes a marker
+document (appliedWrites/{unit id}) for each of its units, and a retry first
+reads the markers and skips the units whose earlier commit did land but whose
+response was lost, so Increment transforms are never applied twice. Markers
+carry an expiresAt for a Firestore TTL policy to clean up. A unit that still
+fails after the retries is logged, with its key, at error level.
+
+The queue is bounded: when it is full, enqueue() commits the unit inline, so
+overload degrades to synchronous writes rather than growing memory or losing
+data. Pending units are flushed at interpreter exit, which gunicorn workers
+reach on SIGTERM (the Cloud Run shutdown signal); other servers get there once
+the app calls install_sigterm_exit() at startup.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+
+# Write-behind on by default; set SAKHI_WRITE_BEHIND=0 to commit every unit inline
+WRITE_BEHIND = os.environ.get("SAKHI_WRITE_BEHIND", "1").lower() in ("1", "true", "yes")
+MAX_PENDING_UNITS = int(os.environ.get("SAKHI_WRITE_QUEUE_MAX", "1000"))
+MAX_RETRIES = int(os.environ.get("SAKHI_WRITE_QUEUE_MAX_RETRIES", "5"))
+# Seconds to wait for pending writes at shutdown (Cloud Run allows 10s after SIGTERM)
+FLUSH_TIMEOUT = float(os.environ.get("SAKHI_WRITE_QUEUE_FLUSH_TIMEOUT", "8"))
+
+# Firestore allows 500 writes per batch; leave room for transforms
+MAX_BATCH_WRITES = 450
+_BASE_DELAY = 0.2
+_MAX_DELAY = 10.0
+
+# Applied-unit markers; they only need to outlive the retries of their unit
+APPLIED_COLLECTION = "appliedWrites"
+APPLIED_MARKER_TTL = timedelta(days=1)
+
+
+class WriteUnit:
+    """
+    Writes that must be committed together; records WriteBatch calls for later.
+    key names what the unit writes to (e.g. "uid/session_id"), for logs.
+    """
+
+    def __init__(self, db, key: Optional[str] = None):
+        self.db = db
+        self.key = key
+        self.id = uuid.uuid4().hex
+        self.ops: List[tuple] = []
+
+    def set(self, ref, data: Dict[str, Any], merge: bool = False) -> None:
+        self.ops.append(("set", ref, data, merge))
+
+    def update(self, ref, data: Dict[str, Any]) -> None:
+        self.ops.append(("update", ref, data))
+
+    def delete(self, ref) -> None:
+        self.ops.append(("delete", ref))
+
+    def apply(self, batch) -> None:
+        for op in self.ops:
+            if op[0] == "set":
+                batch.set(op[1], op[2], merge=op[3])
+            elif op[0] == "update":
+                batch.update(op[1], op[2])
+            else:
+                batch.delete(op[1])
+
+    def marker_ref(self):
+        return self.db.collection(APPLIED_COLLECTION).document(self.id)
+
+    def apply_marked(self, batch) -> None:
+        """apply(), plus the marker that records this unit as committed."""
+        self.apply(batch)
+        batch.set(self.marker_ref(), {
+            "key": self.key,
+            "appliedAt": firestore.SERVER_TIMESTAMP,
+            "expiresAt": datetime.now(timezone.utc) + APPLIED_MARKER_TTL,
+        })
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+
+class WriteBehindQueue:
+    """Bounded queue of WriteUnits drained by one background thread."""
+
+    def __init__(self, max_units: int = MAX_PENDING_UNITS, max_retries: int = MAX_RETRIES,
+                 max_batch_writes: int = MAX_BATCH_WRITES):
+        self.max_units = max(1, max_units)
+        self.max_retries = max(0, max_retries)
+        self.max_batch_writes = max_batch_writes
+        self._units = deque()
+        self._in_flight: List[WriteUnit] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.enqueued = 0
+        self.committed = 0
+        self.commits = 0
+        self.inline_commits = 0
+        self.retries = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def enqueue(self, unit: WriteUnit) -> bool:
+        """
+        Queue a unit for commit. Returns False if it was committed inline instead
+        (queue full or shut down); inline commit errors propagate to the caller.
+        """
+        if not unit:
+            return True
+        with self._cond:
+            if not self._closed and len(self._units) < self.max_units:
+                self._units.append(unit)
+                self.enqueued += 1
+                self._ensure_thread()
+                self._cond.notify()
+                return True
+            self.inline_commits += 1
+        self._commit([unit])
+        return False
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="sakhi-write-queue", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._units and not self._closed:
+                    self._cond.wait()
+                if not self._units:
+                    return
+                group = [self._units.popleft()]
+                # One more write per unit for its marker
+                writes = len(group[0]) + 1
+                while self._units and writes + len(self._units[0]) + 1 <= self.max_batch_writes:
+                    writes += len(self._units[0]) + 1
+                    group.append(self._units.popleft())
+                self._in_flight = group
+            try:
+                self._commit_with_retry(group)
+            finally:
+                with self._cond:
+                    self._in_flight = []
+                    self._cond.notify_all()
+
+    def _commit(self, group: List[WriteUnit], marked: bool = False) -> None:
+        batch = group[0].db.batch()
+        for unit in group:
+            if marked:
+                unit.apply_marked(batch)
+            else:
+                unit.apply(batch)
+        batch.commit()
+        with self._cond:
+            self.commits += 1
+            self.committed += len(group)
+
+    def _unapplied(self, group: List[WriteUnit]) -> List[WriteUnit]:
+        """The units of group without a marker, i.e. not committed by an earlier attempt."""
+        markers = group[0].db.get_all([unit.marker_ref() for unit in group], field_paths=["key"])
+        applied = {snapshot.id for snapshot in markers if snapshot.exists}
+        if applied:
+            with self._cond:
+                self.committed += len(applied)
+        return [unit for unit in group if unit.id not in applied]
+
+    def _commit_with_retry(self, group: List[WriteUnit]) -> None:
+        delay = _BASE_DELAY
+        for attempt in range(self.max_retries + 1):
+            try:
+                if attempt:
+                    # The failed attempt may have committed with its response lost
+                    group = self._unapplied(group)
+                    if not group:
+                        return
+                self._commit(group, marked=True)
+                return
+            except Exception as e:
+                with self._cond:
+                    self.failures += 1
+                error = e
+            if attempt < self.max_retries:
+                with self._cond:
+                    self.retries += 1
+                time.sleep(min(delay, _MAX_DELAY) * random.uniform(0.5, 1.0))
+                delay *= 2
+
+        if len(group) > 1:
+            # One bad unit should not take the others down with it
+            for unit in group:
+                try:
+                    if self._unapplied([unit]):
+                        self._commit([unit], marked=True)
+                except Exception as e:
+                    self._drop(unit, e)
+        else:
+            self._drop(group[0], error)
+
+    def _drop(self, unit: WriteUnit, error: Exception) -> None:
+        with self._cond:
+            self.dropped += 1
+        logging.error("Write queue: dropped unit %s (%s, %d write(s)) after %d retries: %s",
+                      unit.id, unit.key or "no key", len(unit), self.max_retries, error)
+
+    def _pending(self, key: str) -> bool:
+        return any(unit.key == key for unit in self._units) or any(unit.key == key for unit in self._in_flight)
+
+    def has_pending(self, key: str) -> bool:
+        """Whether a unit with this key is queued or being committed."""
+        with self._cond:
+            return self._pending(key)
+
+    def flush(self, timeout: Optional[float] = None, key: Optional[str] = None) -> bool:
+        """
+        Wait until every queued unit (every unit with this key, if given) has been
+        committed or dropped. Returns False on timeout.
+        """
+        with self._cond:
+            if key is not None:
+                return self._cond.wait_for(lambda: not self._pending(key), timeout)
+            return self._cond.wait_for(lambda: not self._units and not self._in_flight, timeout)
+
+    def close(self, timeout: Optional[float] = FLUSH_TIMEOUT) -> bool:
+        """Stop accepting units (later ones commit inline) and flush what is pending."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        return self.flush(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "enabled": WRITE_BEHIND,
+                "depth": len(self._units),
+                "in_flight": len(self._in_flight),
+                "max_units": self.max_units,
+                "enqueued": self.enqueued,
+                "committed": self.committed,
+                "commits": self.commits,
+                "inline_commits": self.inline_commits,
+                "retries": self.retries,
+                "failures": self.failures,
+                "dropped": self.dropped,
+            }
+
+
+_queue = WriteBehindQueue()
+
+
+def enqueue_writes(unit: WriteUnit) -> bool:
+    """Commit unit in the background (or inline when write-behind is off). Returns True if queued."""
+    if not WRITE_BEHIND:
+        batch = unit.db.batch()
+        unit.apply(batch)
+        batch.commit()
+        return False
+    return _queue.enqueue(unit)
+
+
+def flush_writes(timeout: Optional[float] = FLUSH_TIMEOUT, key: Optional[str] = None) -> bool:
+    """Wait for this worker's queued writes (those with this key, if given) to commit. Returns False on timeout."""
+    return _queue.flush(timeout, key)
+
+
+def has_pending_writes(key: str) -> bool:
+    """Whether this worker has queued writes with this key that are not committed yet."""
+    return _queue.has_pending(key)
+
+
+def write_queue_stats() -> Dict[str, Any]:
+    return _queue.stats()
+
+
+def _reset_after_fork() -> None:
+    # Units queued in the parent belong to the parent; the child starts empty
+    global _queue
+    _queue = WriteBehindQueue()
+
+
+def _flush_at_exit() -> None:
+    if not _queue.close(FLUSH_TIMEOUT):
+        print(f"Write queue: {_queue.stats()['depth']} unit(s) still pending at exit", file=sys.stderr)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(_flush_at_exit)
+
+
+def install_sigterm_exit() -> None:
+    """
+    Make SIGTERM exit the process cleanly, so pending writes are flushed.
+    Gunicorn already turns SIGTERM into a clean worker exit (running atexit);
+    under the plain Flask server it would kill the process outright. Leaves any
+    handler already installed alone, and does nothing off the main thread.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    try:
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    except (ValueError, OSError):
+        pass
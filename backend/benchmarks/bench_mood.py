@@ -0,0 +1,103 @@
+"""
+bench_mood.py: Per-message cost of the keyword mood analyzer, single and batched.
+
+Compares analyze_text_mood() (one Aho-Corasick pass over the ~70 MOOD_KEYWORDS,
+built once at import) with the previous implementation, which built and ran
+one \\b-bounded regex per keyword on every call, and checks that both return
+the same (label, score) for every sample. It then times scoring the samples
+through POST /api/mood, one request each, against a single POST
+/api/mood/batch request, using the Flask test client (no network).
+
+Usage (from backend/):
+    python -m benchmarks.bench_mood [--repeat N]
+"""
+import argparse
+import re
+import timeit
+
+from flask import Flask
+
+from app.routes.mood import MOOD_KEYWORDS, MOOD_SCORES, analyze_text_mood, mood_bp
+
+MESSAGES = [
+    "hi",
+    "I'm okay I guess",
+    "feeling really anxious and stressed about my exams, so nervous",
+    "kal mera exam hai aur mujhe bahut tension ho rahi hai yaar",
+    "I am so happy and excited today, over the moon!",
+    "everything feels hopeless and I am heartbroken",
+    "just calm and relaxed after a quiet walk",
+    "my parents keep comparing me and I get so angry and frustrated, honestly annoyed all the time",
+    "not sure what to feel, a bit down but mostly fine",
+    "I finally feel at ease, satisfied with how the week went",
+    "so-so day",
+    "Had a long talk with my friend about college, placements and the future. "
+    "It was nice but I still feel a little uneasy and worried about what comes next.",
+]
+
+
+def legacy_analyze_text_mood(message):
+    """The previous analyzer: one regex built and searched per keyword, per call."""
+    if not message:
+        return "neutral", 5
+    message = message.lower()
+    scores = {mood: 0 for mood in MOOD_KEYWORDS}
+    for mood, keywords in MOOD_KEYWORDS.items():
+        for word in keywords:
+            if re.search(r'\b' + re.escape(word) + r'\b', message):
+                scores[mood] += 1
+    max_score = 0
+    detected_mood = "neutral"
+    for mood, count in scores.items():
+        if count > max_score:
+            max_score = count
+            detected_mood = mood
+    return detected_mood.replace("_", " "), MOOD_SCORES.get(detected_mood, 5)
+
+
+def _per_message_us(fn, repeat: int) -> float:
+    timer = timeit.Timer(fn)
+    best = min(timer.repeat(repeat=5, number=repeat))
+    return best / (repeat * len(MESSAGES)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    mismatches = [m for m in MESSAGES if analyze_text_mood(m) != legacy_analyze_text_mood(m)]
+    print(f"{len(MESSAGES)} messages, {len(MESSAGES) - len(mismatches)} identical results")
+    for message in mismatches:
+        print(f"  MISMATCH {message[:60]!r}: {legacy_analyze_text_mood(message)} vs {analyze_text_mood(message)}")
+    print()
+
+    print(f"Analyzer, {args.repeat} iterations (best of 5)")
+    legacy_us = _per_message_us(lambda: [legacy_analyze_text_mood(m) for m in MESSAGES], args.repeat)
+    matcher_us = _per_message_us(lambda: [analyze_text_mood(m) for m in MESSAGES], args.repeat)
+    print(f"  per-keyword re.search : {legacy_us:8.2f} us/message")
+    print(f"  single-pass matcher   : {matcher_us:8.2f} us/message  ({legacy_us / matcher_us:.1f}x)")
+    print()
+
+    app = Flask(__name__)
+    app.secret_key = "bench"
+    app.register_blueprint(mood_bp, url_prefix="/api")
+    client = app.test_client()
+    requests = max(1, args.repeat // 20)
+
+    def one_by_one():
+        for message in MESSAGES:
+            client.post("/api/mood", json={"message": message})
+
+    def batched():
+        client.post("/api/mood/batch", json={"messages": MESSAGES})
+
+    print(f"HTTP, {requests} iterations (best of 5)")
+    single_us = _per_message_us(one_by_one, requests)
+    batch_us = _per_message_us(batched, requests)
+    print(f"  {len(MESSAGES)} x POST /api/mood    : {single_us:8.2f} us/message")
+    print(f"  1 x POST /api/mood/batch: {batch_us:8.2f} us/message  ({single_us / batch_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
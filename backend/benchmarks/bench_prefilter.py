@@ -0,0 +1,81 @@
+"""
+bench_prefilter.py: Per-message cost of the local crisis prefilter.
+
+Compares classify_locally() (normalisation, one Aho-Corasick pass over ~70
+keywords/stems, gated precompiled patterns) with the previous linear substring
+loops over EXCLUSION_PHRASES and FALLBACK_CRISIS_KEYWORDS. The matcher does more
+work per message, but both stay in the tens of microseconds; what matters is how
+many messages it settles without the Gemini detect_crisis round-trip, which
+typically costs 500-1500 ms.
+
+Usage (from backend/):
+    python -m benchmarks.bench_prefilter [--repeat N]
+"""
+import argparse
+import re
+import timeit
+
+from app.safety.prefilter import (
+    CRISIS_PATTERNS,
+    EXCLUSION_PHRASES,
+    FALLBACK_CRISIS_KEYWORDS,
+    classify_locally,
+)
+
+MESSAGES = [
+    "hi",
+    "hello, how are you?",
+    "thanks!",
+    "exam tomorrow, feeling nervous",
+    "kal mera exam hai aur mujhe bahut tension ho rahi hai yaar, kuch samajh nahi aa raha",
+    "My parents keep comparing me with my cousin and I feel like I am never good enough for them.",
+    "I don't want to die, I just want the pressure to stop for a while",
+    "I want to kill myself",
+    "mujhey marnaa h",
+    "I can't go on like this anymore, everything feels pointless and heavy",
+    "had a great day with friends, feeling light!",
+    "I almost died of embarrassment in class today lol",
+]
+
+
+def legacy_local_checks(message: str):
+    """The pre-matcher local work: linear loops plus uncompiled pattern searches."""
+    message_lower = message.lower()
+    for phrase in EXCLUSION_PHRASES:
+        if phrase.lower() in message_lower:
+            return "excluded"
+    for keyword in FALLBACK_CRISIS_KEYWORDS:
+        if keyword.lower() in message_lower:
+            return "crisis"
+    for pattern in CRISIS_PATTERNS:
+        if re.search(pattern, message_lower):
+            return "suspect"
+    return "unknown"
+
+
+def _per_message_us(fn, repeat: int) -> float:
+    timer = timeit.Timer(lambda: [fn(m) for m in MESSAGES])
+    best = min(timer.repeat(repeat=5, number=repeat))
+    return best / (repeat * len(MESSAGES)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{len(MESSAGES)} messages x {args.repeat} iterations (best of 5)")
+    print(f"  legacy loops + re.search : {_per_message_us(legacy_local_checks, args.repeat):8.2f} us/message")
+    print(f"  classify_locally         : {_per_message_us(classify_locally, args.repeat):8.2f} us/message")
+    print()
+    local = 0
+    for message in MESSAGES:
+        verdict, _ = classify_locally(message)
+        local += verdict in ("crisis", "excluded", "benign")
+        print(f"  {verdict:9s} {message[:70]}")
+    print()
+    print(f"{local}/{len(MESSAGES)} messages settled locally (no Gemini call under the local_first policy)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import pytest
+
+from tests.fake_firestore import FakeFirestore
+
+
+@pytest.fixture
+def db():
+    return FakeFirestore()
@@ -0,0 +1,382 @@
+"""
+fake_firestore.py: In-memory stand-in for the firebase_admin Firestore client.
+
+Covers what the services use: document get/set/update/delete with merge and
+dotted field paths, the Increment/Maximum/Minimum/ArrayUnion/SERVER_TIMESTAMP/
+DELETE_FIELD transforms, atomic batches, get_all, transactions (driven by the
+real firestore.transactional decorator) and queries with where, order_by,
+start_after, limit, select and stream.
+
+Batch commits can be made to fail: each entry pushed onto fail_commits is
+raised by one commit, before it applies ("error") or after it ("lost", a
+commit whose response never arrived).
+"""
+from __future__ import annotations
+
+import copy
+import itertools
+import operator
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from google.api_core import exceptions as gexc
+from google.cloud.firestore_v1 import transforms
+
+class CommitError(Exception):
+    """Raised by a commit listed in FakeFirestore.fail_commits."""
+
+
+class FakeSnapshot:
+    def __init__(self, ref, data, create_time=None, update_time=None, read_time=None):
+        self.reference = ref
+        self.id = ref.id
+        self._data = data
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        value = self._data
+        for part in field.split("."):
+            value = (value or {}).get(part)
+        return copy.deepcopy(value)
+
+
+class FakeDocument:
+    def __init__(self, db, path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str) -> "FakeCollection":
+        return FakeCollection(self._db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        if transaction is not None:
+            transaction._reads += 1
+        return self._db._snapshot(self, field_paths)
+
+    def set(self, data, merge=False):
+        self._db._commit([("set", self, data, merge)])
+
+    def update(self, data):
+        self._db._commit([("update", self, data)])
+
+    def delete(self):
+        self._db._commit([("delete", self)])
+
+    def collections(self):
+        prefix = self.path + "/"
+        names = {p[len(prefix):].split("/", 1)[0] for p in self._db._docs if p.startswith(prefix)}
+        return [self.collection(name) for name in sorted(names)]
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocument) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class FakeQuery:
+    def __init__(self, db, path: str, filters=(), orders=(), limit=None, fields=None, after=None):
+        self._db = db
+        self._path = path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._fields = fields
+        self._after = after
+
+    def _copy(self, **changes) -> "FakeQuery":
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     fields=self._fields, after=self._after)
+        state.update(changes)
+        return FakeQuery(self._db, self._path, **state)
+
+    def where(self, field=None, op=None, value=None, filter=None):
+        if filter is not None:
+            field, op, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(str(field), op, value)])
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self._orders + [(str(field), direction == "DESCENDING")])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def start_after(self, values):
+        return self._copy(after=values)
+
+    def stream(self, transaction=None):
+        return iter(self.get())
+
+    def get(self, transaction=None):
+        docs = [doc for doc in self._db._children(self._path)
+                if all(_matches(doc, *f) for f in self._filters)]
+        orders = self._orders or []
+        for field, _ in orders:
+            docs = [doc for doc in docs if _field(doc, field) is not None]
+        keys = orders + ([("__name__", orders[-1][1] if orders else False)]
+                         if not any(f == "__name__" for f, _ in orders) else [])
+        for field, descending in reversed(keys):
+            docs.sort(key=lambda doc: _sortable(_field(doc, field)), reverse=descending)
+        if self._after is not None:
+            cursor = [_sortable(self._after.get(f) if f != "__name__" else
+                                f"{self._path}/{self._after['__name__']}")
+                      for f, _ in keys]
+            docs = [doc for doc in docs if _after_cursor(doc, keys, cursor)]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        read_time = self._db._now()
+        snapshots = []
+        for ref, data, created, updated in docs:
+            if self._fields is not None:
+                data = {k: v for k, v in data.items() if k in self._fields}
+            snapshots.append(FakeSnapshot(ref, copy.deepcopy(data), created, updated, read_time))
+        return snapshots
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path: str):
+        super().__init__(db, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocument:
+        return FakeDocument(self._db, f"{self._path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def list_documents(self):
+        return [FakeDocument(self._db, p) for p in sorted(self._db._docs)
+                if p.rsplit("/", 1)[0] == self._path]
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(("set", ref, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append(("update", ref, data))
+
+    def delete(self, ref):
+        self._writes.append(("delete", ref))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._db._commit(writes, batch=True)
+
+    def __len__(self):
+        return len(self._writes)
+
+
+class FakeTransaction(FakeBatch):
+    """Enough of Transaction for the real firestore.transactional decorator."""
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._id = None
+        self._reads = 0
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        writes, self._writes = self._writes, []
+        self._db.transactions += 1
+        self._db._commit(writes)
+        return []
+
+    def _rollback(self):
+        self._clean_up()
+
+
+class FakeFirestore:
+    def __init__(self):
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._times: Dict[str, tuple] = {}
+        # Commit and read times: the creation time plus a microsecond per tick
+        self._epoch = datetime.now(timezone.utc)
+        self._clock = itertools.count(1)
+        self.fail_commits: List[str] = []
+        self.batch_commits = 0
+        self.transactions = 0
+
+    # Client API
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def transaction(self, **kwargs) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def get_all(self, refs, field_paths=None, transaction=None):
+        for ref in refs:
+            yield self._snapshot(ref, field_paths)
+
+    # Test helpers
+
+    def data(self, path: str) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._docs.get(path))
+
+    def paths(self, prefix: str = "") -> List[str]:
+        return sorted(p for p in self._docs if p.startswith(prefix))
+
+    # Internals
+
+    def _now(self) -> datetime:
+        return self._epoch + timedelta(microseconds=next(self._clock))
+
+    def _snapshot(self, ref, field_paths=None) -> FakeSnapshot:
+        data = self._docs.get(ref.path)
+        created, updated = self._times.get(ref.path, (None, None))
+        if data is not None and field_paths is not None:
+            data = {k: v for k, v in data.items() if k in {f.split(".")[0] for f in field_paths}}
+        return FakeSnapshot(ref, copy.deepcopy(data), created, updated, self._now())
+
+    def _children(self, path: str):
+        depth = path.count("/") + 1
+        for doc_path in sorted(self._docs):
+            if doc_path.startswith(path + "/") and doc_path.count("/") == depth:
+                created, updated = self._times[doc_path]
+                yield FakeDocument(self, doc_path), self._docs[doc_path], created, updated
+
+    def _commit(self, writes, batch=False):
+        failure = self.fail_commits.pop(0) if batch and self.fail_commits else None
+        if failure == "error":
+            raise CommitError("commit failed")
+        now = self._now()
+        docs = {path: copy.deepcopy(data) for path, data in self._docs.items()
+                if any(w[1].path == path for w in writes)}
+        for write in writes:
+            kind, ref = write[0], write[1]
+            if kind == "delete":
+                docs[ref.path] = None
+            elif kind == "set":
+                base = docs.get(ref.path) if write[3] else None
+                docs[ref.path] = _merge(copy.deepcopy(base) or {}, write[2], now, nested=True)
+            else:
+                if docs.get(ref.path) is None:
+                    raise gexc.NotFound(f"No document to update: {ref.path}")
+                current = docs[ref.path]
+                for key, value in write[2].items():
+                    _put(current, str(key).split("."), value, now)
+        for path, data in docs.items():
+            if data is None:
+                self._docs.pop(path, None)
+                self._times.pop(path, None)
+            else:
+                created = self._times.get(path, (now, None))[0]
+                self._docs[path] = data
+                self._times[path] = (created, now)
+        if batch:
+            self.batch_commits += 1
+        if failure == "lost":
+            raise CommitError("commit response lost")
+
+
+def _resolve(current, value, now):
+    if value is transforms.SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, transforms.Maximum):
+        return value.value if not isinstance(current, (int, float)) else max(current, value.value)
+    if isinstance(value, transforms.Minimum):
+        return value.value if not isinstance(current, (int, float)) else min(current, value.value)
+    if isinstance(value, transforms.ArrayUnion):
+        out = list(current) if isinstance(current, list) else []
+        out.extend(v for v in value.values if v not in out)
+        return out
+    if isinstance(value, transforms.ArrayRemove):
+        return [v for v in (current or []) if v not in value.values]
+    if isinstance(value, dict):
+        return _merge({}, value, now, nested=False)
+    return copy.deepcopy(value)
+
+
+def _put(doc, parts, value, now):
+    for part in parts[:-1]:
+        if not isinstance(doc.get(part), dict):
+            doc[part] = {}
+        doc = doc[part]
+    if value is transforms.DELETE_FIELD:
+        doc.pop(parts[-1], None)
+    else:
+        doc[parts[-1]] = _resolve(doc.get(parts[-1]), value, now)
+
+
+def _merge(doc, data, now, nested):
+    for key, value in data.items():
+        if nested and isinstance(value, dict) and value:
+            if not isinstance(doc.get(key), dict):
+                doc[key] = {}
+            _merge(doc[key], value, now, nested=True)
+        elif value is transforms.DELETE_FIELD:
+            doc.pop(key, None)
+        else:
+            doc[key] = _resolve(doc.get(key), value, now)
+    return doc
+
+
+def _field(doc, field):
+    ref, data = doc[0], doc[1]
+    if field == "__name__":
+        return ref.path
+    value = data
+    for part in field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _sortable(value):
+    if isinstance(value, FakeDocument):
+        return value.path
+    return value
+
+
+_OPS = {
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+    ">": operator.gt, ">=": operator.ge, "in": lambda actual, values: actual in values,
+}
+
+
+def _matches(doc, field, op, value):
+    actual = _field(doc, field)
+    if actual is None:
+        return False
+    value = _sortable(value)
+    if field == "__name__" and isinstance(value, str) and "/" not in value:
+        value = f"{doc[0].path.rsplit('/', 1)[0]}/{value}"
+    try:
+        return _OPS[op](actual, value)
+    except TypeError:
+        return False
+
+
+def _after_cursor(doc, keys, cursor):
+    for (field, descending), bound in zip(keys, cursor):
+        value = _sortable(_field(doc, field))
+        if value == bound:
+            continue
+        return value < bound if descending else value > bound
+    return False
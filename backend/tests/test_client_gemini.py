@@ -0,0 +1,67 @@
+# test_client_gemini.py: The streamed reply is the one the final frame carries.
+
+import json
+
+import pytest
+
+from app.llm import client_gemini
+from app.llm.client_gemini import SERVICE_ERROR_RESPONSE, stream_gemini_response
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Chat:
+    def __init__(self, pieces, fail_after=None):
+        self._pieces = pieces
+        self._fail_after = fail_after
+
+    def send_message(self, message, stream=False):
+        for i, piece in enumerate(self._pieces):
+            if i == self._fail_after:
+                raise RuntimeError("stream broke")
+            yield _Chunk(piece)
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    def use(pieces, fail_after=None):
+        usage = {"prompt_tokens": 0, "total_input_tokens": 0, "turns_kept": 0, "turns_dropped": 0}
+        monkeypatch.setattr(client_gemini, "_chat_model", lambda: object())
+        monkeypatch.setattr(client_gemini, "_start_chat",
+                            lambda *args, **kwargs: (_Chat(pieces, fail_after), "hi", usage))
+    return use
+
+
+def _run(history=None):
+    frames = list(stream_gemini_response(history or [{"role": "user", "parts": [{"text": "hi"}]}]))
+    return "".join(p for k, p in frames if k == "token"), frames[-1]
+
+
+def test_complete_stream(chat):
+    reply = json.dumps({"reply": "I hear you.", "mood": {"label": "calm", "score": 7}})
+    chat([reply[:12], reply[12:]])
+    streamed, (kind, done) = _run()
+    assert kind == "done" and streamed == done["reply"] == "I hear you."
+    assert done["mood"] == {"label": "calm", "score": 7}
+
+
+def test_failure_after_tokens_keeps_the_streamed_text(chat):
+    chat(['{"reply": "I hear', ' you, and', ' then'], fail_after=2)
+    streamed, (_, done) = _run()
+    assert streamed == done["reply"] == "I hear you, and"
+    assert "mood" not in done
+
+
+def test_failure_before_tokens_is_a_service_error(chat):
+    chat(['{"mood": {"label"', 'x'], fail_after=1)
+    streamed, (_, done) = _run()
+    assert streamed == "" and done["reply"] == SERVICE_ERROR_RESPONSE["reply"]
+
+
+def test_unparseable_json_keeps_the_streamed_text(chat):
+    chat(['{"reply": "Take a slow breath."', ', "mood": {oops'])
+    streamed, (_, done) = _run()
+    assert streamed == done["reply"] == "Take a slow breath."
@@ -0,0 +1,71 @@
+# test_deletion_service.py: Account purges and what finished deletion jobs keep.
+
+import time
+
+import pytest
+
+from app.services import data_version, deletion_service, message_store
+from app.services.deletion_service import KIND_ACCOUNT, KIND_SESSIONS, get_job, purge_account, start_job
+
+
+@pytest.fixture(autouse=True)
+def inline_jobs(monkeypatch):
+    monkeypatch.setattr(deletion_service, "submit_background", lambda *args, **kwargs: None)
+
+
+def _seed(db, user_id, session_ids):
+    for session_id in session_ids:
+        message_store.session_ref(db, user_id, session_id).set({"title": session_id})
+        message_store.session_ref(db, user_id, session_id).collection("messages").document().set({"text": "hi"})
+    db.collection("users").document(user_id).collection("moods").document().set({"score": 5})
+    data_version.bump_now(db, user_id, data_version.SCOPE_MOODS)
+    db.collection("userinfo").document(user_id).set({"name": "x"})
+
+
+def test_purge_leaves_nothing_behind(db):
+    _seed(db, "u1", ["s1", "s2"])
+    _seed(db, "u2", ["s3"])
+    assert purge_account(db, "u1") == (2, 7)
+    assert db.paths("users/u1") == [] and db.data("userinfo/u1") is None
+    assert db.paths("users/u2/sessions") != []
+
+
+def test_finished_jobs_drop_identifiers(db):
+    _seed(db, "u1", ["s1", "s2"])
+    job_id = start_job(db, "u1", KIND_SESSIONS, ["s1", "s2"])
+    record = db.data(f"deletionJobs/{job_id}")
+    assert record["status"] == "done" and record["sessionsDone"] == 2
+    assert "sessionIds" not in record and "u1" not in repr(record)
+
+    job = get_job(db, "u1", job_id)
+    assert job["status"] == "done" and job["deletedDocs"] == 4
+    assert get_job(db, "u2", job_id) is None
+
+
+def test_failed_job_keeps_only_the_error_type(db, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("users/u1/sessions/s1 unavailable")
+
+    monkeypatch.setattr(deletion_service, "purge_account", fail)
+    job_id = start_job(db, "u1", KIND_ACCOUNT)
+    record = db.data(f"deletionJobs/{job_id}")
+    assert record["status"] == "failed" and record["error"] == "RuntimeError"
+    assert "u1" not in repr(record)
+
+
+def test_session_delete_waits_only_for_its_own_queued_writes(db, monkeypatch):
+    from app.utils import write_queue
+    from app.utils.write_queue import WriteBehindQueue, WriteUnit
+
+    queue = WriteBehindQueue()
+    monkeypatch.setattr(write_queue, "_queue", queue)
+    _seed(db, "u1", ["s1", "s2"])
+    other = WriteUnit(db, key="u1/s2")
+    other.set(message_store.session_ref(db, "u1", "s2"), {"title": "queued"}, merge=True)
+    queue._units.append(other)  # queued behind a stalled commit thread
+
+    started = time.monotonic()
+    deletion_service.delete_session(db, "u1", "s1")
+    assert time.monotonic() - started < 1
+    assert db.paths("users/u1/sessions/s1") == []
+    assert queue.has_pending("u1/s2")
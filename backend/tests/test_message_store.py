@@ -0,0 +1,97 @@
+# test_message_store.py: Chunk slots stay ordered across workers and chunks stay under the size cap.
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import message_store
+from app.services.message_store import append_messages, layout_state, new_session_state, read_all, read_page
+
+T0 = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(message_store, "NEW_SESSION_LAYOUT", message_store.LAYOUT_CHUNKED)
+    monkeypatch.setattr(message_store, "MESSAGE_CHUNK_SIZE", 4)
+
+
+def _turn(i, text="hello"):
+    return [{"author": "user", "text": text, "timestamp": T0 + timedelta(seconds=2 * i)},
+            {"author": "bot", "text": text, "timestamp": T0 + timedelta(seconds=2 * i + 1)}]
+
+
+def _append(db, state, i, new_session=False, text="hello"):
+    batch = db.batch()
+    written, state, fields = append_messages(batch, db, "u1", "s1", state, _turn(i, text), new_session=new_session)
+    if fields:
+        batch.set(message_store.session_ref(db, "u1", "s1"), fields, merge=True)
+    batch.commit()
+    return state
+
+
+def _chunks(db):
+    return {path.rsplit("/", 1)[-1]: db.data(path) for path in db.paths("users/u1/sessions/s1/chunks/")}
+
+
+def test_stale_worker_state_does_not_reopen_a_chunk(db):
+    worker_a = _append(db, new_session_state(), 0, new_session=True)
+    worker_b = dict(worker_a)
+    worker_b = _append(db, worker_b, 1)      # chunk 000 is now full
+    worker_a = _append(db, worker_a, 2)      # A's cached state still says 2 messages in chunk 000
+
+    chunks = _chunks(db)
+    assert [c["count"] for c in chunks.values()] == [4, 2]
+    assert chunks["000001"]["firstTimestamp"] == T0 + timedelta(seconds=4)
+    assert worker_a["chunkSeq"] == 1
+    assert layout_state(db.data("users/u1/sessions/s1"))["chunkSeq"] == 1
+
+
+def test_state_ahead_of_firestore_is_kept(db):
+    # The new session's own write is still queued: Firestore has no session yet
+    state = {"layout": message_store.LAYOUT_CHUNKED, "chunkSeq": 0, "chunkCount": 2, "chunkBytes": 250}
+    state = _append(db, state, 1)
+    assert (state["chunkSeq"], state["chunkCount"]) == (0, 4)
+    assert db.transactions == 1
+
+
+def test_paging_back_across_chunks_written_by_two_workers(db):
+    worker_a = _append(db, new_session_state(), 0, new_session=True)
+    worker_b = dict(worker_a)
+    for i in range(1, 7):
+        if i % 2:
+            worker_b = _append(db, worker_b, i)
+        else:
+            worker_a = _append(db, worker_a, i)
+
+    state = layout_state(db.data("users/u1/sessions/s1"))
+    everything = read_all(db, "u1", "s1", state)
+    assert len(everything) == 14
+    pages, before = [], None
+    while True:
+        page, more = read_page(db, "u1", "s1", state, 3, before)
+        pages = page + pages
+        if not more:
+            break
+        before = (page[0]["timestamp"], page[0]["id"])
+    assert pages == everything
+
+
+def test_chunks_roll_over_before_the_byte_cap(db, monkeypatch):
+    monkeypatch.setattr(message_store, "MESSAGE_CHUNK_SIZE", 50)
+    monkeypatch.setattr(message_store, "MESSAGE_CHUNK_MAX_BYTES", 10_000)
+    state = _append(db, new_session_state(), 0, new_session=True, text="x" * 3000)
+    for i in range(1, 4):
+        state = _append(db, state, i, text="x" * 3000)
+
+    for chunk in _chunks(db).values():
+        assert message_store.message_bytes(chunk["messages"]) <= 10_000
+    assert len(_chunks(db)) == 4
+
+
+def test_long_texts_are_capped(db, monkeypatch):
+    monkeypatch.setattr(message_store, "MAX_MESSAGE_CHARS", 100)
+    _append(db, new_session_state(), 0, new_session=True, text="y" * 500)
+    assert all(len(m["text"]) == 100 for m in read_all(db, "u1", "s1", new_session_state()))
+    chunks = message_store.chunk_messages([{"id": "a", "author": "user", "text": "z" * 500, "timestamp": T0}])
+    assert len(chunks[0]["messages"][0]["text"]) == 100
@@ -0,0 +1,90 @@
+# test_mood_rollups.py: Rollups rebuild from entries, and streaks are derived from the day rollups.
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import mood_rollups
+from app.services.mood_rollups import current_streak, day_key, read_days, recompute_day, record_entry
+
+NOW = datetime(2026, 3, 10, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def fixed_now(monkeypatch):
+    monkeypatch.setattr(mood_rollups, "utc_now", lambda: NOW)
+
+
+def _add(db, days_ago, score=6, label="calm"):
+    timestamp = NOW - timedelta(days=days_ago)
+    ref = db.collection("users").document("u1").collection("moods").document()
+    batch = db.batch()
+    batch.set(ref, {"label": label, "score": score, "timestamp": timestamp})
+    record_entry(batch, db, "u1", label, score, timestamp)
+    batch.commit()
+    return ref
+
+
+def _first_day(days):
+    return (NOW - timedelta(days=days)).date().isoformat()
+
+
+def test_record_entry_reads_nothing_and_accumulates(db):
+    _add(db, 0, score=4, label="sad")
+    _add(db, 0, score=8, label="Happy")
+    today = db.data(f"users/u1/moodRollups/{day_key(NOW)}")
+    assert (today["sum"], today["count"], today["min"], today["max"]) == (12, 2, 4, 8)
+    assert today["labels"] == {"sad": 1, "happy": 1}
+    assert today["hist"] == {"4": 1, "8": 1}
+    assert "streak" not in today
+    month = db.data("users/u1/moodRollupMonths/2026-03")
+    assert month["days"]["10"]["count"] == 2
+
+
+def test_recompute_day_matches_entries_after_delete(db):
+    keep = _add(db, 1, score=3)
+    drop = _add(db, 1, score=9, label="joy")
+    drop.delete()
+    recompute_day(db, "u1", day_key(NOW - timedelta(days=1)))
+
+    day = db.data(f"users/u1/moodRollups/{day_key(NOW - timedelta(days=1))}")
+    assert (day["sum"], day["count"], day["labels"]) == (3, 1, {"calm": 1})
+    keep.delete()
+    recompute_day(db, "u1", day_key(NOW - timedelta(days=1)))
+    assert db.data(f"users/u1/moodRollups/{day_key(NOW - timedelta(days=1))}") is None
+    assert "09" not in db.data("users/u1/moodRollupMonths/2026-03")["days"]
+
+
+def test_streak_counts_back_from_today(db):
+    for days_ago in (0, 1, 2, 4):
+        _add(db, days_ago)
+    assert current_streak(db, "u1") == 3
+    days = read_days(db, "u1", _first_day(7))
+    assert current_streak(db, "u1", days, _first_day(7)) == 3
+
+
+def test_no_entry_today_means_no_streak(db):
+    _add(db, 1)
+    assert current_streak(db, "u1") == 0
+    assert current_streak(db, "u1", read_days(db, "u1", _first_day(7)), _first_day(7)) == 0
+
+
+def test_streak_runs_past_the_window_and_across_pages(db, monkeypatch):
+    monkeypatch.setattr(mood_rollups, "_STREAK_PAGE_DAYS", 4)
+    for days_ago in range(12):
+        _add(db, days_ago)
+    _add(db, 14)
+    days = read_days(db, "u1", _first_day(3))
+    assert current_streak(db, "u1", days, _first_day(3)) == 12
+
+
+def test_backdated_entry_and_delete_update_the_streak(db):
+    _add(db, 0)
+    gap = _add(db, 1)
+    _add(db, 2)
+    assert current_streak(db, "u1") == 3
+    gap.delete()
+    recompute_day(db, "u1", day_key(NOW - timedelta(days=1)))
+    assert current_streak(db, "u1") == 1
+    _add(db, 1)  # backdated entry fills the gap again
+    assert current_streak(db, "u1") == 3
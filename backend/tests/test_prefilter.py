@@ -0,0 +1,52 @@
+# test_prefilter.py: Local crisis triage never clears passive-suicidal messages.
+
+import pytest
+
+from app.safety import prefilter
+from app.safety.prefilter import classify_locally, normalize_message
+
+PASSIVE_SUICIDAL = [
+    "everyone is better off without me",
+    "nobody would miss me",
+    "I want to disappear",
+    "I wish I was never born",
+    "i want to d1e",
+]
+
+
+@pytest.mark.parametrize("message", PASSIVE_SUICIDAL)
+def test_passive_suicidal_messages_are_not_benign(message):
+    verdict, _ = classify_locally(message)
+    assert verdict != "benign"
+
+
+@pytest.mark.parametrize("message", PASSIVE_SUICIDAL)
+def test_passive_suicidal_messages_reach_gemini_under_local_first(monkeypatch, message):
+    calls = []
+
+    def fake_detect(text):
+        calls.append(text)
+        return True, 0.9, "passive ideation"
+
+    monkeypatch.setattr(prefilter, "PREFILTER_POLICY", "local_first")
+    monkeypatch.setattr(prefilter, "detect_crisis", fake_detect)
+    assert prefilter.check_for_crisis(message) == (True, "gemini_crisis_detection:90")
+    assert calls == [message]
+
+
+@pytest.mark.parametrize("message", ["hi", "Hello!", "thank you :)", "ok.", "theek hai"])
+def test_greetings_and_acknowledgements_are_benign(message):
+    assert classify_locally(message) == ("benign", None)
+
+
+def test_default_policy_is_remote():
+    assert prefilter.PREFILTER_POLICY == "remote"
+
+
+def test_short_english_words_are_not_folded_to_hinglish():
+    assert normalize_message("he said h is fine") == "he said h is fine"
+    assert normalize_message("mujhey marnaa hain") == "mujhe marna hai"
+
+
+def test_high_confidence_keyword_is_local_crisis():
+    assert classify_locally("mujhey marnaa h")[0] == "crisis"
@@ -0,0 +1,32 @@
+# test_pulse_service.py: A region with nothing cached always gets a summary.
+
+from concurrent.futures import Future
+
+import pytest
+
+from app.services import pulse_service
+from app.services.pulse_store import MemoryPulseStore
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(pulse_service, "_STORE", MemoryPulseStore(pulse_service._THEME_NAMES))
+    monkeypatch.setattr(pulse_service, "_REFRESHING", {})
+    monkeypatch.setattr(pulse_service, "_call_gemini", lambda summary: {"ai_summary": "fresh", "ai_actions": []})
+    return pulse_service
+
+
+def test_background_refresh_left_to_another_worker(service):
+    # A background refresh whose lease another worker holds resolves to None
+    future = Future()
+    future.set_result(None)
+    service._REFRESHING["campus"] = future
+
+    result = service.get_or_build_summary("campus")
+    assert result["ai_summary"] == "fresh" and result["cached"] is False
+
+
+def test_first_request_builds_and_caches(service):
+    result = service.get_or_build_summary("campus")
+    assert result["ai_summary"] == "fresh"
+    assert service._STORE.get_summary("campus") is not None
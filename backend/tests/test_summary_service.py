@@ -0,0 +1,69 @@
+# test_summary_service.py: Legacy sessions compact, and compaction never double-counts.
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import summary_service
+from app.services.summary_service import SUMMARY_BATCH, SUMMARY_KEEP_RECENT, compact_session, summary_state
+
+T0 = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def fake_summarizer(monkeypatch):
+    calls = []
+
+    def summarize(summary, history):
+        calls.append(len(history))
+        return f"summary of {len(history)}"
+
+    monkeypatch.setattr(summary_service, "summarize_conversation", summarize)
+    return calls
+
+
+def _session(db, count, **fields):
+    ref = db.collection("users").document("u1").collection("sessions").document("s1")
+    ref.set(fields)
+    for i in range(count):
+        ref.collection("messages").document(f"m{i:03d}").set(
+            {"author": "user", "text": str(i), "timestamp": T0 + timedelta(seconds=i)})
+    return ref
+
+
+def test_legacy_session_counts_every_message_until_first_compaction():
+    # unsummarized started from zero on the first turn after the upgrade
+    assert summary_state({"messageCount": 40, "unsummarized": 4})[2] == 40
+    assert summary_state({"messageCount": 40})[2] == 40
+    assert summary_state({"messageCount": 40, "unsummarized": 4, "summarizedThrough": T0})[2] == 4
+
+
+def test_first_compaction_of_legacy_session_writes_absolute_count(db, fake_summarizer):
+    _session(db, 40, messageCount=40, unsummarized=4)
+
+    assert compact_session(db, "u1", "s1")
+    data = db.data("users/u1/sessions/s1")
+    assert fake_summarizer == [40 - SUMMARY_KEEP_RECENT]
+    assert data["unsummarized"] == SUMMARY_KEEP_RECENT
+    assert data["summarizedThrough"] == T0 + timedelta(seconds=40 - SUMMARY_KEEP_RECENT - 1)
+
+
+def test_compaction_skips_session_compacted_meanwhile(db, monkeypatch):
+    ref = _session(db, 30, messageCount=30, unsummarized=30)
+
+    def summarize_while_another_worker_compacts(summary, history):
+        ref.update({"summarizedThrough": T0 + timedelta(seconds=5), "unsummarized": 24})
+        return "late summary"
+
+    monkeypatch.setattr(summary_service, "summarize_conversation", summarize_while_another_worker_compacts)
+    assert not compact_session(db, "u1", "s1")
+    assert db.data("users/u1/sessions/s1")["unsummarized"] == 24
+
+
+def test_history_window_covers_the_compaction_tail():
+    from app.routes import chat
+
+    assert chat.HISTORY_WINDOW >= SUMMARY_KEEP_RECENT + SUMMARY_BATCH
+    assert chat._history_window(0) == chat.HISTORY_WINDOW
+    assert chat._history_window(chat.HISTORY_WINDOW + 5) == chat.HISTORY_WINDOW + 5
+    assert chat._history_window(10 ** 6) == chat.HISTORY_WINDOW_MAX
@@ -0,0 +1,86 @@
+# test_sync_service.py: Change tokens, tombstones and backdated creates in the mood delta sync.
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import mood_rollups, sync_service
+from app.services.sync_service import SyncError, apply_mutations, changes_since, decode_token, entry_id_for
+from app.utils.cursor import encode_cursor
+
+
+def _create(client_id, score=6, when=None):
+    entry = {"label": "calm", "score": score}
+    if when is not None:
+        entry["timestamp"] = when.isoformat()
+    return {"clientId": client_id, "op": "upsert", "entry": entry}
+
+
+@pytest.mark.parametrize("token", [
+    "not a token",
+    encode_cursor({"t": 5}),
+    encode_cursor({"t": "2026-01-01T00:00:00+00:00"}),
+    encode_cursor({"t": datetime(2026, 1, 1)}),
+    encode_cursor({"x": datetime(2026, 1, 1, tzinfo=timezone.utc)}),
+])
+def test_malformed_tokens_are_sync_errors(token):
+    with pytest.raises(SyncError):
+        decode_token(token)
+
+
+def test_token_round_trips():
+    when = datetime(2026, 1, 1, 8, 30, 0, 123456, tzinfo=timezone.utc)
+    assert decode_token(encode_cursor({"t": when})) == when
+    assert decode_token(None) is None
+
+
+def test_changes_and_tombstones_since_token(db):
+    apply_mutations(db, "u1", [_create("a"), _create("b"), _create("c")])
+    first = changes_since(db, "u1", None)
+    assert first["reset"] and len(first["changed"]) == 3
+
+    a, b = entry_id_for("u1", "a"), entry_id_for("u1", "b")
+    results = apply_mutations(db, "u1", [
+        {"clientId": "a", "op": "upsert", "id": a, "entry": {"score": 2}},
+        {"clientId": "b", "op": "delete", "id": b},
+    ])
+    assert [r["status"] for r in results] == ["updated", "deleted"]
+
+    delta = changes_since(db, "u1", decode_token(first["token"]))
+    assert not delta["reset"]
+    assert [e["id"] for e in delta["changed"]] == [a]
+    assert delta["deleted"] == [b]
+
+    # Nothing changed since the new token
+    again = changes_since(db, "u1", decode_token(delta["token"]))
+    assert (again["changed"], again["deleted"]) == ([], [])
+
+
+def test_update_of_deleted_entry_reports_missing(db):
+    apply_mutations(db, "u1", [_create("a")])
+    a = entry_id_for("u1", "a")
+    apply_mutations(db, "u1", [{"clientId": "a", "op": "delete", "id": a}])
+    [result] = apply_mutations(db, "u1", [{"clientId": "a", "op": "upsert", "id": a, "entry": {"score": 3}}])
+    assert result["status"] == "missing"
+    assert db.data(f"users/u1/moodTombstones/{a}") is not None
+
+
+def test_retried_create_does_not_duplicate(db):
+    apply_mutations(db, "u1", [_create("a")])
+    [result] = apply_mutations(db, "u1", [_create("a", score=7)])
+    assert result["status"] == "updated"
+    assert len(db.paths("users/u1/moods/")) == 1
+
+
+def test_token_older_than_tombstone_retention_resets(db):
+    old = datetime.now(timezone.utc) - timedelta(days=sync_service.SYNC_TOMBSTONE_DAYS + 1)
+    assert changes_since(db, "u1", old)["reset"]
+
+
+def test_backdated_creates_extend_the_streak(db):
+    now = datetime.now(timezone.utc)
+    apply_mutations(db, "u1", [_create("today", when=now)])
+    assert mood_rollups.current_streak(db, "u1") == 1
+    apply_mutations(db, "u1", [_create("d2", when=now - timedelta(days=2)),
+                               _create("d1", when=now - timedelta(days=1))])
+    assert mood_rollups.current_streak(db, "u1") == 3
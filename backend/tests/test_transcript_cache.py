@@ -0,0 +1,104 @@
+# test_transcript_cache.py: Filling the cache never drops queued turns, and entries go stale on other workers' writes.
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import data_version, transcript_cache
+from app.services.transcript_cache import (
+    append_messages, await_pending_writes, count_version_bump, get_transcript, is_current, put_transcript,
+)
+from app.utils import write_queue
+from app.utils.write_queue import WriteBehindQueue, WriteUnit
+
+T0 = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+
+def _msg(i):
+    return {"id": f"m{i}", "author": "user" if i % 2 == 0 else "bot", "text": f"message {i}",
+            "timestamp": T0 + timedelta(seconds=i)}
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    queue = WriteBehindQueue()
+    monkeypatch.setattr(write_queue, "_queue", queue)
+    return queue
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    yield
+    for session_id in ("s1", "s2"):
+        transcript_cache.invalidate("u1", session_id)
+
+
+def test_full_read_keeps_cached_turns_newer_than_the_read(queue):
+    put_transcript("u1", "s1", [_msg(0), _msg(1)], complete=False, unsummarized=2)
+    # A turn written by this worker, still queued when the full transcript is read
+    append_messages("u1", "s1", [_msg(2), _msg(3)])
+    firestore_read = [_msg(i) for i in range(2)]
+    put_transcript("u1", "s1", firestore_read, complete=True, unsummarized=2)
+
+    entry = get_transcript("u1", "s1")
+    assert [m["id"] for m in entry["messages"]] == ["m0", "m1", "m2", "m3"]
+    assert entry["complete"] is True
+    assert entry["unsummarized"] == 4
+
+
+def test_read_that_already_has_the_turn_does_not_duplicate_it(queue):
+    put_transcript("u1", "s1", [_msg(0), _msg(1)], complete=False, unsummarized=2)
+    append_messages("u1", "s1", [_msg(2), _msg(3)])
+    put_transcript("u1", "s1", [_msg(i) for i in range(4)], complete=True, unsummarized=4)
+
+    entry = get_transcript("u1", "s1")
+    assert [m["id"] for m in entry["messages"]] == ["m0", "m1", "m2", "m3"]
+    assert entry["unsummarized"] == 4
+
+
+def test_no_fill_while_uncached_session_has_queued_writes(db, queue):
+    unit = WriteUnit(db, key="u1/s1")
+    unit.set(db.collection("users").document("u1"), {"x": 1})
+    queue._units.append(unit)  # queued, not yet committed
+
+    put_transcript("u1", "s1", [_msg(0)], complete=True)
+    assert get_transcript("u1", "s1") is None
+
+    put_transcript("u1", "s2", [_msg(0)], complete=True)
+    assert get_transcript("u1", "s2") is not None
+
+
+def test_await_pending_writes_waits_for_the_session_only(db, queue):
+    unit = WriteUnit(db, key="u1/s1")
+    unit.set(db.collection("users").document("u1").collection("sessions").document("s1"), {"messageCount": 2})
+    queue.enqueue(unit)
+
+    assert await_pending_writes("u1", "s1")
+    assert db.data("users/u1/sessions/s1") == {"messageCount": 2}
+    assert not write_queue.has_pending_writes("u1/s1")
+
+
+def test_entry_tracks_this_workers_version_bumps(db, queue):
+    data_version.bump_now(db, "u1", data_version.SCOPE_SESSIONS)
+    put_transcript("u1", "s1", [_msg(0), _msg(1)], complete=True,
+                   version=data_version.current(db, "u1", data_version.SCOPE_SESSIONS))
+    assert is_current(get_transcript("u1", "s1"), data_version.current(db, "u1", data_version.SCOPE_SESSIONS))
+
+    # A turn and a generated title written by this worker, each bumping the version once
+    append_messages("u1", "s1", [_msg(2), _msg(3)])
+    count_version_bump("u1", "s1")
+    for _ in range(2):
+        data_version.bump_now(db, "u1", data_version.SCOPE_SESSIONS)
+    assert is_current(get_transcript("u1", "s1"), data_version.current(db, "u1", data_version.SCOPE_SESSIONS))
+
+
+def test_another_workers_write_makes_the_entry_stale(db, queue):
+    put_transcript("u1", "s1", [_msg(0)], complete=True,
+                   version=data_version.current(db, "u1", data_version.SCOPE_SESSIONS))
+    data_version.bump_now(db, "u1", data_version.SCOPE_SESSIONS)
+    assert not is_current(get_transcript("u1", "s1"), data_version.current(db, "u1", data_version.SCOPE_SESSIONS))
+
+
+def test_new_session_entry_is_validated_by_a_read(db, queue):
+    append_messages("u1", "s1", [_msg(0), _msg(1)], new_session=True)
+    assert not is_current(get_transcript("u1", "s1"), data_version.current(db, "u1", data_version.SCOPE_SESSIONS))
@@ -0,0 +1,91 @@
+# test_write_queue.py: Retries never apply a unit twice; units that fail for good are logged.
+
+import logging
+import subprocess
+import sys
+
+import pytest
+from firebase_admin import firestore
+
+from app.utils import write_queue
+from app.utils.write_queue import APPLIED_COLLECTION, WriteBehindQueue, WriteUnit
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(write_queue.time, "sleep", lambda seconds: None)
+
+
+def _turn(db, session_id="s1"):
+    unit = WriteUnit(db, key=f"u1/{session_id}")
+    session = db.collection("users").document("u1").collection("sessions").document(session_id)
+    unit.set(session, {"messageCount": firestore.Increment(2), "unsummarized": firestore.Increment(2)}, merge=True)
+    unit.set(db.collection("users").document("u1"),
+             {"dataVersions": {"sessions": firestore.Increment(1)}}, merge=True)
+    return unit
+
+
+def _commit(queue, *units):
+    for unit in units:
+        assert queue.enqueue(unit)
+    assert queue.flush(5)
+
+
+def test_lost_commit_response_is_not_reapplied(db):
+    queue = WriteBehindQueue(max_retries=3)
+    db.fail_commits = ["lost"]
+    _commit(queue, _turn(db))
+
+    assert db.data("users/u1/sessions/s1") == {"messageCount": 2, "unsummarized": 2}
+    assert db.data("users/u1")["dataVersions"] == {"sessions": 1}
+    assert db.batch_commits == 1
+    assert queue.stats()["committed"] == 1
+    assert queue.stats()["dropped"] == 0
+
+
+def test_failed_commit_is_retried(db):
+    queue = WriteBehindQueue(max_retries=3)
+    db.fail_commits = ["error", "error"]
+    _commit(queue, _turn(db))
+
+    assert db.data("users/u1/sessions/s1") == {"messageCount": 2, "unsummarized": 2}
+    assert queue.stats()["retries"] == 2
+    assert len(db.paths(APPLIED_COLLECTION + "/")) == 1
+
+
+def test_lost_group_commit_then_split_retry_applies_each_unit_once(db):
+    queue = WriteBehindQueue(max_retries=1)
+    units = [_turn(db, "s1"), _turn(db, "s2")]
+    db.fail_commits = ["lost", "error"]
+    queue._commit_with_retry(units)
+
+    for sid in ("s1", "s2"):
+        assert db.data(f"users/u1/sessions/{sid}") == {"messageCount": 2, "unsummarized": 2}
+    assert db.data("users/u1")["dataVersions"] == {"sessions": 2}
+    assert queue.stats()["dropped"] == 0
+
+
+def test_unit_failing_every_retry_is_logged_with_its_key(db, caplog):
+    queue = WriteBehindQueue(max_retries=2)
+    db.fail_commits = ["error"] * 3
+    with caplog.at_level(logging.ERROR):
+        _commit(queue, _turn(db))
+
+    assert db.data("users/u1/sessions/s1") is None
+    assert queue.stats()["dropped"] == 1
+    [record] = [r for r in caplog.records if r.levelno == logging.ERROR]
+    assert "u1/s1" in record.getMessage()
+
+
+def test_inline_commit_writes_no_marker(db):
+    queue = WriteBehindQueue(max_units=1)
+    queue._closed = True
+    assert not queue.enqueue(_turn(db))
+    assert db.data("users/u1/sessions/s1") == {"messageCount": 2, "unsummarized": 2}
+    assert db.paths(APPLIED_COLLECTION + "/") == []
+
+
+def test_import_leaves_sigterm_alone():
+    code = ("import signal; from app.utils import write_queue; "
+            "assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL")
+    subprocess.run([sys.executable, "-c", code], check=True)
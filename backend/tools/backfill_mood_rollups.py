@@ -0,0 +1,85 @@
+"""
+backfill_mood_rollups.py: Rebuild the daily and monthly mood rollups from the mood entries.
+
+/mood/cloud/stats reads users/{uid}/moodRollups and moodRollupMonths, which
+mood writes now keep up to date. This rebuilds them from every entry of each
+user. Use it once for entries written before rollups
+existed, or to repair rollups that have drifted. Rollup days with no entries
+are removed.
+
+Usage (from backend/):
+    python -m tools.backfill_mood_rollups [--uid UID ...] [--dry-run]
+"""
+import argparse
+
+from app.db import get_db, initialize_firebase
+from app.services import mood_rollups
+
+_BATCH_DAYS = 150  # three writes per day (day, month, version), under Firestore's 500 per commit
+
+
+def rebuild_user(db, user_id, dry_run=False):
+    """Rebuild one user's rollups. Returns (entries, days with entries, stale days removed)."""
+    user_ref = db.collection("users").document(user_id)
+    days = {}
+    entries = 0
+    for doc in user_ref.collection("moods").select(["score", "label", "timestamp"]).stream():
+        data = doc.to_dict() or {}
+        if not hasattr(data.get("timestamp"), "date"):
+            continue
+        days.setdefault(mood_rollups.day_key(data["timestamp"]), []).append(data)
+        entries += 1
+
+    existing = {doc.id for doc in user_ref.collection(mood_rollups.DAYS_COLLECTION).select([]).stream()}
+    stale = sorted(existing - set(days))
+    if dry_run:
+        return entries, len(days), len(stale)
+
+    batch, pending = db.batch(), 0
+    for day in sorted(days):
+        aggregate = mood_rollups.aggregate_entries(days[day])
+        if aggregate is None:
+            stale.append(day)
+            continue
+        mood_rollups.write_day(db, user_id, day, aggregate, batch=batch)
+        pending += 1
+        if pending >= _BATCH_DAYS:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    for day in stale:
+        mood_rollups.write_day(db, user_id, day, None, batch=batch)
+        pending += 1
+        if pending >= _BATCH_DAYS:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    return entries, len(days), len(stale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild mood rollups from mood entries")
+    parser.add_argument("--uid", action="append", help="only this user (repeatable); default: all users")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    initialize_firebase()
+    db = get_db()
+    user_ids = args.uid or [ref.id for ref in db.collection("users").list_documents()]
+
+    total_entries = total_days = total_stale = 0
+    for user_id in user_ids:
+        entries, days, stale = rebuild_user(db, user_id, dry_run=args.dry_run)
+        total_entries += entries
+        total_days += days
+        total_stale += stale
+        if entries or stale:
+            print(f"{user_id}: {entries} entries -> {days} days" + (f", {stale} stale days" if stale else ""))
+
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}{len(user_ids)} users, {total_entries} entries rolled up into {total_days} days, "
+          f"{total_stale} stale days removed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+backfill_session_listing.py: Fill in the session fields the paginated sidebar listing relies on.
+
+The listing orders sessions by updatedAt and shows the denormalized
+messageCount and lastMessagePreview, which chat turns now maintain. Sessions
+written before that may lack them, and a session without updatedAt is left
+out of the listing entirely. For each such session this sets updatedAt (from
+the newest message, else createdAt), messageCount (an aggregation count) and
+lastMessagePreview. Run it right after deploying: a turn in a session that has
+no messageCount yet starts the count from that turn. Sessions that were never
+summarized also get unsummarized raised to messageCount, since every one of
+their messages is unsummarized.
+
+Usage (from backend/):
+    python -m tools.backfill_session_listing [--uid UID ...] [--dry-run]
+"""
+import argparse
+from datetime import datetime, timezone
+
+from app.db import get_db, initialize_firebase
+from app.services import data_version, message_store
+
+
+def backfill_session(db, user_id, snapshot, dry_run=False):
+    """Return the fields set on one session ({} if it needed nothing)."""
+    data = snapshot.to_dict() or {}
+    # Never summarized, with an unsummarized count that a turn after the upgrade started from zero
+    legacy_tail = ('summarizedThrough' not in data
+                   and int(data.get('unsummarized') or 0) < int(data.get('messageCount') or 0))
+    if all(field in data for field in ('updatedAt', 'messageCount', 'lastMessagePreview')) and not legacy_tail:
+        return {}
+
+    state = message_store.layout_state(data)
+    last = message_store.read_recent(db, user_id, snapshot.id, state, 1)
+    updates = {}
+    if 'updatedAt' not in data:
+        updates['updatedAt'] = (last[-1]['timestamp'] if last else None) or data.get('createdAt') \
+            or datetime.now(timezone.utc)
+    if 'messageCount' not in data:
+        if state['layout'] == message_store.LAYOUT_CHUNKED:
+            chunks = snapshot.reference.collection('chunks').select(['count']).stream()
+            updates['messageCount'] = sum(int((c.to_dict() or {}).get('count') or 0) for c in chunks)
+        else:
+            result = snapshot.reference.collection('messages').count().get()
+            updates['messageCount'] = int(result[0][0].value)
+    if 'lastMessagePreview' not in data:
+        updates['lastMessagePreview'] = message_store.preview(last[-1]['text']) if last else ''
+    message_count = updates.get('messageCount', data.get('messageCount'))
+    if 'summarizedThrough' not in data and int(data.get('unsummarized') or 0) < int(message_count or 0):
+        updates['unsummarized'] = int(message_count)
+
+    if not dry_run:
+        snapshot.reference.update(updates)
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill session listing fields")
+    parser.add_argument("--uid", action="append", help="only this user (repeatable); default: all users")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    initialize_firebase()
+    db = get_db()
+    user_ids = args.uid or [ref.id for ref in db.collection("users").list_documents()]
+
+    scanned = updated = 0
+    for user_id in user_ids:
+        changed = False
+        for snapshot in db.collection("users").document(user_id).collection("sessions").stream():
+            scanned += 1
+            updates = backfill_session(db, user_id, snapshot, dry_run=args.dry_run)
+            if updates:
+                updated += 1
+                changed = True
+                print(f"{user_id}/{snapshot.id}: {', '.join(sorted(updates))}")
+        if changed and not args.dry_run:
+            # Invalidate the listing's ETags
+            data_version.bump_now(db, user_id, data_version.SCOPE_SESSIONS)
+
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}{scanned} sessions scanned, {updated} backfilled")
+
+
+if __name__ == "__main__":
+    main()
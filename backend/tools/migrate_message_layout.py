@@ -0,0 +1,135 @@
+"""
+migrate_message_layout.py: Convert chat sessions between message storage layouts.
+
+For each session not already in the target layout, every message is read,
+written in the target layout (chunk documents or one document per message),
+and the session document's messageLayout is flipped in the same batch as the
+last of those writes, so readers keep using the old layout until the copy is
+complete. The source documents are then deleted.
+
+Running servers remember a session's layout for up to SAKHI_TRANSCRIPT_CACHE_TTL
+seconds. Migrate while the backend is scaled to zero, or run once with
+--keep-source, wait that long, and run again with --cleanup to delete the
+leftover source documents.
+
+Usage (from backend/):
+    python -m tools.migrate_message_layout [--to chunked|docs] [--uid UID ...]
+                                           [--dry-run] [--keep-source | --cleanup]
+"""
+import argparse
+
+from firebase_admin import firestore
+
+from app.db import get_db, initialize_firebase
+from app.services import message_store
+from app.services.message_store import LAYOUT_CHUNKED, LAYOUT_DOCS
+
+_BATCH_WRITES = 450
+
+
+def _commit_in_batches(db, writes, final_write):
+    """Commit (ref, data) set-writes in batches; final_write goes into the last batch."""
+    batch = db.batch()
+    pending = 0
+    for ref, data in writes:
+        batch.set(ref, data)
+        pending += 1
+        if pending >= _BATCH_WRITES:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    ref, data = final_write
+    batch.update(ref, data)
+    batch.commit()
+
+
+def migrate_session(db, user_id, session_id, session_data, target, dry_run=False, keep_source=False):
+    """Migrate one session. Returns (messages moved, documents written), or None if already in target."""
+    state = message_store.layout_state(session_data)
+    if state["layout"] == target:
+        return None
+
+    messages = message_store.read_all(db, user_id, session_id, state)
+    session_ref = message_store.session_ref(db, user_id, session_id)
+    if target == LAYOUT_CHUNKED:
+        chunks = message_store.chunk_messages(messages)
+        writes = [(session_ref.collection("chunks").document(f"{c['seq']:06d}"), c) for c in chunks]
+        flip = {
+            "messageLayout": LAYOUT_CHUNKED,
+            "chunkSeq": chunks[-1]["seq"] if chunks else 0,
+            "chunkCount": chunks[-1]["count"] if chunks else 0,
+            "chunkBytes": message_store.message_bytes(chunks[-1]["messages"]) if chunks else 0,
+        }
+        source = "messages"
+    else:
+        writes = [
+            (session_ref.collection("messages").document(m["id"]),
+             {"author": m["author"], "text": m["text"], "timestamp": m["timestamp"]})
+            for m in messages
+        ]
+        flip = {
+            "messageLayout": LAYOUT_DOCS,
+            "chunkSeq": firestore.DELETE_FIELD,
+            "chunkCount": firestore.DELETE_FIELD,
+            "chunkBytes": firestore.DELETE_FIELD,
+        }
+        source = "chunks"
+
+    if not dry_run:
+        _commit_in_batches(db, writes, (session_ref, flip))
+        if not keep_source:
+            message_store.delete_messages(db, user_id, session_id, collections=(source,))
+    return len(messages), len(writes) + 1
+
+
+def cleanup_session(db, user_id, session_id, session_data, dry_run=False):
+    """Delete documents of the layout a session is no longer using. Returns documents deleted."""
+    state = message_store.layout_state(session_data)
+    stale = "messages" if state["layout"] == LAYOUT_CHUNKED else "chunks"
+    if dry_run:
+        session_ref = message_store.session_ref(db, user_id, session_id)
+        return sum(1 for _ in session_ref.collection(stale).select([]).stream())
+    return message_store.delete_messages(db, user_id, session_id, collections=(stale,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert chat sessions between message storage layouts")
+    parser.add_argument("--to", choices=[LAYOUT_CHUNKED, LAYOUT_DOCS], default=LAYOUT_CHUNKED,
+                        help="target layout (default: chunked)")
+    parser.add_argument("--uid", action="append", help="only migrate this user (repeatable); default: all users")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--keep-source", action="store_true", help="leave the old documents in place")
+    mode.add_argument("--cleanup", action="store_true",
+                      help="only delete documents left over from an earlier --keep-source run")
+    args = parser.parse_args()
+
+    initialize_firebase()
+    db = get_db()
+    user_ids = args.uid or [ref.id for ref in db.collection("users").list_documents()]
+
+    sessions = migrated = moved = written = deleted = 0
+    for user_id in user_ids:
+        for snapshot in db.collection("users").document(user_id).collection("sessions").stream():
+            sessions += 1
+            session_data = snapshot.to_dict() or {}
+            if args.cleanup:
+                deleted += cleanup_session(db, user_id, snapshot.id, session_data, args.dry_run)
+                continue
+            result = migrate_session(db, user_id, snapshot.id, session_data, args.to,
+                                     dry_run=args.dry_run, keep_source=args.keep_source)
+            if result is not None:
+                migrated += 1
+                moved += result[0]
+                written += result[1]
+                print(f"{user_id}/{snapshot.id}: {result[0]} messages -> {result[1]} documents")
+
+    prefix = "[dry run] " if args.dry_run else ""
+    if args.cleanup:
+        print(f"{prefix}{sessions} sessions scanned, {deleted} leftover documents deleted")
+    else:
+        print(f"{prefix}{sessions} sessions scanned, {migrated} migrated to '{args.to}': "
+              f"{moved} messages in {written} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,11 @@ from app.routes.flag import flag_bp
 from app.routes.pulse import pulse_bp
 from app.routes.user import user_bp
 from app.routes.history import history_bp  # New import for history blueprint
+from app.routes.metrics import metrics_bp
+from app.routes.deletion import deletion_bp
 from app.db import initialize_firebase
+from app.utils.session_store import create_session_interface
+from app.utils.write_queue import install_sigterm_exit
 
 # Flask app initialization (also serves built frontend from /app/static)
 app = Flask(__name__, static_folder='static', static_url_path='/')
@@ -29,18 +33,27 @@ app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'dev-secret-key-fo
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 app.config['SESSION_PERMANENT'] = True
 
+# Keep session data server-side; the cookie only carries an opaque id (SAKHI_SESSION_BACKEND)
+_session_interface = create_session_interface()
+if _session_interface is not None:
+    app.session_interface = _session_interface
+
 # CORS configuration: allow specific origins via ALLOWED_ORIGINS env (comma-separated)
 allowed_origins = os.environ.get('ALLOWED_ORIGINS')
 if allowed_origins:
     origins = [o.strip() for o in allowed_origins.split(',') if o.strip()]
-    CORS(app, resources={r"/api/*": {"origins": origins}}, supports_credentials=True)
+    CORS(app, resources={r"/api/*": {"origins": origins}}, supports_credentials=True,
+         expose_headers=['X-Next-Cursor'])
 else:
     # Dev friendly default; tighten in production by setting ALLOWED_ORIGINS
-    CORS(app, supports_credentials=True)
+    CORS(app, supports_credentials=True, expose_headers=['X-Next-Cursor'])
 
 # Initialize Firebase Admin SDK
 initialize_firebase()
 
+# Flush queued Firestore writes on SIGTERM under servers that don't handle it themselves
+install_sigterm_exit()
+
 # Generate a single server-run session id that lasts until the backend restarts
 SERVER_RUN_SESSION_ID = os.environ.get('SERVER_RUN_SESSION_ID') or str(uuid4())
 
@@ -57,6 +70,8 @@ app.register_blueprint(flag_bp, url_prefix='/api')
 app.register_blueprint(pulse_bp, url_prefix='/api')
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(history_bp, url_prefix='/api')  # Registering the new history blueprint
+app.register_blueprint(metrics_bp, url_prefix='/api')
+app.register_blueprint(deletion_bp, url_prefix='/api')
 
 @app.route('/')
 def index():
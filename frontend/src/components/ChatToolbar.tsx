@@ -3,7 +3,7 @@ import { useNavigate } from 'react-router-dom';
 import { Plus, Trash2, Pencil, ChevronLeft, ChevronRight, Home, Activity, Heart, LogOut } from 'lucide-react';
 import { firebaseAuth } from '../lib/firebase';
 import { ChatSession, deleteChatSession, listChatSessions, renameChatSession } from '../utils/indexeddb';
-import { getRemoteChatSessions } from '../lib/api';
+import { deleteRemoteChatSession, getRemoteChatSessions } from '../lib/api';
 import Logo from './Logo';
 
 interface ChatToolbarProps {
@@ -24,29 +24,32 @@ const ChatToolbar: React.FC<ChatToolbarProps> = ({
   const navigate = useNavigate();
   const [sessions, setSessions] = useState<ChatSession[]>([]);
   const [loading, setLoading] = useState(true);
+  // Cursor for the next page of remote sessions (null when everything is loaded)
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   // Check if user is logged in
   const isLoggedIn = () => !!firebaseAuth?.currentUser;
 
+  // Map remote sessions to match our ChatSession type
+  const toChatSessions = (data: any[]): ChatSession[] => data.map((session: any) => ({
+    id: session.id,
+    title: session.title || 'Untitled Chat',
+    createdAt: session.createdAt ? new Date(session.createdAt).getTime() : Date.now(),
+    updatedAt: session.updatedAt ? new Date(session.updatedAt).getTime() : Date.now()
+  }));
+
   // Load sessions based on authentication status
   const loadSessions = async () => {
     setLoading(true);
     
     try {
       if (isLoggedIn()) {
-        // Load remote sessions from Firebase if logged in
+        // Load the first page of remote sessions from Firebase if logged in
         const response = await getRemoteChatSessions();
         const data = await response.json();
-        
-        // Map the remote sessions to match our ChatSession type
-        const remoteSessions = data.map((session: any) => ({
-          id: session.id,
-          title: session.title || 'Untitled Chat',
-          createdAt: session.createdAt ? new Date(session.createdAt).getTime() : Date.now(),
-          updatedAt: session.updatedAt ? new Date(session.updatedAt).getTime() : Date.now()
-        }));
-        
-        setSessions(remoteSessions);
+        setSessions(toChatSessions(data));
+        setNextCursor(response.headers.get('X-Next-Cursor'));
       } else {
         // Load local sessions from IndexedDB if not logged in
         const localSessions = await listChatSessions();
@@ -60,6 +63,22 @@ const ChatToolbar: React.FC<ChatToolbarProps> = ({
     }
   };
 
+  // Append the next page of remote sessions
+  const loadMoreSessions = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const response = await getRemoteChatSessions(nextCursor);
+      const data = await response.json();
+      setSessions(prev => [...prev, ...toChatSessions(data).filter(s => !prev.some(p => p.id === s.id))]);
+      setNextCursor(response.headers.get('X-Next-Cursor'));
+    } catch (err) {
+      console.error('Failed to load more sessions', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Initial load of sessions
   useEffect(() => {
     loadSessions();
@@ -100,15 +119,19 @@ const ChatToolbar: React.FC<ChatToolbarProps> = ({
   const handleDelete = async (id: string) => {
     if (!confirm('Are you sure you want to delete this chat?')) return;
     
-    if (isLoggedIn()) {
-      // For remote sessions, we would need to implement this
-      alert('Deleting remote sessions is not implemented yet');
-    } else {
-      await deleteChatSession(id);
+    try {
+      if (isLoggedIn()) {
+        await deleteRemoteChatSession(id);
+      } else {
+        await deleteChatSession(id);
+      }
       if (activeId === id) {
         navigate('/chat');
         onSelect(null);
       }
+    } catch (err) {
+      console.error('Failed to delete chat', err);
+      alert('Could not delete this chat. Please try again.');
     }
     
     await loadSessions();
@@ -239,6 +262,15 @@ const ChatToolbar: React.FC<ChatToolbarProps> = ({
                   )}
                 </div>
               ))}
+              {isOpen && nextCursor && (
+                <button
+                  onClick={loadMoreSessions}
+                  disabled={loadingMore}
+                  className="w-full text-xs text-white/70 hover:text-white p-2 rounded-md hover:bg-accentDark/30 transition-colors"
+                >
+                  {loadingMore ? 'Loading...' : 'Load older chats'}
+                </button>
+              )}
             </div>
           )}
         </div>
@@ -1,11 +1,12 @@
-// TrendChart.tsx: A component for displaying a 7-day mood trend chart.
-import { useState } from 'react';
+// TrendChart.tsx: A component for displaying mood trend charts (the last 7 days, or longer ranges from the cloud).
+import { useEffect, useState } from 'react';
 import { motion } from 'framer-motion';
 import { 
   LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, 
   ResponsiveContainer, ReferenceLine, ReferenceArea, AreaChart, Area,
   PieChart, Pie, Cell, BarChart, Bar, LabelList
 } from 'recharts';
+import { getMoodSeries } from '../lib/api';
 
 // Define the type for the data points for type safety.
 type ChartData = {
@@ -140,10 +141,58 @@ const processDistributionData = (data: ChartData[]) => {
 // Chart types
 type ChartType = 'line' | 'area' | 'distribution';
 
+// Time ranges: the last 7 days come from the data prop; longer ranges are
+// fetched as a downsampled series (cloud users only)
+type Range = 'week' | 'month' | 'halfYear' | 'year';
+const SERIES_RESOLUTION: Record<Exclude<Range, 'week'>, 'day' | 'week' | 'month'> = {
+  month: 'day',     // 30 days
+  halfYear: 'week', // 26 weeks
+  year: 'month',    // 12 months
+};
+const RANGE_LABELS: Record<Range, string> = { week: '7D', month: '30D', halfYear: '6M', year: '1Y' };
+
+type SeriesPoint = { start: string; count: number; mean: number | null };
+
+// Label a series bucket by its start date (YYYY-MM-DD, UTC)
+const bucketLabel = (start: string, resolution: 'day' | 'week' | 'month') => {
+  const date = new Date(`${start}T00:00:00Z`);
+  return resolution === 'month'
+    ? date.toLocaleDateString(undefined, { month: 'short', timeZone: 'UTC' })
+    : date.toLocaleDateString(undefined, { month: 'short', day: 'numeric', timeZone: 'UTC' });
+};
+
 // This component renders a line chart using the Recharts library.
-// It is a presentational component that receives data as a prop.
-const TrendChart = ({ data }: { data: ChartData[] }) => {
+// It receives the last 7 days as a prop; with cloud set it also offers longer
+// ranges, read from /mood/cloud/series.
+const TrendChart = ({ data: weekData, cloud = false }: { data: ChartData[]; cloud?: boolean }) => {
   const [chartType, setChartType] = useState<ChartType>('line');
+  const [range, setRange] = useState<Range>('week');
+  const [seriesData, setSeriesData] = useState<ChartData[] | null>(null);
+
+  // Fetch the series for a longer range
+  useEffect(() => {
+    if (range === 'week' || !cloud) {
+      setSeriesData(null);
+      return;
+    }
+    let cancelled = false;
+    const resolution = SERIES_RESOLUTION[range];
+    getMoodSeries(resolution)
+      .then((series) => {
+        if (cancelled) return;
+        setSeriesData((series.points as SeriesPoint[]).map((p) => ({
+          day: bucketLabel(p.start, resolution),
+          score: p.mean === null ? null : Math.round(p.mean * 10) / 10,
+        })));
+      })
+      .catch((error) => {
+        console.error('Failed to load mood series:', error);
+        if (!cancelled) setRange('week');
+      });
+    return () => { cancelled = true; };
+  }, [range, cloud]);
+
+  const data = range !== 'week' && cloud && seriesData ? seriesData : weekData;
   
   // Process data for distribution chart
   const distributionData = processDistributionData(data);
@@ -437,8 +486,24 @@ const TrendChart = ({ data }: { data: ChartData[] }) => {
       initial="hidden"
       animate="show"
     >
-      {/* Chart Type Selector */}
-      <div className="flex justify-end mb-4">
+      {/* Range and Chart Type Selectors */}
+      <div className="flex justify-end gap-2 mb-4">
+        {cloud && (
+          <div className="bg-gray-100 p-1 rounded-lg inline-flex">
+            {(Object.keys(RANGE_LABELS) as Range[]).map((r) => (
+              <motion.button
+                key={r}
+                className="px-3 py-1 rounded-lg text-sm font-medium"
+                animate={range === r ? 'active' : 'inactive'}
+                variants={buttonVariants}
+                whileTap={{ scale: 0.95 }}
+                onClick={() => setRange(r)}
+              >
+                {RANGE_LABELS[r]}
+              </motion.button>
+            ))}
+          </div>
+        )}
         <div className="bg-gray-100 p-1 rounded-lg inline-flex">
           <motion.button
             className="px-3 py-1 rounded-lg text-sm font-medium"
@@ -140,6 +140,33 @@ export const getMoodStats = async (days: number = 7) => {
   return response.json();
 };
 
+// Get a mood time series for charts: a fixed number of day/week/month buckets
+// ending now, each with count, mean, min, max and p25/p50/p75/p90 (null when empty)
+export const getMoodSeries = async (resolution: 'day' | 'week' | 'month' = 'day', buckets?: number) => {
+  const query = buckets ? `&buckets=${buckets}` : '';
+  const response = await authenticatedRequest(`/mood/cloud/series?resolution=${resolution}${query}`);
+  return response.json();
+};
+
+// Delta sync for the local mood cache: applies queued local changes and returns
+// everything changed or deleted remotely since the `since` token, plus the next token
+export type MoodMutation = {
+  clientId: string;
+  op: 'upsert' | 'delete';
+  id?: string;
+  entry?: {
+    label?: string; score?: number; journal?: string; themes?: string[]; source?: 'manual' | 'chat'; timestamp?: number;
+  };
+};
+
+export const syncMoods = async (since: string | null, mutations: MoodMutation[]) => {
+  const response = await authenticatedRequest('/mood/cloud/sync', {
+    method: 'POST',
+    body: JSON.stringify({ since: since || undefined, mutations }),
+  });
+  return response.json();
+};
+
 // Function to flag crisis
 export const flagCrisis = async (payload: { session_id: string; reason: string }) => {
   const response = await fetch(`${API_BASE_URL}/flag`, {
@@ -290,10 +317,11 @@ export async function registerUser(profile: {
 /**
  * Create a new chat with the first message
  * This combines creating a session and sending the first message in one call
- * The backend will generate a title automatically based on the first message
+ * The backend returns a quick local title and refines it with AI in the background
+ * (titleSource goes from 'heuristic' to 'generated'; see waitForGeneratedTitle)
  * 
  * @param message The first message to send in the chat
- * @returns Promise with sessionId, title, and initialResponse
+ * @returns Promise with sessionId, title, titleSource, and initialResponse
  */
 export const createNewChat = async (message: string) => {
   return await authenticatedRequest('/chat/new', {
@@ -302,6 +330,25 @@ export const createNewChat = async (message: string) => {
   });
 };
 
+/**
+ * Poll a new session until its AI-generated title is saved
+ * @param sessionId ID of the chat session
+ * @returns The generated title, or null if it did not arrive in time
+ */
+export const waitForGeneratedTitle = async (sessionId: string, attempts = 5, intervalMs = 1500): Promise<string | null> => {
+  for (let i = 0; i < attempts; i++) {
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+    try {
+      const response = await authenticatedRequest(`/chat/${sessionId}/title`);
+      const data = await response.json();
+      if (data.titleSource === 'generated' && data.title) return data.title;
+    } catch {
+      // Not there yet (or transient error); keep polling
+    }
+  }
+  return null;
+};
+
 /**
  * Create a new remote chat session
  * @param title Title of the chat session
@@ -314,18 +361,25 @@ export const createRemoteChatSession = async (title: string) => {
 };
 
 /**
- * Get all remote chat sessions for the user
+ * Get one page of the user's remote chat sessions, most recently updated first
+ * @param cursor Token from the previous page's X-Next-Cursor header (omit for the first page)
  */
-export const getRemoteChatSessions = async () => {
-    return await authenticatedRequest('/history/sessions');
+export const getRemoteChatSessions = async (cursor?: string | null) => {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    return await authenticatedRequest(`/history/sessions${query}`);
 };
 
 /**
- * Get messages for a specific remote chat session
+ * Get one page of messages for a remote chat session: the newest page first,
+ * then older pages by passing the X-Next-Cursor header of the previous one
  * @param sessionId ID of the chat session
+ * @param before Cursor from the previous (newer) page, omitted for the newest page
+ * @param limit Page size
  */
-export const getRemoteMessages = async (sessionId: string) => {
-    return await authenticatedRequest(`/history/messages/${sessionId}`);
+export const getRemoteMessages = async (sessionId: string, before?: string | null, limit = 50) => {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (before) params.set('before', before);
+    return await authenticatedRequest(`/history/messages/${sessionId}?${params.toString()}`);
 };
 
 /**
@@ -349,3 +403,92 @@ export const deleteRemoteChatSession = async (sessionId: string) => {
         method: 'DELETE'
     });
 };
+
+/**
+ * Start a background job purging all of the user's stored data
+ * (chats, moods, profile). The Firebase account itself is not deleted.
+ * @returns Response with { jobId }; see waitForDeletionJob
+ */
+export const deleteAccountData = async () => {
+    return await authenticatedRequest('/deletions/account', {
+        method: 'POST',
+        body: JSON.stringify({ confirm: true })
+    });
+};
+
+/**
+ * Get the status of a deletion job: queued, running, done or failed
+ * @param jobId ID returned when the job was started
+ */
+export const getDeletionJob = async (jobId: string) => {
+    return await authenticatedRequest(`/deletions/${jobId}`);
+};
+
+/**
+ * Poll a deletion job until it finishes
+ * @param jobId ID returned when the job was started
+ * @param onProgress Called with each status read (sessionsDone, deletedDocs, ...)
+ * @returns The final job status ('done' or 'failed'), or null if it did not finish in time
+ */
+export const waitForDeletionJob = async (
+    jobId: string,
+    onProgress?: (job: any) => void,
+    attempts = 120,
+    intervalMs = 1500
+): Promise<any | null> => {
+    for (let i = 0; i < attempts; i++) {
+        try {
+            const job = await (await getDeletionJob(jobId)).json();
+            onProgress?.(job);
+            if (job.status === 'done' || job.status === 'failed') return job;
+        } catch {
+            // Transient error; keep polling
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+    return null;
+};
+
+/**
+ * Send a message to a remote chat session and stream the reply (Server-Sent Events)
+ * @param sessionId ID of the chat session
+ * @param message The message content
+ * @param onToken Called with each chunk of reply text as it arrives
+ * @returns Promise with the final response (reply, mood, is_crisis, resources, ...)
+ */
+export const streamRemoteMessage = async (
+    sessionId: string,
+    message: string,
+    onToken: (text: string) => void
+) => {
+    const response = await authenticatedRequest('/chat/stream', {
+        method: 'POST',
+        body: JSON.stringify({ sessionId, message }),
+    });
+    const reader = response.body?.getReader();
+    if (!reader) {
+        throw new Error('Streaming not supported');
+    }
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let final: any = null;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep = buffer.indexOf('\n\n');
+        while (sep !== -1) {
+            const frame = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            const event = /^event: (.*)$/m.exec(frame)?.[1];
+            const data = /^data: (.*)$/m.exec(frame)?.[1];
+            if (data) {
+                const payload = JSON.parse(data);
+                if (event === 'token') onToken(payload.text);
+                else if (event === 'done') final = payload;
+            }
+            sep = buffer.indexOf('\n\n');
+        }
+    }
+    return final;
+};
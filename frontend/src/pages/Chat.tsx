@@ -1,10 +1,11 @@
-import React, { useState, useRef, useEffect } from 'react';
+import React, { useState, useRef, useEffect, useLayoutEffect } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import ChatBubble from '../components/ChatBubble';
 import ChatToolbar from '../components/ChatToolbar';
 import { 
   createNewChat, 
-  sendRemoteMessage, 
+  waitForGeneratedTitle,
+  streamRemoteMessage, 
   getRemoteMessages,
   getServerSession,
   sendMessage
@@ -39,19 +40,38 @@ const Chat: React.FC = () => {
   const [user, setUser] = useState<FirebaseUser>(null);
   const [refreshTrigger, setRefreshTrigger] = useState(0);
   const [musicOn, setMusicOn] = useState(false);
+  // Cursor for the next older page of remote messages (null once the start is loaded)
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   
   // References
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const chatContainerRef = useRef<HTMLDivElement>(null);
   const inputRef = useRef<HTMLInputElement>(null);
   const audioRef = useRef<HTMLAudioElement | null>(null);
+  // Scroll height before older messages were prepended, to keep the view in place
+  const prependHeightRef = useRef<number | null>(null);
+  // True until a session's first messages are shown and scrolled to instantly;
+  // older pages don't load before then
+  const initialScrollRef = useRef(true);
   
   // Music toggle function
   const handleMusicToggle = () => setMusicOn((prev) => !prev);
 
-  // Auto-scroll to bottom when messages change
-  useEffect(() => {
-    messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
+  // Auto-scroll to bottom when messages change, or keep the view in place
+  // when older messages were prepended
+  useLayoutEffect(() => {
+    const container = chatContainerRef.current;
+    if (prependHeightRef.current !== null && container) {
+      container.scrollTop += container.scrollHeight - prependHeightRef.current;
+      prependHeightRef.current = null;
+      return;
+    }
+    // Jump straight to the bottom of a freshly opened session: a smooth scroll
+    // would pass the top and trigger the older-page loader on the way
+    const behavior = initialScrollRef.current ? 'auto' : 'smooth';
+    if (messages.length > 0) initialScrollRef.current = false;
+    messagesEndRef.current?.scrollIntoView({ behavior });
   }, [messages]);
   
   // Handle music playback
@@ -75,9 +95,19 @@ const Chat: React.FC = () => {
     return () => unsubscribe();
   }, []);
 
+  // Map remote messages to our Message type
+  const toMessages = (data: any[]): Message[] => data.map((msg: any) => ({
+    id: msg.id,
+    role: msg.author === 'user' ? 'user' : 'model',
+    content: msg.text,
+    timestamp: new Date(msg.timestamp).getTime()
+  }));
+
   // Load messages when session ID changes
   useEffect(() => {
     const loadMessages = async () => {
+      setOlderCursor(null);
+      initialScrollRef.current = true;
       // Clear messages when no session ID is present
       if (!sessionId) {
         setMessages([]);
@@ -89,16 +119,13 @@ const Chat: React.FC = () => {
       
       try {
         if (user) {
-          // Load remote messages for authenticated users
+          // Load the newest page of remote messages for authenticated users;
+          // older pages load as the user scrolls up
           const response = await getRemoteMessages(sessionId);
           const data = await response.json();
           
-          setMessages(data.map((msg: any) => ({
-            id: msg.id,
-            role: msg.author === 'user' ? 'user' : 'model',
-            content: msg.text,
-            timestamp: new Date(msg.timestamp).getTime()
-          })));
+          setMessages(toMessages(data));
+          setOlderCursor(response.headers.get('X-Next-Cursor'));
         } else {
           // Load local messages for guest users
           const localMessages = await getChatMessages(sessionId);
@@ -120,6 +147,30 @@ const Chat: React.FC = () => {
     loadMessages();
   }, [sessionId, user, navigate]);
 
+  // Prepend the next older page of remote messages
+  const loadOlderMessages = async () => {
+    if (!sessionId || !user || !olderCursor || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const response = await getRemoteMessages(sessionId, olderCursor);
+      const data = await response.json();
+      prependHeightRef.current = chatContainerRef.current?.scrollHeight ?? null;
+      setMessages(prev => [...toMessages(data), ...prev]);
+      setOlderCursor(response.headers.get('X-Next-Cursor'));
+    } catch (error) {
+      console.error('Failed to load older messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
+  // Load older messages when the user scrolls near the top
+  const handleMessagesScroll = (e: React.UIEvent<HTMLDivElement>) => {
+    if (!initialScrollRef.current && e.currentTarget.scrollTop < 80) {
+      loadOlderMessages();
+    }
+  };
+
   // Handle sending messages
   const handleSendMessage = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -152,7 +203,7 @@ const Chat: React.FC = () => {
           try {
             // Create a new chat session with the first message
             const response = await createNewChat(message);
-            const { sessionId: newSessionId, initialResponse } = await response.json();
+            const { sessionId: newSessionId, titleSource, initialResponse, is_crisis } = await response.json();
             
             // Update URL to include the session ID
             navigate(`/chat/${newSessionId}`, { replace: true });
@@ -171,6 +222,14 @@ const Chat: React.FC = () => {
             
             // Refresh the sidebar to show the new chat
             setRefreshTrigger(prev => prev + 1);
+
+            // Refresh it again once the AI title replaces the quick one
+            // (crisis turns are never titled, so there is nothing to wait for)
+            if (titleSource === 'heuristic' && !is_crisis) {
+              waitForGeneratedTitle(newSessionId).then(title => {
+                if (title) setRefreshTrigger(prev => prev + 1);
+              });
+            }
           } catch (error) {
             console.error('Failed to create new chat:', error);
             // Show error in UI
@@ -188,19 +247,23 @@ const Chat: React.FC = () => {
         } else {
           // Subsequent message in existing conversation
           try {
-            const response = await sendRemoteMessage(sessionId, message);
-            const data = await response.json();
-            
-            // Add the bot response
-            const botMessage: Message = {
-              id: `model_${Date.now()}`,
-              role: 'model',
-              content: data.reply || data.text,
-              timestamp: Date.now(),
-              animate: true
-            };
-            
-            setMessages(prev => [...prev, botMessage]);
+            // Show the reply as it streams in, in a bubble added with the first token
+            const botMessageId = `model_${Date.now()}`;
+            let streamed = '';
+            const setBotContent = (content: string) => setMessages(prev => (
+              prev.some(m => m.id === botMessageId)
+                ? prev.map(m => (m.id === botMessageId ? { ...m, content } : m))
+                : [...prev, { id: botMessageId, role: 'model', content, timestamp: Date.now(), animate: true }]
+            ));
+            const data = await streamRemoteMessage(sessionId, message, text => {
+              streamed += text;
+              setBotContent(streamed);
+            });
+            if (!data) {
+              throw new Error('Stream ended without a reply');
+            }
+            // The final reply is what gets stored; it replaces the streamed text
+            setBotContent(data.reply || data.text || streamed);
           } catch (error) {
             console.error('Failed to send message:', error);
             // Show error in UI
@@ -360,9 +423,13 @@ const Chat: React.FC = () => {
         {/* Chat Messages */}
         <div 
           ref={chatContainerRef}
+          onScroll={handleMessagesScroll}
           className="flex-1 overflow-y-auto p-4 space-y-4 scrollbar-hide"
           style={{ scrollbarWidth: 'none', msOverflowStyle: 'none' }}
         >
+          {loadingOlder && (
+            <div className="text-center text-xs text-textSubtle">Loading earlier messages...</div>
+          )}
           {/* Welcome message when no messages exist */}
           {messages.length === 0 && (
             <div className="flex flex-col items-center justify-center h-full text-center p-8">
@@ -2,11 +2,14 @@
 import { useEffect, useMemo, useRef, useState } from 'react';
 // import { motion } from 'framer-motion';
 import useSession from '../hooks/useSession';
-import { reportPulse, saveMoodToCloud, getCloudMoodHistory, getMoodStats, deleteMoodEntry } from '../lib/api';
+import { reportPulse, getMoodStats } from '../lib/api';
 import TrendChart from '../components/TrendChart';
 import MoodPicker from '../components/MoodPicker';
 import JournalEntry from '../components/JournalEntry';
-import { getLast7Days, addSnapshot, clearAll, isPersistenceEnabled, enablePersistence, disablePersistence } from '../utils/indexeddb';
+import {
+  getLast7Days, addSnapshot, clearAll, deleteAllSnapshots, syncMoodCache,
+  isPersistenceEnabled, enablePersistence, disablePersistence,
+} from '../utils/indexeddb';
 import { getMoodHistory } from '../lib/api';
 import BreathTimer from '../components/BreathTimer';
 import Sidebar from '../components/Sidebar';
@@ -77,19 +80,12 @@ const Mood = () => {
     
     // Get mood data based on selected source
     if (useCloudStorage && isAuthenticated) {
-      // Use cloud storage (Firestore) if authenticated
+      // Use cloud storage (Firestore) if authenticated: one sync round trip
+      // pushes local edits and brings the local cache up to date
       setLoadingCloud(true);
       try {
-        const cloudData = await getCloudMoodHistory(7);
-        entries = cloudData.history.map((entry: any) => ({
-          id: entry.id,
-          timestamp: new Date(entry.timestamp).getTime(),
-          label: entry.label,
-          score: entry.score,
-          source: entry.source || 'manual',
-          journal: entry.journal,
-          themes: entry.themes || []
-        }));
+        await syncMoodCache();
+        entries = await getLast7Days();
         
         // Also try to get stats directly from the cloud
         try {
@@ -118,8 +114,8 @@ const Mood = () => {
           // We'll calculate stats locally as fallback
         }
       } catch (error) {
-        console.error('Failed to load mood data from cloud:', error);
-        // Fall back to local data
+        console.error('Failed to sync mood data with the cloud:', error);
+        // Fall back to local data; unsynced changes go up with the next sync
         entries = await getLast7Days();
       } finally {
         setLoadingCloud(false);
@@ -298,6 +294,15 @@ const Mood = () => {
     load();
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [filter, useCloudStorage]);
+
+  // Sync changes made offline once the connection is back
+  useEffect(() => {
+    if (!(useCloudStorage && isAuthenticated)) return;
+    const onOnline = () => { load(); };
+    window.addEventListener('online', onOnline);
+    return () => window.removeEventListener('online', onOnline);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [useCloudStorage, isAuthenticated, filter]);
   
   // Toggle persistence setting
   const togglePersistence = () => {
@@ -311,28 +316,17 @@ const Mood = () => {
   };
 
   const handleSave = async (journal: string) => {
-    // Save to local database
+    // Save to local database, marked for the cloud if the user is authenticated
+    // and has cloud storage enabled
+    const cloud = isAuthenticated && useCloudStorage;
     await addSnapshot({ 
       label: selected.label, 
       score: selected.score,
       journal: journal.trim() ? journal : undefined,
+      themes: selectedThemes.length > 0 ? selectedThemes : undefined,
       source: 'manual'
-    });
+    }, { sync: cloud });
     
-    // Also save to cloud if the user is authenticated and has cloud storage enabled
-    if (isAuthenticated && useCloudStorage) {
-      try {
-        await saveMoodToCloud({
-          label: selected.label,
-          score: selected.score,
-          journal: journal.trim() || undefined,
-          source: 'manual',
-          themes: selectedThemes.length > 0 ? selectedThemes : undefined
-        });
-      } catch (error) {
-        console.error('Error saving mood to cloud:', error);
-      }
-    }
     // Report to Pulse if opted in (no raw text, only score + themes)
     try {
       if (pulseOptIn && sessionId) {
@@ -347,6 +341,7 @@ const Mood = () => {
       // Non-blocking; ignore errors in UI
       console.warn('Pulse report failed', e);
     }
+    // load() syncs, which pushes the new entry to the cloud
     await load();
   };
 
@@ -356,21 +351,16 @@ const Mood = () => {
         return;
       }
       try {
-        const history = await getCloudMoodHistory(100);
-        if (history && history.history) {
-          // Delete each mood entry from the cloud
-          for (const entry of history.history) {
-            if (entry.id) {
-              await deleteMoodEntry(entry.id);
-            }
-          }
-        }
+        // Bring every cloud entry into the local cache, so each one gets its delete queued
+        await syncMoodCache();
       } catch (error) {
-        console.error('Error clearing cloud mood entries:', error);
+        console.error('Error syncing before clearing cloud mood entries:', error);
       }
+      // Queued deletes are pushed by the sync in load(), or the next one if that fails
+      await deleteAllSnapshots();
+    } else {
+      await clearAll(); // Clear local storage entries
     }
-    
-    await clearAll(); // Clear local storage entries
     await load();  // Reload entries
   };
 
@@ -688,7 +678,7 @@ const Mood = () => {
         <div className="lg:col-span-2 space-y-4 sm:space-y-6 overflow-x-hidden">
           <div className="bg-white/90 p-3 sm:p-4 md:p-6 rounded-3xl shadow-lg transition-transform duration-300 hover:shadow-lg hover:-translate-y-0.5 overflow-hidden">
             <div className="overflow-x-hidden w-full">
-              <TrendChart data={data.map(d => ({ day: d.day, score: d.score ?? null, manualScore: (d as any).manualScore ?? undefined, chatScore: (d as any).chatScore ?? undefined }))} />
+              <TrendChart data={data.map(d => ({ day: d.day, score: d.score ?? null, manualScore: (d as any).manualScore ?? undefined, chatScore: (d as any).chatScore ?? undefined }))} cloud={useCloudStorage && isAuthenticated} />
             </div>
             <div className="text-xs sm:text-sm text-gray-600 mt-2 sm:mt-3">
               <p>The chart shows your average mood score for each day (scale of 1–10).</p>
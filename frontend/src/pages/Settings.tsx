@@ -1,11 +1,67 @@
+import { useEffect, useState } from 'react';
 import { Link } from 'react-router-dom';
+import { onAuthChange, FirebaseUser } from '../lib/firebase';
+import { deleteAccountData, waitForDeletionJob } from '../lib/api';
+import { clearAll } from '../utils/indexeddb';
 
 const Settings = () => {
+  const [user, setUser] = useState<FirebaseUser>(null);
+  // Progress of a "delete my data" request, shown under the button
+  const [deleteStatus, setDeleteStatus] = useState<string | null>(null);
+  const [deleting, setDeleting] = useState(false);
+
+  useEffect(() => {
+    const unsubscribe = onAuthChange(setUser);
+    return () => unsubscribe();
+  }, []);
+
+  // Purge everything stored for the user (chats, moods, profile) as a background job
+  const handleDeleteData = async () => {
+    if (!confirm('This permanently deletes all your chats, mood entries and profile data. Continue?')) return;
+    setDeleting(true);
+    setDeleteStatus('Starting…');
+    try {
+      const { jobId } = await (await deleteAccountData()).json();
+      const job = await waitForDeletionJob(jobId, (j) => {
+        setDeleteStatus(`Deleting… ${j.deletedDocs ?? 0} items removed`);
+      });
+      if (job?.status === 'done') {
+        await clearAll(); // Drop the local mood cache too
+        setDeleteStatus(`All your data was deleted (${job.deletedDocs} items).`);
+      } else if (job?.status === 'failed') {
+        setDeleteStatus('Deleting your data failed. Please try again.');
+      } else {
+        setDeleteStatus('Deletion is still running. Check back in a few minutes.');
+      }
+    } catch (error) {
+      console.error('Failed to delete account data:', error);
+      setDeleteStatus('Could not start the deletion. Please try again.');
+    } finally {
+      setDeleting(false);
+    }
+  };
+
   return (
     <div className="min-h-screen bg-background flex flex-col items-center justify-center p-6">
       <div className="bg-white rounded-xl shadow border border-border max-w-lg w-full p-8 text-center">
         <h1 className="text-2xl font-semibold text-main mb-2">Settings</h1>
         <p className="text-subtle mb-6">This is a placeholder. Configure app preferences here later.</p>
+        {user && (
+          <div className="border-t border-border pt-6 mb-6">
+            <h2 className="text-lg font-semibold text-main mb-2">Your data</h2>
+            <p className="text-subtle text-sm mb-4">
+              Delete every chat, mood entry and profile detail stored for your account. Your sign-in stays.
+            </p>
+            <button
+              className="px-4 py-2 rounded-lg bg-red-600 text-white text-sm font-medium hover:bg-red-700 disabled:opacity-50"
+              onClick={handleDeleteData}
+              disabled={deleting}
+            >
+              Delete my data
+            </button>
+            {deleteStatus && <p className="text-sm text-subtle mt-3">{deleteStatus}</p>}
+          </div>
+        )}
         <Link to="/" className="text-accentDark hover:text-accentDark/80">Back to Home</Link>
       </div>
     </div>
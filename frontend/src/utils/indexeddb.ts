@@ -1,5 +1,6 @@
 // indexeddb.ts: A utility for interacting with IndexedDB for ephemeral client-side storage.
 import { openDB, DBSchema } from 'idb';
+import { syncMoods, MoodMutation } from '../lib/api';
 
 
 // This file provides a simple interface for storing and retrieving mood data
@@ -31,9 +32,16 @@ interface SakhiDB extends DBSchema {
       label: string;
       score: number;
       journal?: string;
+      themes?: string[];
       source?: 'manual' | 'chat'; // Indicates if entry is from manual input or chat detection
+      remoteId?: string; // Firestore id once synced
+      dirty?: boolean; // Changed locally since the last sync
     };
-    indexes: { 'timestamp': number };
+    indexes: { 'timestamp': number; 'remoteId': string };
+  };
+  mood_deletions: {
+    key: string; // remoteId of an entry deleted locally, until the next sync
+    value: { remoteId: string };
   };
   chat_sessions: {
     key: string; // sessionId (uuid)
@@ -58,8 +66,8 @@ interface SakhiDB extends DBSchema {
   };
 }
 
-const dbPromise = openDB<SakhiDB>('sakhi-journal', 2, {
-  upgrade(db, oldVersion) {
+const dbPromise = openDB<SakhiDB>('sakhi-journal', 3, {
+  upgrade(db, oldVersion, _newVersion, transaction) {
     if (oldVersion < 1) {
       const store = db.createObjectStore('moods', {
         keyPath: 'id',
@@ -76,22 +84,30 @@ const dbPromise = openDB<SakhiDB>('sakhi-journal', 2, {
       m.createIndex('sessionId', 'sessionId');
       m.createIndex('sessionId_timestamp', ['sessionId', 'timestamp']);
     }
+    if (oldVersion < 3) {
+      // cloud sync bookkeeping
+      transaction.objectStore('moods').createIndex('remoteId', 'remoteId');
+      db.createObjectStore('mood_deletions', { keyPath: 'remoteId' });
+    }
   },
 });
 
 // An inline arrow function to add a mood snapshot.
+// With sync, the snapshot is pushed to the cloud by the next syncMoodCache();
+// without it, it stays on this device.
 export const addSnapshot = async (snapshot: { 
   label: string; 
   score: number; 
   journal?: string;
+  themes?: string[];
   source?: 'manual' | 'chat';
-}) => {
+}, { sync = false }: { sync?: boolean } = {}) => {
   // Ensure score is clamped between 1-10
   const score = Math.max(1, Math.min(10, snapshot.score));
   const db = await dbPromise;
   // Default source to 'manual' if not specified
   const source = snapshot.source || 'manual';
-  return db.add('moods', { ...snapshot, score, source, timestamp: Date.now() });
+  return db.add('moods', { ...snapshot, score, source, timestamp: Date.now(), dirty: sync });
 };
 
 // An inline arrow function to get mood snapshots from the last 7 days.
@@ -107,6 +123,11 @@ export const getLast7Days = async () => {
 // An inline arrow function to clear all journal entries.
 export const clearAll = async () => {
     const db = await dbPromise;
+    await db.clear('mood_deletions');
+    if (typeof window !== 'undefined') {
+        // An emptied cache needs a full sync next time
+        window.localStorage.removeItem(MOOD_SYNC_TOKEN_KEY);
+    }
     return db.clear('moods');
 };
 
@@ -222,3 +243,139 @@ export const getActiveChatId = (): string | null => {
   }
   return null;
 };
+
+// ---------------- Cloud sync helpers ----------------
+// The local mood cache syncs with Firestore in one round trip: entries added or
+// edited here are marked dirty, deletions of synced entries are queued in
+// mood_deletions, and POST /mood/cloud/sync pushes both and returns what
+// changed remotely since the last token.
+
+const MOOD_SYNC_TOKEN_KEY = 'mood-sync-token';
+const MOOD_SYNC_DEVICE_KEY = 'mood-sync-device';
+// Mutations per request (the server's SAKHI_SYNC_MAX_MUTATIONS default)
+const MOOD_SYNC_MAX_MUTATIONS = 500;
+
+// Client ids must be unique per device, since local ids restart in every browser
+const syncDeviceId = (): string => {
+  let device = window.localStorage.getItem(MOOD_SYNC_DEVICE_KEY);
+  if (!device) {
+    device = uuidv4();
+    window.localStorage.setItem(MOOD_SYNC_DEVICE_KEY, device);
+  }
+  return device;
+};
+
+// Delete a local entry, queueing the remote delete if it was already synced
+export const deleteSnapshot = async (id: number): Promise<void> => {
+  const db = await dbPromise;
+  const entry = await db.get('moods', id);
+  if (!entry) return;
+  if (entry.remoteId) {
+    await db.put('mood_deletions', { remoteId: entry.remoteId });
+  }
+  await db.delete('moods', id);
+};
+
+// Delete every local entry, queueing the remote deletes of synced ones
+export const deleteAllSnapshots = async (): Promise<void> => {
+  const db = await dbPromise;
+  for (const key of await db.getAllKeys('moods')) {
+    await deleteSnapshot(key);
+  }
+};
+
+type RemoteMood = {
+  id: string;
+  timestamp?: string;
+  label: string;
+  score: number;
+  journal?: string;
+  themes?: string[];
+  source?: 'manual' | 'chat';
+};
+
+// Push local changes and pull remote ones. Returns the number of entries changed locally.
+export const syncMoodCache = async (): Promise<number> => {
+  const db = await dbPromise;
+  const device = syncDeviceId();
+  const pendingDirty = (await db.getAll('moods')).filter((m) => m.dirty);
+  const pendingDeletions = await db.getAll('mood_deletions');
+  // Larger backlogs (a cleared history) go up over several requests
+  const dirty = pendingDirty.slice(0, MOOD_SYNC_MAX_MUTATIONS);
+  const deletions = pendingDeletions.slice(0, MOOD_SYNC_MAX_MUTATIONS - dirty.length);
+  const mutations: MoodMutation[] = [
+    ...dirty.map((m): MoodMutation => ({
+      clientId: `${device}:${m.id}`,
+      op: 'upsert',
+      id: m.remoteId,
+      entry: {
+        label: m.label, score: m.score, journal: m.journal, themes: m.themes, source: m.source, timestamp: m.timestamp,
+      },
+    })),
+    ...deletions.map((d): MoodMutation => ({ clientId: `delete:${d.remoteId}`, op: 'delete', id: d.remoteId })),
+  ];
+
+  const result = await syncMoods(window.localStorage.getItem(MOOD_SYNC_TOKEN_KEY), mutations);
+  if (result.error) throw new Error(result.error);
+
+  const tx = db.transaction(['moods', 'mood_deletions'], 'readwrite');
+  const moods = tx.objectStore('moods');
+  const byClientId = new Map(dirty.map((m) => [`${device}:${m.id}`, m]));
+  for (const r of result.results as { clientId: string; id: string; status: string }[]) {
+    const local = byClientId.get(r.clientId);
+    if (!local) {
+      await tx.objectStore('mood_deletions').delete(r.id);
+    } else if (r.status === 'missing') {
+      // Deleted on another device: the deletion wins
+      await moods.delete(local.id!);
+    } else {
+      await moods.put({ ...local, remoteId: r.id, dirty: false });
+    }
+  }
+
+  let changed = 0;
+  const remoteIds = new Set<string>();
+  for (const remote of result.changed as RemoteMood[]) {
+    remoteIds.add(remote.id);
+    const local = await moods.index('remoteId').get(remote.id);
+    if (local?.dirty) continue; // Local edit made during the sync; pushed next time
+    await moods.put({
+      ...(local ?? {}),
+      timestamp: remote.timestamp ? Date.parse(remote.timestamp) : Date.now(),
+      label: remote.label,
+      score: remote.score,
+      journal: remote.journal,
+      themes: remote.themes,
+      source: remote.source,
+      remoteId: remote.id,
+      dirty: false,
+    });
+    changed += 1;
+  }
+  for (const remoteId of result.deleted as string[]) {
+    const key = await moods.index('remoteId').getKey(remoteId);
+    if (key !== undefined) {
+      await moods.delete(key);
+      changed += 1;
+    }
+  }
+  if (result.reset) {
+    // A full sync: synced entries the server no longer has were deleted remotely
+    for (const local of await moods.getAll()) {
+      if (local.remoteId && !local.dirty && !remoteIds.has(local.remoteId)) {
+        await moods.delete(local.id!);
+        changed += 1;
+      }
+    }
+  }
+  await tx.done;
+  window.localStorage.setItem(MOOD_SYNC_TOKEN_KEY, result.token);
+  if (pendingDirty.length + pendingDeletions.length > mutations.length) {
+    // Carry on while each request shrinks the backlog
+    const remaining = (await db.getAll('moods')).filter((m) => m.dirty).length + (await db.count('mood_deletions'));
+    if (remaining > 0 && remaining < pendingDirty.length + pendingDeletions.length) {
+      changed += await syncMoodCache();
+    }
+  }
+  return changed;
+};